@@ -0,0 +1,721 @@
+#!/usr/bin/python3
+
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from language import SymbolTable, SyntaxNodeTypes, SyntaxOnlyHelpers, walk
+from scanner import Scanner
+from dfa_scanner import DFAScanner
+from streaming import StreamingScanner
+from tokenbuffer import CompactScanner
+from mapped_source import MappedSource, MappedScanner
+from parallel_scanner import ParallelScanner
+from token_cache import TokenCache
+from incremental_scanner import IncrementalScanner
+from parser import Parser
+from iterative_parser import IterativeParser
+from precedence_parser import PrecedenceParser
+from tree_file import encode_program, ProgramFile
+from incremental_parser import IncrementalParser
+from parallel_parser import ParallelParser
+from scope_index import ScopeRecorder
+from symbol_index import SymbolIndex
+from semantic import SemanticAnalyzer
+from folding import ConstantFolder
+from interpreter import Interpreter
+from bytecode import compile_program, VirtualMachine
+from ir import build_program, IRInterpreter
+from optimizer import optimize_program, PASSES
+from loops import LoopOptimizer, loop_passes
+
+# Programs the execution backends are timed on, loops, recursion and array sweeps
+PROGRAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programs")
+
+# Body repeated to build large inputs, close to what our generators emit
+FUNCTION_TEMPLATE = [
+    "int func{0}(int a, b; char c){{\n",
+    "    int array{0}[10];\n",
+    "    int i = 0;\n",
+    "    bool done = false; // loop guard\n",
+    "    while(i < 10){{\n",
+    "        array{0}[i] = a * i + b;\n",
+    "        i++;\n",
+    "        if(i == b and not done){{\n",
+    "            break;\n",
+    "        }}\n",
+    "    }}\n",
+    "    return 'x';\n",
+    "}}\n",
+]
+
+# Expression heavy function, parsed without errors by every parser
+EXPRESSION_TEMPLATE = [
+    "int calc{0}(){{\n",
+    "    int a = 3;\n",
+    "    int b = 5;\n",
+    "    int x = 0;\n",
+    "    int y = 1;\n",
+    "    x = a * 2 + b * 3 - (a + b) / 4;\n",
+    "    y = x * x + a % 7 - b;\n",
+    "    while(x < y + 10){{\n",
+    "        x = x + y * 2 - a;\n",
+    "        if(x >= b * b){{\n",
+    "            break;\n",
+    "        }}\n",
+    "    }}\n",
+    "    return x;\n",
+    "}}\n",
+]
+
+def iter_source(functions):
+    for index in range(functions):
+        for line in FUNCTION_TEMPLATE:
+            yield line.format(index)
+
+def generate_source(functions):
+    return list(iter_source(functions))
+
+def time_scan(scanner_class, code):
+    symbol_table = SymbolTable()
+    scanner = scanner_class(code, symbol_table)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scanner.scan()
+    elapsed = time.perf_counter() - start
+    return scanner, elapsed
+
+def bench_scanner(args):
+    code = generate_source(args.functions)
+    size = sum(len(line) for line in code)
+    print("Source: {} lines, {} bytes".format(len(code), size))
+    reference = None
+    for name, scanner_class in [("classic", Scanner), ("dfa", DFAScanner)]:
+        best = None
+        for _ in range(args.repeat):
+            scanner, elapsed = time_scan(scanner_class, code)
+            best = elapsed if best is None else min(best, elapsed)
+        tokens = [(t.token_class, t.value, t.line, t.column) for t in scanner.tokens]
+        if reference is None:
+            reference = tokens
+        elif tokens != reference:
+            raise Exception("Scanner '{}' produced a different token stream".format(name))
+        print("{:>8}: {:>10.0f} tokens/s ({} tokens in {:.3f}s)".format(
+            name, len(tokens) / best, len(tokens), best))
+
+def drain(scanner):
+    count = 0
+    while scanner.see_next_token() is not None:
+        scanner.next_token()
+        count += 1
+    return count
+
+def bench_stream(args):
+    # Every generated function declares new names, so the symbol table (not
+    # the token pipeline) is what still grows in streaming mode
+    print("{:>10} {:>10} {:>8} {:>16} {:>16}".format(
+        "functions", "tokens", "ids", "list peak KiB", "stream peak KiB"))
+    for functions in args.sizes:
+        tracemalloc.start()
+        scanner = DFAScanner(generate_source(functions), SymbolTable())
+        scanner.scan()
+        count = drain(scanner)
+        list_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del scanner
+
+        tracemalloc.start()
+        # Lines are produced lazily, like reading an open file
+        symbol_table = SymbolTable()
+        drain(StreamingScanner(iter_source(functions), symbol_table))
+        stream_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:>10} {:>10} {:>8} {:>16.0f} {:>16.0f}".format(
+            functions, count, len(symbol_table.hashtable), list_peak / 1024, stream_peak / 1024))
+
+def bench_tokens(args):
+    # About 67 tokens per generated function
+    code = generate_source(args.tokens // 67 + 1)
+    print("{:>10} {:>10} {:>16}".format("storage", "tokens", "bytes/token"))
+    for name, scanner_class in [("Token", DFAScanner), ("buffer", CompactScanner)]:
+        tracemalloc.start()
+        scanner = scanner_class(code, SymbolTable())
+        scanner.scan()
+        # Everything the scan kept alive: tokens, lexemes and symbol table
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("{:>10} {:>10} {:>16.1f}".format(name, len(scanner.tokens), current / len(scanner.tokens)))
+        del scanner
+
+def scan_file(args):
+    # Runs in a child process so ru_maxrss only covers one scan
+    start = time.perf_counter()
+    if args.mode == "mmap":
+        scanner = MappedScanner(MappedSource(args.path), SymbolTable())
+    else:
+        with open(args.path) as source:
+            scanner = DFAScanner(source.readlines(), SymbolTable())
+    with contextlib.redirect_stdout(io.StringIO()):
+        scanner.scan()
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(len(scanner.tokens), elapsed, peak)
+
+def bench_mmap(args):
+    handle, path = tempfile.mkstemp(suffix=".c")
+    with os.fdopen(handle, "w") as source:
+        source.writelines(iter_source(args.functions))
+    try:
+        print("Source: {:.1f} MiB".format(os.path.getsize(path) / 2 ** 20))
+        print("{:>10} {:>10} {:>10} {:>14}".format("mode", "tokens", "seconds", "peak RSS MiB"))
+        for mode in ["lines", "mmap"]:
+            output = subprocess.check_output([sys.executable, __file__, "scan-file", mode, path])
+            tokens, elapsed, peak = output.decode().split()
+            print("{:>10} {:>10} {:>10.2f} {:>14.1f}".format(mode, tokens, float(elapsed), int(peak) / 1024))
+    finally:
+        os.remove(path)
+
+def bench_parallel(args):
+    code = generate_source(args.functions)
+    print("Source: {:.1f} MiB, {} cpus".format(sum(len(line) for line in code) / 2 ** 20, os.cpu_count()))
+    _, serial = time_scan(DFAScanner, code)
+    print("{:>8} {:>10} {:>8}".format("workers", "seconds", "speedup"))
+    print("{:>8} {:>10.2f} {:>8.2f}".format("serial", serial, 1.0))
+    for workers in args.workers:
+        _, elapsed = time_scan(lambda code, table: ParallelScanner(code, table, workers, threshold=0), code)
+        print("{:>8} {:>10.2f} {:>8.2f}".format(workers, elapsed, serial / elapsed))
+
+def bench_cache(args):
+    code = generate_source(args.functions)
+    directory = tempfile.mkdtemp()
+    try:
+        cache = TokenCache(directory)
+        for label in ["miss", "hit"]:
+            scanner = DFAScanner(code, SymbolTable())
+            start = time.perf_counter()
+            cache.scan(scanner)
+            print("{:>6}: {:.3f}s ({} tokens)".format(label, time.perf_counter() - start, len(scanner.tokens)))
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print("entry: {:.1f} KiB for {:.1f} KiB of source".format(size / 1024, sum(map(len, code)) / 1024))
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+def bench_grammar(args):
+    from grammar import Grammar, GRAMMAR_TEXT, START, read_grammar
+    start = time.perf_counter()
+    grammar = Grammar(read_grammar(GRAMMAR_TEXT), START, args.k)
+    print("Prediction table built in {:.1f} ms".format((time.perf_counter() - start) * 1000))
+    for line in grammar.conflict_report():
+        print(line)
+
+def bench_relex(args):
+    code = generate_source(args.lines // len(FUNCTION_TEMPLATE) + 1)[:args.lines]
+    scanner = IncrementalScanner(code, SymbolTable())
+    scanner.scan()
+    tokens = scanner.tokens
+    print("Source: {} lines, {} tokens".format(len(code), len(tokens)))
+    for label, new_lines in [("replace line", lambda old: [old.replace("i++", "i--")]),
+                             ("insert line", lambda old: [old, "    i = i + 1;\n"])]:
+        timings = []
+        for edit in range(args.edits):
+            line_pos = (edit * 7919) % (len(scanner.code) - 1)
+            replacement = new_lines(scanner.code[line_pos])
+            start = time.perf_counter()
+            tokens, diff = scanner.relex(tokens, line_pos, line_pos + 1, replacement)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print("{:>14}: median {:.1f} us, max {:.1f} us".format(
+            label, timings[len(timings) // 2] * 1e6, timings[-1] * 1e6))
+
+def nested_source(depth):
+    # Parenthesised expression and while loops both nested `depth` levels deep
+    return ["int main(){\n",
+            "    int x = 0;\n",
+            "    x = " + "(" * depth + "1" + ")" * depth + ";\n"] + \
+           ["    while(x < 1)\n"] * depth + \
+           ["    x = 1;\n", "    return 0;\n", "}\n", "int end;\n"]
+
+def time_parse(parser_class, code):
+    symbol_table = SymbolTable()
+    scanner = DFAScanner(code, symbol_table)
+    scanner.scan()
+    parser = parser_class(symbol_table, scanner)
+    start = time.perf_counter()
+    try:
+        parser.parse()
+    except RecursionError:
+        return len(scanner.tokens), None
+    return len(scanner.tokens), time.perf_counter() - start
+
+EXPRESSION_NODE_TYPES = {
+    SyntaxNodeTypes.EXPRESSION, SyntaxNodeTypes.SIMPLE_EXPRESSION, SyntaxNodeTypes.EXPRESSION_SIMPLE,
+    SyntaxNodeTypes.AND_EXPRESSION, SyntaxNodeTypes.EXPRESSION_AND, SyntaxNodeTypes.UNARY_REL_EXPRESSION,
+    SyntaxNodeTypes.REL_EXPRESSION, SyntaxNodeTypes.EXPRESSION_REL, SyntaxNodeTypes.RELOP,
+    SyntaxNodeTypes.SUM_EXPRESSION, SyntaxNodeTypes.EXPRESSION_SUM, SyntaxNodeTypes.SUMOP,
+    SyntaxNodeTypes.TERM, SyntaxNodeTypes.NEW_TERM, SyntaxNodeTypes.MULOP,
+    SyntaxNodeTypes.UNARY_EXPRESSION, SyntaxNodeTypes.UNARY_OP, SyntaxNodeTypes.FACTOR,
+    SyntaxNodeTypes.MUTABLE, SyntaxNodeTypes.NEW_MUTABLE, SyntaxNodeTypes.IMMUTABLE,
+    SyntaxNodeTypes.CALL, SyntaxNodeTypes.CONSTANT,
+}
+
+def count_nodes(tree):
+    # Tree nodes reachable from the root and how many of them are expression nodes
+    count = 0
+    expressions = 0
+    for node in walk(tree):
+        count += 1
+        if node.type in EXPRESSION_NODE_TYPES:
+            expressions += 1
+    return count, expressions
+
+def bench_expressions(args):
+    code = [line.format(index) for index in range(args.functions) for line in EXPRESSION_TEMPLATE]
+    code.append("int end;\n")
+    print("Source: {} lines".format(len(code)))
+    print("{:>12} {:>10} {:>12} {:>10} {:>8}".format("parser", "nodes", "expr nodes", "seconds", "errors"))
+    for name, parser_class in [("recursive", Parser), ("precedence", PrecedenceParser)]:
+        symbol_table = SymbolTable()
+        scanner = DFAScanner(code, symbol_table)
+        scanner.scan()
+        parser = parser_class(symbol_table, scanner)
+        start = time.perf_counter()
+        tree = parser.parse()
+        elapsed = time.perf_counter() - start
+        print("{:>12} {:>10} {:>12} {:>10.3f} {:>8}".format(name, *count_nodes(tree), elapsed, len(parser.error_list)))
+
+def bench_tree(args):
+    code = [line.format(index) for index in range(args.functions) for line in EXPRESSION_TEMPLATE]
+    code.append("int end;\n")
+    print("{:>12} {:>10} {:>12} {:>14}".format("parser", "nodes", "bytes/node", "walk nodes/s"))
+    for name, parser_class in [("recursive", Parser), ("precedence", PrecedenceParser)]:
+        symbol_table = SymbolTable()
+        scanner = DFAScanner(code, symbol_table)
+        scanner.scan()
+        parser = parser_class(symbol_table, scanner)
+        # Tokens already exist, what is left after parsing is the tree
+        tracemalloc.start()
+        tree = parser.parse()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        count = sum(1 for _ in walk(tree))
+        elapsed = time.perf_counter() - start
+        print("{:>12} {:>10} {:>12.1f} {:>14.0f}".format(name, count, size / count, count / elapsed))
+
+def bench_tree_file(args):
+    code = [line.format(index) for index in range(args.functions) for line in EXPRESSION_TEMPLATE]
+    code.append("int end;\n")
+    symbol_table = SymbolTable()
+    scanner = DFAScanner(code, symbol_table)
+    scanner.scan()
+    parser = Parser(symbol_table, scanner)
+    start = time.perf_counter()
+    tree = parser.parse()
+    parse_time = time.perf_counter() - start
+    start = time.perf_counter()
+    data = encode_program(tree, symbol_table, parser.error_list)
+    encode_time = time.perf_counter() - start
+    print("Source: {} lines, {:.1f} KiB; tree file: {:.1f} KiB".format(
+        len(code), sum(map(len, code)) / 1024, len(data) / 1024))
+
+    timings = [("parse", parse_time), ("encode", encode_time)]
+    start = time.perf_counter()
+    program = ProgramFile(data)
+    timings.append(("open", time.perf_counter() - start))
+    start = time.perf_counter()
+    program.find("calc{}".format(args.functions // 2))
+    timings.append(("one function", time.perf_counter() - start))
+    start = time.perf_counter()
+    ProgramFile(data).tree()
+    timings.append(("whole tree", time.perf_counter() - start))
+    for label, elapsed in timings:
+        print("{:>14}: {:>9.1f} ms {:>7.1%} of parse".format(label, elapsed * 1000, elapsed / parse_time))
+
+def bench_reparse(args):
+    print("{:>10} {:>10} {:>14} {:>14}".format("functions", "tokens", "full parse ms", "reparse ms"))
+    for functions in args.functions:
+        code = [line.format(index) for index in range(functions) for line in EXPRESSION_TEMPLATE]
+        code.append("int end;\n")
+        symbol_table = SymbolTable()
+        scanner = IncrementalScanner(code, symbol_table)
+        scanner.scan()
+        parser = IncrementalParser(symbol_table, scanner)
+        start = time.perf_counter()
+        tree = parser.parse()
+        parse_time = time.perf_counter() - start
+
+        # Edit one statement in the middle function, back and forth
+        line_pos = (functions // 2) * len(EXPRESSION_TEMPLATE) + 6
+        timings = []
+        for edit in range(args.edits):
+            new_line = "    y = x * x + a % 7 - b;\n" if edit % 2 else "    y = x * (x + a) % 7 - b * 2;\n"
+            tokens, diff = scanner.relex(scanner.tokens, line_pos, line_pos + 1, [new_line])
+            start = time.perf_counter()
+            parser.reparse(tree, diff)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print("{:>10} {:>10} {:>14.1f} {:>14.3f}".format(
+            functions, len(scanner.tokens), parse_time * 1000, timings[len(timings) // 2] * 1000))
+
+def bench_parallel_parse(args):
+    code = [line.format(index) for index in range(args.functions) for line in EXPRESSION_TEMPLATE]
+    code.append("int end;\n")
+    print("Source: {} functions, {} cpus".format(args.functions, os.cpu_count()))
+    print("{:>8} {:>10} {:>8}".format("workers", "seconds", "speedup"))
+    tokens, serial = time_parse(Parser, code)
+    print("{:>8} {:>10.2f} {:>8.2f}".format("serial", serial, 1.0))
+    for workers in args.workers:
+        _, elapsed = time_parse(lambda table, scanner: ParallelParser(table, scanner, workers, threshold=0), code)
+        print("{:>8} {:>10.2f} {:>8.2f}".format(workers, elapsed, serial / elapsed))
+
+class ScanningSymbolTable(SymbolTable):
+    # kill_scope as it was before the undo logs, walking every name
+    def kill_scope(self):
+        for key, tk_list in self.hashtable.items():
+            if tk_list and tk_list[-1].scope == self.current_scope:
+                tk_list.pop()
+        self.scopes.pop()
+        self.current_scope -= 1
+
+def blocks_source(names, blocks):
+    code = ["int g{0};\n".format(index) for index in range(names)]
+    for function in range(0, blocks, 100):
+        code += ["int f{0}(){{\n".format(function), "    int x = 0;\n"]
+        code += ["    while(x < 1){ int t; t = x; x = t + 1; }\n"] * min(100, blocks - function)
+        code += ["    return x;\n", "}\n"]
+    return code + ["int end;\n"]
+
+def bench_symbols(args):
+    print("{:>8} {:>8} {:>16} {:>16}".format("names", "blocks", "scan all ms", "undo log ms"))
+    for names in args.names:
+        for blocks in args.blocks:
+            code = blocks_source(names, blocks)
+            timings = []
+            for table_class in [ScanningSymbolTable, SymbolTable]:
+                symbol_table = table_class()
+                scanner = DFAScanner(code, symbol_table)
+                scanner.scan()
+                parser = Parser(symbol_table, scanner)
+                start = time.perf_counter()
+                parser.parse()
+                timings.append((time.perf_counter() - start) * 1000)
+            print("{:>8} {:>8} {:>16.1f} {:>16.1f}".format(names, blocks, *timings))
+
+def bench_scopes(args):
+    print("{:>10} {:>10} {:>12} {:>10} {:>12} {:>12}".format(
+        "functions", "tokens", "parse ms", "index ms", "resolve us", "visible us"))
+    for functions in args.functions:
+        code = [line.format(index) for index in range(functions) for line in EXPRESSION_TEMPLATE]
+        code.append("int end;\n")
+        symbol_table = SymbolTable()
+        scanner = DFAScanner(code, symbol_table)
+        scanner.scan()
+        start = time.perf_counter()
+        recorder = ScopeRecorder(symbol_table, scanner)
+        Parser(symbol_table, scanner).parse()
+        parse_time = time.perf_counter() - start
+        start = time.perf_counter()
+        index = recorder.finish()
+        index_time = time.perf_counter() - start
+
+        tokens = len(scanner.tokens)
+        positions = [(query * 7919) % tokens for query in range(args.queries)]
+        start = time.perf_counter()
+        for position in positions:
+            index.resolve("x", position)
+        resolve_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for position in positions:
+            index.visible_symbols(position)
+        visible_time = time.perf_counter() - start
+        print("{:>10} {:>10} {:>12.1f} {:>10.1f} {:>12.2f} {:>12.2f}".format(
+            functions, tokens, parse_time * 1000, index_time * 1000,
+            resolve_time / args.queries * 1e6, visible_time / args.queries * 1e6))
+
+def bench_symbol_index(args):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for file_index in range(args.files):
+            path = os.path.join(directory, "unit{}.c".format(file_index))
+            with open(path, "w") as source:
+                source.write("char tag{};\n".format(file_index))
+                for function in range(args.functions):
+                    source.writelines(line.format("{}x{}".format(file_index, function))
+                                      for line in EXPRESSION_TEMPLATE)
+                source.write("int use{}(){{\n    return calc0x0();\n}}\n".format(file_index))
+            paths.append(path)
+
+        with SymbolIndex(os.path.join(directory, "index.db")) as index:
+            start = time.perf_counter()
+            index.update(paths)
+            print("Index {} files: {:.2f} s".format(args.files, time.perf_counter() - start))
+            start = time.perf_counter()
+            index.update(paths)
+            print("Update, nothing changed: {:.1f} ms".format((time.perf_counter() - start) * 1000))
+            with open(paths[-1], "a") as source:
+                source.write("int extra;\n")
+            start = time.perf_counter()
+            index.update(paths)
+            print("Update, one file changed: {:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+            rows = index.connection.execute("SELECT (SELECT count(*) FROM declarations), "
+                                            "(SELECT count(*) FROM uses)").fetchone()
+            print("Rows: {} declarations, {} uses".format(*rows))
+            for label, query in [("callers", lambda: index.callers("calc0x0")),
+                                 ("definitions", lambda: index.definitions("calc1x1")),
+                                 ("declarations_of_type", lambda: index.declarations_of_type("char"))]:
+                start = time.perf_counter()
+                found = query()
+                print("{:>22}: {:>8.2f} ms, {} rows".format(label, (time.perf_counter() - start) * 1000, len(found)))
+
+def bench_semantics(args):
+    code = [line.format(index) for index in range(args.functions) for line in EXPRESSION_TEMPLATE]
+    code.append("int end;\n")
+    print("Source: {} functions, {} cpus".format(args.functions, os.cpu_count()))
+
+    def syntax_only(symbol_table, scanner):
+        parser = PrecedenceParser(symbol_table, scanner)
+        parser.semantic_helpers = SyntaxOnlyHelpers(symbol_table)
+        return parser
+
+    for label, parser_class in [("inline checks", PrecedenceParser), ("syntax only", syntax_only)]:
+        tokens, elapsed = time_parse(parser_class, code)
+        print("{:>22}: {:>8.1f} ms parse".format(label, elapsed * 1000))
+
+    symbol_table = SymbolTable()
+    scanner = DFAScanner(code, symbol_table)
+    scanner.scan()
+    tree = syntax_only(symbol_table, scanner).parse()
+    for workers in [1] + args.workers:
+        analyzer = SemanticAnalyzer(symbol_table, workers, threshold=0)
+        start = time.perf_counter()
+        errors = analyzer.analyze(tree)
+        print("{:>22}: {:>8.1f} ms, {} errors".format("pass, {} workers".format(workers),
+                                                      (time.perf_counter() - start) * 1000, len(errors)))
+
+def checked_tree(path):
+    # Tree of a program that must be free of syntax and semantic errors
+    with open(path) as source:
+        code = source.readlines()
+    symbol_table = SymbolTable()
+    scanner = DFAScanner(code, symbol_table)
+    scanner.scan()
+    parser = PrecedenceParser(symbol_table, scanner)
+    parser.semantic_helpers = SyntaxOnlyHelpers(symbol_table)
+    tree = parser.parse()
+    errors = scanner.error_list + parser.error_list + SemanticAnalyzer(symbol_table).analyze(tree)
+    if errors:
+        raise Exception("{}: {}".format(path, errors[0]))
+    return tree
+
+def program_paths(names):
+    if names:
+        return [os.path.join(PROGRAMS_DIR, name + ".c") for name in names]
+    return sorted(os.path.join(PROGRAMS_DIR, name) for name in os.listdir(PROGRAMS_DIR) if name.endswith(".c"))
+
+def bench_run(args):
+    print("{:>12} {:>10} {:>10} {:>10} {:>10} {:>8} {:>10}".format("program", "walk ms", "folded ms", "vm ms",
+                                                                    "vm fold ms", "speedup", "result"))
+    for path in program_paths(args.programs):
+        timings = []
+        results = set()
+        for fold in [False, True]:
+            tree = checked_tree(path)
+            if fold:
+                ConstantFolder().fold(tree)
+            for runner in [Interpreter(tree), VirtualMachine(compile_program(tree))]:
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    results.add(runner.run())
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best * 1000)
+        name = os.path.splitext(os.path.basename(path))[0]
+        print("{:>12} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>7.1f}x {:>10}".format(
+            name, timings[0], timings[2], timings[1], timings[3], timings[0] / timings[1],
+            " ".join(str(result) for result in results)))
+
+def time_ir(program, repeat):
+    best = None
+    for _ in range(repeat):
+        interpreter = IRInterpreter(program)
+        start = time.perf_counter()
+        result = interpreter.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, result, interpreter.executed
+
+def bench_ir(args):
+    for path in program_paths(args.programs):
+        name = os.path.splitext(os.path.basename(path))[0]
+        # SSA alone is the baseline the other passes are measured against
+        plain = build_program(checked_tree(path))
+        optimize_program(plain, PASSES[:1])
+        program = build_program(checked_tree(path))
+        manager = optimize_program(program)
+        print("{}:".format(name))
+        print("\n".join("  " + line for line in manager.format_report().splitlines()))
+        plain_ms, plain_result, _ = time_ir(plain, args.repeat)
+        optimized_ms, optimized_result, _ = time_ir(program, args.repeat)
+        print("  run: ssa {:.1f} ms, optimized {:.1f} ms ({:.2f}x), result {} {}".format(
+            plain_ms, optimized_ms, plain_ms / optimized_ms, plain_result, optimized_result))
+
+def bench_loops(args):
+    print("{:>10} {:>6} {:>8} {:>8} {:>8} {:>12} {:>12} {:>8} {:>10} {:>10} {:>8} {:>14}".format(
+        "program", "loops", "hoisted", "reduced", "checks", "scalar ran", "loops ran", "fewer", "scalar ms",
+        "loops ms", "time", "result"))
+    for path in program_paths(args.programs):
+        name = os.path.splitext(os.path.basename(path))[0]
+        scalar = build_program(checked_tree(path))
+        optimize_program(scalar)
+        program = build_program(checked_tree(path))
+        loops = LoopOptimizer()
+        optimize_program(program, loop_passes(loops))
+        counts = [sum(1 for line in loops.applied if kind in line) for kind in ("hoisted", "reduced", "dropped")]
+        # Runs alternate, so a slower stretch of the machine hits both sides
+        timings = ([], [])
+        for _ in range(args.repeat):
+            for side, ir in zip(timings, (scalar, program)):
+                interpreter = IRInterpreter(ir)
+                start = time.perf_counter()
+                result = interpreter.run()
+                side.append((time.perf_counter() - start, result, interpreter.executed))
+        (scalar_s, scalar_result, scalar_ran), (loops_s, loops_result, loops_ran) = [
+            sorted(side)[len(side) // 2] for side in timings]
+        print("{:>10} {:>6} {:>8} {:>8} {:>8} {:>12} {:>12} {:>7.1%} {:>10.1f} {:>10.1f} {:>7.2f}x {:>14}".format(
+            name, len(loops.loops), *counts, scalar_ran, loops_ran, 1 - loops_ran / scalar_ran, scalar_s * 1000,
+            loops_s * 1000, scalar_s / loops_s, "{} {}".format(scalar_result, loops_result)))
+
+def bench_depth(args):
+    print("Recursion limit: {}".format(sys.getrecursionlimit()))
+    print("{:>8} {:>8} {:>14} {:>14}".format("depth", "tokens", "recursive ms", "iterative ms"))
+    for depth in args.depths:
+        code = nested_source(depth)
+        timings = []
+        for parser_class in [Parser, IterativeParser]:
+            tokens, elapsed = time_parse(parser_class, code)
+            timings.append("RecursionError" if elapsed is None else "{:.1f}".format(elapsed * 1000))
+        print("{:>8} {:>8} {:>14} {:>14}".format(depth, tokens, *timings))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    scanner_parser = subparsers.add_parser("scanner", help="Classic vs table-driven scanner")
+    scanner_parser.add_argument("--functions", type=int, default=2000)
+    scanner_parser.add_argument("--repeat", type=int, default=3)
+    scanner_parser.set_defaults(run=bench_scanner)
+
+    stream_parser = subparsers.add_parser("stream", help="Peak memory of list vs streaming tokens")
+    stream_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    stream_parser.set_defaults(run=bench_stream)
+
+    tokens_parser = subparsers.add_parser("tokens", help="Memory per token, Token list vs TokenBuffer")
+    tokens_parser.add_argument("--tokens", type=int, default=1000000)
+    tokens_parser.set_defaults(run=bench_tokens)
+
+    mmap_parser = subparsers.add_parser("mmap", help="Peak RSS of readlines vs memory mapped scanning")
+    mmap_parser.add_argument("--functions", type=int, default=20000)
+    mmap_parser.set_defaults(run=bench_mmap)
+
+    scan_file_parser = subparsers.add_parser("scan-file")
+    scan_file_parser.add_argument("mode", choices=["lines", "mmap"])
+    scan_file_parser.add_argument("path")
+    scan_file_parser.set_defaults(run=scan_file)
+
+    parallel_parser = subparsers.add_parser("parallel", help="Serial vs process pool scanning")
+    parallel_parser.add_argument("--functions", type=int, default=20000)
+    parallel_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parallel_parser.set_defaults(run=bench_parallel)
+
+    cache_parser = subparsers.add_parser("cache", help="Scanning vs loading from the token cache")
+    cache_parser.add_argument("--functions", type=int, default=5000)
+    cache_parser.set_defaults(run=bench_cache)
+
+    grammar_parser = subparsers.add_parser("grammar", help="LL(k) table build time and conflicts")
+    grammar_parser.add_argument("--k", type=int, default=3)
+    grammar_parser.set_defaults(run=bench_grammar)
+
+    relex_parser = subparsers.add_parser("relex", help="Latency of incremental re-lexing")
+    relex_parser.add_argument("--lines", type=int, default=100000)
+    relex_parser.add_argument("--edits", type=int, default=200)
+    relex_parser.set_defaults(run=bench_relex)
+
+    depth_parser = subparsers.add_parser("depth", help="Recursive vs iterative parser on deep nesting")
+    depth_parser.add_argument("--depths", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    depth_parser.set_defaults(run=bench_depth)
+
+    expressions_parser = subparsers.add_parser("expressions", help="Tree nodes, recursive vs precedence climbing")
+    expressions_parser.add_argument("--functions", type=int, default=2000)
+    expressions_parser.set_defaults(run=bench_expressions)
+
+    tree_parser = subparsers.add_parser("tree", help="Memory per tree node and walk speed")
+    tree_parser.add_argument("--functions", type=int, default=2000)
+    tree_parser.set_defaults(run=bench_tree)
+
+    tree_file_parser = subparsers.add_parser("tree-file", help="Parsing vs loading a saved syntax tree")
+    tree_file_parser.add_argument("--functions", type=int, default=2000)
+    tree_file_parser.set_defaults(run=bench_tree_file)
+
+    parallel_parse_parser = subparsers.add_parser("parallel-parse", help="Serial vs process pool body parsing")
+    parallel_parse_parser.add_argument("--functions", type=int, default=3000)
+    parallel_parse_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parallel_parse_parser.set_defaults(run=bench_parallel_parse)
+
+    symbols_parser = subparsers.add_parser("symbols", help="Scope exit cost as names and blocks grow")
+    symbols_parser.add_argument("--names", type=int, nargs="+", default=[100, 1000, 10000])
+    symbols_parser.add_argument("--blocks", type=int, nargs="+", default=[100, 1000, 10000])
+    symbols_parser.set_defaults(run=bench_symbols)
+
+    scopes_parser = subparsers.add_parser("scopes", help="Scope index build time and query latency")
+    scopes_parser.add_argument("--functions", type=int, nargs="+", default=[100, 1000, 10000])
+    scopes_parser.add_argument("--queries", type=int, default=10000)
+    scopes_parser.set_defaults(run=bench_scopes)
+
+    symbol_index_parser = subparsers.add_parser("symbol-index", help="Indexing a corpus into SQLite and querying it")
+    symbol_index_parser.add_argument("--files", type=int, default=300)
+    symbol_index_parser.add_argument("--functions", type=int, default=20)
+    symbol_index_parser.set_defaults(run=bench_symbol_index)
+
+    semantics_parser = subparsers.add_parser("semantics", help="Inline checks vs syntax only, and the semantic pass")
+    semantics_parser.add_argument("--functions", type=int, default=2000)
+    semantics_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    semantics_parser.set_defaults(run=bench_semantics)
+
+    run_parser = subparsers.add_parser("run", help="Tree-walking interpreter on the programs/ directory")
+    run_parser.add_argument("--programs", nargs="+", help="Names of programs/*.c to run, all by default")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.set_defaults(run=bench_run)
+
+    ir_parser = subparsers.add_parser("ir", help="IR optimization passes on the programs/ directory")
+    ir_parser.add_argument("--programs", nargs="+", help="Names of programs/*.c to optimize, all by default")
+    ir_parser.add_argument("--repeat", type=int, default=3)
+    ir_parser.set_defaults(run=bench_ir)
+
+    loops_parser = subparsers.add_parser("loops", help="Loop optimizations on the array sweeps of programs/")
+    loops_parser.add_argument("--programs", nargs="+", default=["sweep", "matrix"],
+                              help="Names of programs/*.c to optimize (default: %(default)s)")
+    loops_parser.add_argument("--repeat", type=int, default=11)
+    loops_parser.set_defaults(run=bench_loops)
+
+    reparse_parser = subparsers.add_parser("reparse", help="Full parse vs reparsing one edited function")
+    reparse_parser.add_argument("--functions", type=int, nargs="+", default=[100, 1000, 10000])
+    reparse_parser.add_argument("--edits", type=int, default=50)
+    reparse_parser.set_defaults(run=bench_reparse)
+
+    args = parser.parse_args()
+    if hasattr(args, "run"):
+        args.run(args)
+    else:
+        parser.print_help()
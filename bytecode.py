@@ -0,0 +1,908 @@
+# -*- coding: utf-8 -*-
+
+import operator
+import random
+from array import array
+from language import *
+from precedence_parser import compact_program
+from semantic import type_name, items
+from folding import constant_value, divide
+from interpreter import DEFAULT_VALUES, remainder, position
+
+# Name and operand kinds of every instruction; an instruction is its opcode
+# followed by its operands in the code array. A "slot" operand is a local
+# or, past the locals, one of the function's constant operands.
+INSTRUCTIONS = (
+    ("COMPARE_JUMP", ("operator", "slot", "slot", "target")),
+    ("COMPARE_POP_JUMP", ("operator", "target")),
+    ("COMPARE_SIZE_JUMP", ("operator", "slot", "slot", "target")),
+    ("BINARY_OPERANDS", ("operator", "slot", "slot")),
+    ("BINARY_OPERAND", ("operator", "slot")),
+    ("INPLACE_OPERAND", ("operator", "slot", "slot")),
+    ("INPLACE", ("operator", "slot")),
+    ("LOAD_LOCAL", ("slot",)),
+    ("STORE_LOCAL", ("slot",)),
+    ("MOVE", ("slot", "slot")),
+    ("INDEX_OPERANDS", ("site", "slot", "slot")),
+    ("STORE_INDEX_OPERANDS", ("site", "slot", "slot")),
+    ("JUMP", ("target",)),
+    ("JUMP_IF_FALSE", ("target",)),
+    ("JUMP_IF_TRUE", ("target",)),
+    ("LOAD_CONST", ("constant",)),
+    ("BINARY", ("operator",)),
+    ("CALL", ("function",)),
+    ("RETURN", ()),
+    ("LOAD_GLOBAL", ("global",)),
+    ("STORE_GLOBAL", ("global",)),
+    ("INDEX", ("site",)),
+    ("STORE_INDEX", ("site",)),
+    ("FIELD", ("field",)),
+    ("STORE_FIELD", ("field",)),
+    ("DIVIDE", ("site",)),
+    ("REMAINDER", ("site",)),
+    ("SIZE", ()),
+    ("NEGATE", ()),
+    ("NOT", ()),
+    ("POP", ()),
+    ("DUP", ()),
+    ("DUP_TWO", ()),
+    ("JUMP_IF_FALSE_OR_POP", ("target",)),
+    ("JUMP_IF_TRUE_OR_POP", ("target",)),
+    ("NEW", ("constant",)),
+    ("COPY", ()),
+    ("RANDOM", ("site",)),
+)
+OPCODE_NAMES = tuple(name for name, _ in INSTRUCTIONS)
+OPERANDS = tuple(operands for _, operands in INSTRUCTIONS)
+(COMPARE_JUMP, COMPARE_POP_JUMP, COMPARE_SIZE_JUMP, BINARY_OPERANDS, BINARY_OPERAND, INPLACE_OPERAND, INPLACE,
+ LOAD_LOCAL, STORE_LOCAL, MOVE, INDEX_OPERANDS, STORE_INDEX_OPERANDS, JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE, LOAD_CONST,
+ BINARY, CALL, RETURN, LOAD_GLOBAL, STORE_GLOBAL, INDEX, STORE_INDEX, FIELD, STORE_FIELD, DIVIDE, REMAINDER, SIZE, NEGATE, NOT,
+ POP, DUP, DUP_TWO, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, NEW, COPY, RANDOM) = range(len(INSTRUCTIONS))
+
+# An "operator" operand indexes these. The fused instructions only divide
+# by nonzero constants, DIVIDE and REMAINDER check the divisor.
+BINARY_OPERATORS = ("+", "-", "*", "/", "%", "<", "<=", ">", ">=", "==", "!=")
+BINARY_FUNCTIONS = (operator.add, operator.sub, operator.mul, divide, remainder, operator.lt, operator.le,
+                    operator.gt, operator.ge, operator.eq, operator.ne)
+
+# Jumping when a comparison holds is jumping when its complement fails
+COMPLEMENTS = {"<": ">=", "<=": ">", ">": "<=", ">=": "<", "==": "!=", "!=": "=="}
+
+# Constant operands are numbered from here until the function's locals are known
+CONSTANT_BASE = 1 << 24
+
+# C- calls nested deeper than this stop the program
+CALL_STACK_LIMIT = 10000
+
+def copy_value(value):
+    # Arrays and records are both lists here, scalars are immutable
+    if type(value) is list:
+        return [copy_value(element) for element in value]
+    return value
+
+def instructions(code):
+    """(offset, opcode, operands) of every instruction in a code array."""
+    offset = 0
+    while offset < len(code):
+        opcode = code[offset]
+        count = len(OPERANDS[opcode])
+        yield offset, opcode, code[offset + 1:offset + 1 + count].tolist()
+        offset += 1 + count
+
+def assigns(node):
+    # Whether an expression assigns to a variable anywhere inside
+    return any(isinstance(child, ExpressionNode) for child in walk(node))
+
+class Function():
+    """Bytecode of one function.
+
+    The first `arity` local slots are the parameters; a call copies
+    `padding` after the arguments, None for the other locals then the
+    constant operands. sites are the tokens run time errors report.
+    """
+
+    __slots__ = ["name", "code", "arity", "slot_names", "sites", "padding"]
+
+    def __init__(self, name, arity):
+        self.name = name
+        self.code = array('i')
+        self.arity = arity
+        self.slot_names = []
+        self.sites = []
+        self.padding = []
+
+class Program():
+    """Functions, constant pool and globals of a compiled program.
+
+    `init` fills the global slots; functions call each other by their index
+    in `functions`.
+    """
+
+    def __init__(self):
+        self.functions = []
+        self.function_index = {}
+        self.constants = []
+        self.global_names = []
+        self.records = {}
+        self.init = None
+
+    def function(self, name):
+        return self.functions[self.function_index[name]]
+
+class BytecodeCompiler():
+    """Compiles a checked syntax tree to a Program.
+
+    Expressions are made compact first, like for the Interpreter. Names
+    resolve at compile time: a scope stack mirrors the symbol table's
+    scopes, every block declaration gets the next local slot and the slots
+    of a block are reused once it closes. Records become lists with a
+    slot per field, so a field access is a constant index.
+
+    Scalar locals and constants are operands of fused instructions, so
+    `i < n`, `i * 2` or `total += v[i]` do not go through the stack, and
+    loops test their condition at the bottom.
+    """
+
+    def __init__(self, tree):
+        self.tree = compact_program(tree)
+        self.program = Program()
+        self.constant_keys = {}
+        self.signatures = {}
+        self.global_scope = {}
+        self.function = None
+        self.scopes = []
+        self.slot_count = 0
+        self.constant_operands = {}
+        self.loop_exits = []
+
+    def compile(self):
+        program = self.program
+        functions = []
+        global_declarations = []
+        for declaration in top_level_declarations(self.tree):
+            if getattr(declaration, "fun_declaration", None) is not None:
+                node = declaration.fun_declaration
+                if getattr(node, "id", None) is not None:
+                    self.declare_function(node)
+                    functions.append(node)
+            elif getattr(declaration, "rec_declaration", None) is not None:
+                self.rec_declaration(declaration.rec_declaration)
+            elif getattr(declaration, "var_declaration", None) is not None:
+                global_declarations.append(declaration.var_declaration)
+
+        self.begin(Function("<init>", 0))
+        for declaration in global_declarations:
+            self.var_declaration(declaration.type_specifier, declaration.var_declaration_list, self.declare_global)
+        self.emit(LOAD_CONST, self.constant(None))
+        self.emit(RETURN)
+        program.init = self.end()
+
+        for node in functions:
+            self.fun_declaration(node)
+        return program
+
+    # Constants and code
+
+    def constant(self, value):
+        # True == 1 and '1' != 1, so the key has the type
+        key = (type(value), value)
+        index = self.constant_keys.get(key)
+        if index is None:
+            index = len(self.program.constants)
+            self.program.constants.append(value)
+            self.constant_keys[key] = index
+        return index
+
+    def template(self, value):
+        # Array and record values are copied from the pool by NEW, never shared
+        self.program.constants.append(value)
+        return len(self.program.constants) - 1
+
+    def emit(self, opcode, *operands):
+        """Appends an instruction, returns the offset of its last operand (a jump target to patch)."""
+        code = self.function.code
+        code.append(opcode)
+        code.extend(operands)
+        return len(code) - 1
+
+    def here(self):
+        return len(self.function.code)
+
+    def patch(self, at, target):
+        self.function.code[at] = target
+
+    def site(self, token):
+        self.function.sites.append(token)
+        return len(self.function.sites) - 1
+
+    def operand(self, node):
+        """Slot of a scalar local or constant leaf, None for anything else."""
+        if not isinstance(node, LeafNode) or getattr(node, "data_type", None) not in DEFAULT_VALUES:
+            return None
+        if node.type == SyntaxNodeTypes.CONSTANT:
+            return self.constant_operand(constant_value(node.token))
+        load, slot, _ = self.lookup(node.token.value)
+        return slot if load == LOAD_LOCAL else None
+
+    def constant_operand(self, value):
+        key = (type(value), value)
+        if key not in self.constant_operands:
+            self.constant_operands[key] = CONSTANT_BASE + len(self.constant_operands)
+        return self.constant_operands[key]
+
+    # Declarations
+
+    def declare_function(self, node):
+        name = node.id.value
+        params = []
+        param_list = getattr(getattr(node, "params", None), "param_list", None)
+        if param_list is not None:
+            for group in [param_list.param_type_list] + items(getattr(param_list.list_param, "list_param", None)):
+                param_ids = [group.param_id_list.param_id]
+                param_ids += items(getattr(group.param_id_list.list_id_param, "list_id_param", None))
+                for param_id in param_ids:
+                    data_type = type_name(group.type_specifier)
+                    if getattr(param_id.id_param, "id_param", None) is not None:
+                        data_type += "[]"
+                    params.append((param_id.id.value, data_type))
+        self.program.function_index[name] = len(self.program.functions)
+        self.program.functions.append(Function(name, len(params)))
+        self.signatures[name] = (params, type_name(getattr(node, "type_specifier", None)))
+
+    def rec_declaration(self, node):
+        fields = {}
+        for declaration in items(getattr(getattr(node, "local_declarations", None), "declarations_local", None)):
+            data_type = type_name(declaration.scoped_type_specifier.type_specifier)
+            for var_decl_id, _ in self.declared(declaration.var_decl_list):
+                size = self.array_size(var_decl_id)
+                fields[var_decl_id.id.value] = (len(fields), data_type if size is None else data_type + "[]", size)
+        self.program.records[node.id.value] = fields
+
+    def declared(self, var_decl_list):
+        # (VAR_DEC_ID, initializer or None) of every name in a declaration
+        found = []
+        for declaration in [var_decl_list.var_decl_initialize] + items(
+                getattr(var_decl_list.list_var_decl, "list_var_decl", None)):
+            found.append((declaration.var_decl_id, getattr(declaration.initialize_decl_var, "simple_expression", None)))
+        return found
+
+    def array_size(self, var_decl_id):
+        size = getattr(var_decl_id.id_decl_var, "id_decl_var", None)
+        return int(size.value) if size is not None else None
+
+    def new_value(self, data_type, array_size=None):
+        if array_size is not None:
+            return [self.new_value(data_type) for _ in range(array_size)]
+        if data_type in DEFAULT_VALUES:
+            return DEFAULT_VALUES[data_type]
+        fields = self.program.records.get(data_type)
+        if fields is None:
+            return None
+        return [self.new_value(field_type if size is None else field_type[:-2], size)
+                for _, field_type, size in fields.values()]
+
+    def load_value(self, data_type, array_size=None):
+        value = self.new_value(data_type, array_size)
+        if type(value) is list:
+            self.emit(NEW, self.template(value))
+        else:
+            self.emit(LOAD_CONST, self.constant(value))
+
+    def var_declaration(self, type_specifier, var_decl_list, declare):
+        data_type = type_name(type_specifier)
+        for var_decl_id, initializer in self.declared(var_decl_list):
+            size = self.array_size(var_decl_id)
+            if initializer is not None:
+                self.expression(initializer)
+                self.copy_if_aggregate(initializer)
+            else:
+                self.load_value(data_type, size)
+            # The initializer still sees the outer name
+            store, slot = declare(var_decl_id.id.value, data_type if size is None else data_type + "[]")
+            self.emit(store, slot)
+
+    def declare_global(self, name, data_type):
+        slot = len(self.program.global_names)
+        self.program.global_names.append(name)
+        self.global_scope[name] = (LOAD_GLOBAL, slot, data_type)
+        return STORE_GLOBAL, slot
+
+    def declare_local(self, name, data_type):
+        slot = self.slot_count
+        self.slot_count += 1
+        if slot == len(self.function.slot_names):
+            self.function.slot_names.append(name)
+        else:
+            self.function.slot_names[slot] += "/" + name
+        self.scopes[-1][name] = (LOAD_LOCAL, slot, data_type)
+        return STORE_LOCAL, slot
+
+    def spare_slot(self):
+        # A local for a value in flight, free again once the expression is done
+        slot = self.slot_count
+        if slot == len(self.function.slot_names):
+            self.function.slot_names.append("<value>")
+        return slot
+
+    # Functions
+
+    def begin(self, function):
+        self.function = function
+        self.scopes = [{}]
+        self.slot_count = 0
+        self.constant_operands = {}
+
+    def end(self):
+        """Moves the constant operands after the locals, returns the finished function."""
+        function = self.function
+        code = function.code
+        local_count = len(function.slot_names)
+        for offset, opcode, operands in instructions(code):
+            for number, kind in enumerate(OPERANDS[opcode]):
+                if kind == "slot" and operands[number] >= CONSTANT_BASE:
+                    code[offset + 1 + number] = operands[number] - CONSTANT_BASE + local_count
+        constants = sorted(self.constant_operands.items(), key=lambda item: item[1])
+        function.padding = [None] * (local_count - function.arity) + [value for (_, value), _ in constants]
+        self.function = None
+        return function
+
+    def fun_declaration(self, node):
+        name = node.id.value
+        params, return_type = self.signatures[name]
+        self.begin(self.program.function(name))
+        for param, data_type in params:
+            self.declare_local(param, data_type)
+        self.statement(node.statement)
+        # Falling off the end returns the default value of the return type
+        self.load_value(return_type)
+        self.emit(RETURN)
+        self.end()
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return self.global_scope[name]
+
+    # Statements
+
+    def statement(self, node):
+        for name in node.fields:
+            statement = getattr(node, name, None)
+            if statement is not None:
+                self.STATEMENTS[statement.type](self, statement)
+                return
+
+    def expression_stmt(self, node):
+        expression = getattr(node, "expression", None)
+        if isinstance(expression, SyntaxNode):
+            self.expression(expression, keep=False)
+
+    def compound_stmt(self, node):
+        self.scopes.append({})
+        slot_count = self.slot_count
+        for declaration in items(getattr(getattr(node, "local_declarations", None), "declarations_local", None)):
+            self.var_declaration(declaration.scoped_type_specifier.type_specifier, declaration.var_decl_list,
+                                 self.declare_local)
+        statement_list = getattr(node, "statement_list", None)
+        for statement in items(getattr(getattr(statement_list, "list_statement", None), "statement", None)):
+            self.statement(statement)
+        self.scopes.pop()
+        self.slot_count = slot_count
+
+    def branch(self, node, when):
+        """Emits a jump taken when condition node is `when`, returns the offset to patch with its target."""
+        if isinstance(node, BinaryNode) and node.op.value in COMPLEMENTS:
+            left, right = self.operand(node.left), self.operand(node.right)
+            # The compare and jump instructions jump when the comparison fails
+            operator_name = COMPLEMENTS[node.op.value] if when else node.op.value
+            if left is not None and right is not None:
+                return self.emit(COMPARE_JUMP, BINARY_OPERATORS.index(operator_name), left, right, 0)
+            array_slot = self.local_size(node.right)
+            if left is not None and array_slot is not None:
+                # i < *v, the loop over a whole array
+                return self.emit(COMPARE_SIZE_JUMP, BINARY_OPERATORS.index(operator_name), left, array_slot, 0)
+            self.expression(node.left)
+            self.expression(node.right)
+            return self.emit(COMPARE_POP_JUMP, BINARY_OPERATORS.index(operator_name), 0)
+        self.expression(node)
+        return self.emit(JUMP_IF_TRUE if when else JUMP_IF_FALSE, 0)
+
+    def selection_stmt(self, node):
+        skip = self.branch(node.simple_expression, False)
+        self.statement(node.statement)
+        otherwise = getattr(getattr(node, "stmt_selection", None), "statement", None)
+        if otherwise is not None:
+            done = self.emit(JUMP, 0)
+            self.patch(skip, self.here())
+            self.statement(otherwise)
+            self.patch(done, self.here())
+        else:
+            self.patch(skip, self.here())
+
+    def iteration_stmt(self, node):
+        # The condition is at the bottom, one jump per iteration
+        test = self.emit(JUMP, 0)
+        body = self.here()
+        exits = []
+        self.loop_exits.append(exits)
+        self.statement(node.statement)
+        self.loop_exits.pop()
+        self.patch(test, self.here())
+        self.patch(self.branch(node.simple_expression, True), body)
+        for at in exits:
+            self.patch(at, self.here())
+
+    def return_stmt(self, node):
+        expression = getattr(node, "expression", None)
+        if expression is not None:
+            self.expression(expression)
+        else:
+            self.load_value(self.signatures[self.function.name][1])
+        self.emit(RETURN)
+
+    def break_stmt(self, node):
+        self.loop_exits[-1].append(self.emit(JUMP, 0))
+
+    STATEMENTS = {
+        SyntaxNodeTypes.EXPRESSION_STATEMENT: expression_stmt,
+        SyntaxNodeTypes.COMPOUND_STATEMENT: compound_stmt,
+        SyntaxNodeTypes.SELECTION_STATEMENT: selection_stmt,
+        SyntaxNodeTypes.ITERATION_STATEMENT: iteration_stmt,
+        SyntaxNodeTypes.RETURN_STATEMENT: return_stmt,
+        SyntaxNodeTypes.BREAK_STATEMENT: break_stmt,
+    }
+
+    # Expressions
+
+    def expression(self, node, keep=True):
+        """Emits code for node; the value is left on the stack only when keep is set."""
+        if isinstance(node, ExpressionNode):
+            self.assignment(node, keep)
+            return
+        if isinstance(node, BinaryNode):
+            self.binary(node)
+        elif isinstance(node, UnaryNode):
+            self.unary(node)
+        elif isinstance(node, LeafNode):
+            if node.type == SyntaxNodeTypes.CONSTANT:
+                self.emit(LOAD_CONST, self.constant(constant_value(node.token)))
+            else:
+                load, slot, _ = self.lookup(node.token.value)
+                self.emit(load, slot)
+        elif isinstance(node, MutableNode):
+            self.element(node)
+        elif isinstance(node, CallNode):
+            self.call(node)
+        if not keep:
+            self.emit(POP)
+
+    def copy_if_aggregate(self, node):
+        # Assigning or passing a record or an array copies it
+        data_type = getattr(node, "data_type", None)
+        if data_type is not None and data_type not in DEFAULT_VALUES:
+            self.emit(COPY)
+
+    def divisor_operand(self, operator_name, node):
+        # Operand slot of a right operand that needs no check, None when it does
+        if operator_name in ("/", "%") and not (node.type == SyntaxNodeTypes.CONSTANT and
+                                                isinstance(node, LeafNode) and constant_value(node.token) != 0):
+            return None
+        return self.operand(node)
+
+    def binary(self, node):
+        operator_name = node.op.value
+        if operator_name == "and" or operator_name == "or":
+            self.expression(node.left)
+            done = self.emit(JUMP_IF_FALSE_OR_POP if operator_name == "and" else JUMP_IF_TRUE_OR_POP, 0)
+            self.expression(node.right)
+            self.patch(done, self.here())
+            return
+        right = self.divisor_operand(operator_name, node.right)
+        if right is not None:
+            left = self.operand(node.left)
+            if left is not None:
+                self.emit(BINARY_OPERANDS, BINARY_OPERATORS.index(operator_name), left, right)
+            else:
+                self.expression(node.left)
+                self.emit(BINARY_OPERAND, BINARY_OPERATORS.index(operator_name), right)
+            return
+        self.expression(node.left)
+        self.expression(node.right)
+        if operator_name == "/":
+            self.emit(DIVIDE, self.site(node.op))
+        elif operator_name == "%":
+            self.emit(REMAINDER, self.site(node.op))
+        else:
+            self.emit(BINARY, BINARY_OPERATORS.index(operator_name))
+
+    def unary(self, node):
+        operator_name = node.op.value
+        self.expression(node.operand)
+        if operator_name == "-":
+            self.emit(NEGATE)
+        elif operator_name == "not":
+            self.emit(NOT)
+        elif operator_name == "*":
+            self.emit(SIZE)
+        else:
+            self.emit(RANDOM, self.site(node.op))
+
+    def local_size(self, node):
+        """Slot of local array v when node is *v, else None."""
+        if not isinstance(node, UnaryNode) or node.op.value != "*" or not isinstance(node.operand, LeafNode):
+            return None
+        load, slot, _ = self.lookup(node.operand.token.value)
+        return slot if load == LOAD_LOCAL else None
+
+    def local_element(self, node):
+        """(array slot, index slot) when node is a local array indexed by a scalar operand, else None."""
+        if not isinstance(node, MutableNode) or getattr(node.new_mutable, "ids", None) is not None:
+            return None
+        indices = items(getattr(node.new_mutable, "expressions", None))
+        load, array_slot, _ = self.lookup(node.id.value)
+        if len(indices) != 1 or load != LOAD_LOCAL:
+            return None
+        index = self.operand(indices[0])
+        return None if index is None else (array_slot, index)
+
+    def target(self, node):
+        """Emits the container of the element node stands for and its key, but the last step.
+
+        Returns (store opcode, operand); a variable emits nothing and
+        returns its own store.
+        """
+        token = node.token if isinstance(node, LeafNode) else node.id
+        load, slot, data_type = self.lookup(token.value)
+        new_mutable = getattr(node, "new_mutable", None)
+        steps = [(INDEX, STORE_INDEX, index) for index in items(getattr(new_mutable, "expressions", None))]
+        steps += [(FIELD, STORE_FIELD, field) for field in items(getattr(new_mutable, "ids", None))]
+        if not steps:
+            return (STORE_LOCAL if load == LOAD_LOCAL else STORE_GLOBAL), slot
+        self.emit(load, slot)
+        for number, (load, store, step) in enumerate(steps):
+            if load == INDEX:
+                self.expression(step)
+                data_type = data_type[:-2]
+                operand = self.site(token)
+            else:
+                operand, data_type, _ = self.program.records[data_type][step.value]
+            if number < len(steps) - 1:
+                self.emit(load, operand)
+        return store, operand
+
+    def element(self, node):
+        element = self.local_element(node)
+        if element is not None:
+            self.emit(INDEX_OPERANDS, self.site(node.id), *element)
+            return
+        store, operand = self.target(node)
+        self.emit(INDEX if store == STORE_INDEX else FIELD, operand)
+
+    def assignment(self, node, keep):
+        op = node.op.value
+        value = getattr(node, "expression", None)
+        if op == "=" and not keep and not assigns(value):
+            # Nothing the value does can move the element, so it is stored last
+            element = self.local_element(node.mutable)
+            if element is not None:
+                self.expression(value)
+                self.emit(STORE_INDEX_OPERANDS, self.site(node.mutable.id), *element)
+                return
+        store, operand = self.target(node.mutable)
+        if store == STORE_LOCAL and not keep:
+            if op == "=":
+                source = self.operand(value)
+                if source is not None:
+                    self.emit(MOVE, operand, source)
+                else:
+                    self.expression(value)
+                    self.copy_if_aggregate(value)
+                    self.emit(STORE_LOCAL, operand)
+                return
+            source = self.constant_operand(1) if op in ("++", "--") else self.divisor_operand(op[0], value)
+            if source is not None:
+                self.emit(INPLACE_OPERAND, BINARY_OPERATORS.index(op[0]), operand, source)
+                return
+            if op[0] != "/":
+                self.expression(value)
+                self.emit(INPLACE, BINARY_OPERATORS.index(op[0]), operand)
+                return
+        load = {STORE_LOCAL: LOAD_LOCAL, STORE_GLOBAL: LOAD_GLOBAL, STORE_INDEX: INDEX, STORE_FIELD: FIELD}[store]
+        if op != "=":
+            # The target is read and written, keep its container and key
+            if store == STORE_INDEX:
+                self.emit(DUP_TWO)
+            elif store == STORE_FIELD:
+                self.emit(DUP)
+            self.emit(load, operand)
+        if op == "=":
+            self.expression(value)
+            self.copy_if_aggregate(value)
+        elif op == "++" or op == "--":
+            self.emit(BINARY_OPERAND, BINARY_OPERATORS.index(op[0]), self.constant_operand(1))
+        else:
+            self.expression(value)
+            if op[0] == "/":
+                self.emit(DIVIDE, self.site(node.op))
+            else:
+                self.emit(BINARY, BINARY_OPERATORS.index(op[0]))
+        if keep:
+            if store == STORE_LOCAL or store == STORE_GLOBAL:
+                self.emit(DUP)
+            else:
+                # The value goes under the container, through a spare slot
+                slot = self.spare_slot()
+                self.emit(DUP)
+                self.emit(STORE_LOCAL, slot)
+                self.emit(store, operand)
+                self.emit(LOAD_LOCAL, slot)
+                return
+        self.emit(store, operand)
+
+    def call(self, node):
+        name = node.id.value
+        params = self.signatures[name][0]
+        arg_list = getattr(getattr(node, "args", None), "arg_list", None)
+        arguments = []
+        if arg_list is not None:
+            arguments = [arg_list.expression] + items(getattr(arg_list.list_arg, "expression", None))
+        for argument, (_, data_type) in zip(arguments, params):
+            self.expression(argument)
+            # Records are passed by value, arrays by reference
+            if not data_type.endswith("[]"):
+                self.copy_if_aggregate(argument)
+        self.emit(CALL, self.program.function_index[name])
+
+def compile_program(tree):
+    return BytecodeCompiler(tree).compile()
+
+class VirtualMachine():
+    """Runs a compiled Program in one dispatch loop.
+
+    Values live on one operand stack, locals in a list of slots per call.
+    Calls push the caller's code, pc and slots on a frame stack instead of
+    recursing in Python, so deep C- recursion only hits CALL_STACK_LIMIT.
+    Run time errors are the Interpreter's, with the same positions.
+
+    Code arrays are loaded into lists once: CPython indexes a list without
+    boxing a new int, which the dispatch loop does for every operand.
+    """
+
+    def __init__(self, program, seed=None):
+        self.program = program
+        self.random = random.Random(seed)
+        self.globals = []
+        self.loaded = [(function, function.code.tolist()) for function in program.functions]
+
+    def run(self, name="main", arguments=()):
+        """Initializes the globals and calls function `name`, returns what it returns."""
+        program = self.program
+        if name not in program.function_index:
+            raise Exception("No function '{}' to run".format(name))
+        self.globals = [None] * len(program.global_names)
+        self.execute((program.init, program.init.code.tolist()), program.init.padding[:])
+        function, code = self.loaded[program.function_index[name]]
+        return self.execute((function, code), list(arguments) + function.padding, name)
+
+    def execute(self, loaded, slots, name="<init>"):
+        constants = self.program.constants
+        functions = self.loaded
+        global_slots = self.globals
+        operations = BINARY_FUNCTIONS
+        function, code = loaded
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+        pc = 0
+        # Most frequent instructions first
+        while True:
+            op = code[pc]
+            if op == COMPARE_JUMP:
+                if operations[code[pc + 1]](slots[code[pc + 2]], slots[code[pc + 3]]):
+                    pc += 5
+                else:
+                    pc = code[pc + 4]
+            elif op == BINARY_OPERANDS:
+                push(operations[code[pc + 1]](slots[code[pc + 2]], slots[code[pc + 3]]))
+                pc += 4
+            elif op == BINARY_OPERAND:
+                stack[-1] = operations[code[pc + 1]](stack[-1], slots[code[pc + 2]])
+                pc += 3
+            elif op == INPLACE_OPERAND:
+                target = code[pc + 2]
+                slots[target] = operations[code[pc + 1]](slots[target], slots[code[pc + 3]])
+                pc += 4
+            elif op == LOAD_LOCAL:
+                push(slots[code[pc + 1]])
+                pc += 2
+            elif op == INPLACE:
+                target = code[pc + 2]
+                slots[target] = operations[code[pc + 1]](slots[target], pop())
+                pc += 3
+            elif op == COMPARE_SIZE_JUMP:
+                if operations[code[pc + 1]](slots[code[pc + 2]], len(slots[code[pc + 3]])):
+                    pc += 5
+                else:
+                    pc = code[pc + 4]
+            elif op == COMPARE_POP_JUMP:
+                right = pop()
+                if operations[code[pc + 1]](pop(), right):
+                    pc += 3
+                else:
+                    pc = code[pc + 2]
+            elif op == SIZE:
+                stack[-1] = len(stack[-1])
+                pc += 1
+            elif op == INDEX_OPERANDS:
+                container = slots[code[pc + 2]]
+                key = slots[code[pc + 3]]
+                if not 0 <= key < len(container):
+                    token = function.sites[code[pc + 1]]
+                    raise Exception("Index {} out of bounds of '{}' {}".format(key, token.value, position(token)))
+                push(container[key])
+                pc += 4
+            elif op == STORE_INDEX_OPERANDS:
+                container = slots[code[pc + 2]]
+                key = slots[code[pc + 3]]
+                if not 0 <= key < len(container):
+                    token = function.sites[code[pc + 1]]
+                    raise Exception("Index {} out of bounds of '{}' {}".format(key, token.value, position(token)))
+                container[key] = pop()
+                pc += 4
+            elif op == CALL:
+                if len(frames) >= CALL_STACK_LIMIT:
+                    raise Exception("Call stack overflow running '{}'".format(name))
+                frames.append((function, code, pc + 2, slots))
+                function, code = functions[code[pc + 1]]
+                arity = function.arity
+                if arity:
+                    slots = stack[-arity:]
+                    del stack[-arity:]
+                    slots += function.padding
+                else:
+                    slots = function.padding[:]
+                pc = 0
+            elif op == RETURN:
+                if not frames:
+                    return pop()
+                # The return value stays on the stack for the caller
+                function, code, pc, slots = frames.pop()
+            elif op == BINARY:
+                right = pop()
+                stack[-1] = operations[code[pc + 1]](stack[-1], right)
+                pc += 2
+            elif op == JUMP:
+                pc = code[pc + 1]
+            elif op == STORE_LOCAL:
+                slots[code[pc + 1]] = pop()
+                pc += 2
+            elif op == MOVE:
+                slots[code[pc + 1]] = slots[code[pc + 2]]
+                pc += 3
+            elif op == LOAD_CONST:
+                push(constants[code[pc + 1]])
+                pc += 2
+            elif op == JUMP_IF_FALSE:
+                pc = pc + 2 if pop() else code[pc + 1]
+            elif op == JUMP_IF_TRUE:
+                pc = code[pc + 1] if pop() else pc + 2
+            elif op == LOAD_GLOBAL:
+                push(global_slots[code[pc + 1]])
+                pc += 2
+            elif op == STORE_GLOBAL:
+                global_slots[code[pc + 1]] = pop()
+                pc += 2
+            elif op == INDEX:
+                key = pop()
+                container = stack[-1]
+                if not 0 <= key < len(container):
+                    token = function.sites[code[pc + 1]]
+                    raise Exception("Index {} out of bounds of '{}' {}".format(key, token.value, position(token)))
+                stack[-1] = container[key]
+                pc += 2
+            elif op == STORE_INDEX:
+                value = pop()
+                key = pop()
+                container = pop()
+                if not 0 <= key < len(container):
+                    token = function.sites[code[pc + 1]]
+                    raise Exception("Index {} out of bounds of '{}' {}".format(key, token.value, position(token)))
+                container[key] = value
+                pc += 2
+            elif op == FIELD:
+                stack[-1] = stack[-1][code[pc + 1]]
+                pc += 2
+            elif op == STORE_FIELD:
+                value = pop()
+                pop()[code[pc + 1]] = value
+                pc += 2
+            elif op == DIVIDE or op == REMAINDER:
+                right = pop()
+                if right == 0:
+                    raise Exception("Division by zero {}".format(position(function.sites[code[pc + 1]])))
+                stack[-1] = (divide if op == DIVIDE else remainder)(stack[-1], right)
+                pc += 2
+            elif op == NEGATE:
+                stack[-1] = -stack[-1]
+                pc += 1
+            elif op == NOT:
+                stack[-1] = not stack[-1]
+                pc += 1
+            elif op == POP:
+                pop()
+                pc += 1
+            elif op == DUP:
+                push(stack[-1])
+                pc += 1
+            elif op == DUP_TWO:
+                stack += stack[-2:]
+                pc += 1
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if stack[-1]:
+                    pop()
+                    pc += 2
+                else:
+                    pc = code[pc + 1]
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    pc = code[pc + 1]
+                else:
+                    pop()
+                    pc += 2
+            elif op == NEW:
+                push(copy_value(constants[code[pc + 1]]))
+                pc += 2
+            elif op == COPY:
+                stack[-1] = copy_value(stack[-1])
+                pc += 1
+            elif op == RANDOM:
+                # ?n is a random int from 0 to n - 1
+                if stack[-1] <= 0:
+                    token = function.sites[code[pc + 1]]
+                    raise Exception("Operator '?' needs a positive operand {}".format(position(token)))
+                stack[-1] = self.random.randrange(stack[-1])
+                pc += 2
+            else:
+                raise Exception("Unknown opcode {} in '{}'".format(op, function.name))
+
+def short_repr(value):
+    # Array and record templates can be long
+    if type(value) is list and len(value) > 4:
+        return "[{} x {}]".format(len(value), short_repr(value[0]))
+    return repr(value)
+
+def describe(program, function, kind, operand):
+    # What an operand of an instruction stands for
+    if kind == "constant":
+        return short_repr(program.constants[operand])
+    if kind == "slot":
+        if operand < len(function.slot_names):
+            return function.slot_names[operand]
+        return short_repr(function.padding[operand - function.arity])
+    if kind == "global":
+        return program.global_names[operand]
+    if kind == "operator":
+        return BINARY_OPERATORS[operand]
+    if kind == "site":
+        token = function.sites[operand]
+        return "{} {}".format(token.value, position(token))
+    if kind == "function":
+        return program.functions[operand].name
+    if kind == "target":
+        return "-> {}".format(operand)
+    return str(operand)
+
+def disassemble(program):
+    """A listing of every function of program, one instruction per line."""
+    lines = []
+    for function in [program.init] + program.functions:
+        lines.append("{} ({} parameters, {} locals, {} bytes):".format(
+            function.name, function.arity, len(function.slot_names), len(function.code) * function.code.itemsize))
+        for offset, opcode, operands in instructions(function.code):
+            described = [describe(program, function, kind, operand)
+                         for kind, operand in zip(OPERANDS[opcode], operands)]
+            lines.append("{:>6}  {:<22}{}".format(offset, OPCODE_NAMES[opcode], " ".join(described)).rstrip())
+        lines.append("")
+    return "\n".join(lines)
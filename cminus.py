@@ -4,47 +4,185 @@
 
 import argparse
 from scanner import Scanner
+from dfa_scanner import DFAScanner
+from streaming import StreamingScanner
+from tokenbuffer import CompactScanner
+from mapped_source import MappedSource, MappedScanner
+from parallel_scanner import ParallelScanner
+from token_cache import TokenCache, DEFAULT_CACHE_DIR
+from tree_file import save_program
 from parser import Parser
-from language import SymbolTable, TokenClass
+from iterative_parser import IterativeParser
+from precedence_parser import PrecedenceParser
+from parallel_parser import ParallelParser
+from language import SymbolTable, SyntaxOnlyHelpers
+from semantic import SemanticAnalyzer
+from folding import ConstantFolder
+from interpreter import Interpreter
+from bytecode import compile_program, VirtualMachine, disassemble
+from ir import build_program, format_program, IRInterpreter
+from optimizer import optimize_program
+from loops import LoopOptimizer, loop_passes
+from symbol_index import SymbolIndex
 
-def main(source_path):
+SCANNERS = {"classic": Scanner, "dfa": DFAScanner, "compact": CompactScanner,
+            "parallel": ParallelScanner}
+PARSERS = {"recursive": Parser, "iterative": IterativeParser, "precedence": PrecedenceParser,
+           "parallel": ParallelParser}
+
+def print_symbols(symbol_table):
+    for key, value in symbol_table.hashtable.items():
+        name = symbol_table.names[key]
+        if value[-1].declared:
+            print("Key: {0}  Scope: {1}  Type: {2}".format(name, value[-1].scope, value[-1].data_type))
+        else:
+            print("key: {0}, Scope: {1} ".format(name, value[-1].scope))
+
+def check_semantics(ast, symbol_table):
+    # Inline checks are off while parsing, the finished tree is checked instead
+    errors = SemanticAnalyzer(symbol_table, workers=None).analyze(ast)
+    for error in errors:
+        print(error)
+    return errors
+
+def fold_constants(ast):
+    folder = ConstantFolder()
+    folder.fold(ast)
+    print("Constant folding removed {} nodes ({} expressions folded, {} if/while pruned)".format(
+        folder.removed, folder.folded, folder.pruned))
+
+def optimize_ir(ast, show=False):
+    program = build_program(ast)
+    loops = LoopOptimizer()
+    manager = optimize_program(program, loop_passes(loops))
+    if show:
+        print(format_program(program))
+        print(loops.format_report())
+        print(manager.format_report())
+    return program
+
+def run_program(ast, runner="vm", listing=False):
+    if runner == "ir":
+        print("Program returned {}".format(IRInterpreter(optimize_ir(ast)).run()))
+        return
+    if runner == "tree" and not listing:
+        print("Program returned {}".format(Interpreter(ast).run()))
+        return
+    program = compile_program(ast)
+    if listing:
+        print(disassemble(program))
+    if runner is not None:
+        print("Program returned {}".format(VirtualMachine(program).run()))
+
+def backends(ast, fold, run, listing=False, show_ir=False):
+    # Only a program without syntax or semantic errors gets here
+    if fold:
+        fold_constants(ast)
+    if show_ir:
+        optimize_ir(ast, show=True)
+    if run or listing:
+        run_program(ast, run, listing)
+
+def parse_stream(source_path, symbol_table, parser_class=Parser, syntax_only=False, fold=False, run=None,
+                 listing=False, show_ir=False):
+    # Lexing and parsing are interleaved, the file is never fully loaded
+    with open(source_path) as source:
+        lexer = StreamingScanner(source, symbol_table)
+        parser = parser_class(symbol_table, lexer)
+        parser.semantic_helpers = SyntaxOnlyHelpers(symbol_table)
+        ast = parser.parse()
+    if len(lexer.error_list) > 0:
+        print("Lexical erros encountered!!")
+    for error in parser.error_list:
+        print(error)
+    if not syntax_only and not check_semantics(ast, symbol_table) and not parser.error_list:
+        backends(ast, fold, run, listing, show_ir)
+
+def main(source_path, scanner_mode="classic", streaming=False, mapped=False, cache_dir=DEFAULT_CACHE_DIR,
+         parser_mode="recursive", tree_path=None, syntax_only=False, fold=False, run=None,
+         listing=False, show_ir=False):
     # All exceptions should be captured here
     symbol_table = SymbolTable()
     try:
-        with open(source_path) as source:
-            code = source.readlines()
-        source.close()
-        lexer = Scanner(code, symbol_table)
-        lexer.scan()
+        if streaming:
+            parse_stream(source_path, symbol_table, PARSERS[parser_mode], syntax_only, fold, run, listing, show_ir)
+            return
+        if mapped:
+            # Tokens keep spans into the mapping, so it stays open until exit
+            lexer = MappedScanner(MappedSource(source_path), symbol_table)
+        else:
+            with open(source_path) as source:
+                code = source.readlines()
+            source.close()
+            lexer = SCANNERS[scanner_mode](code, symbol_table)
+        if cache_dir and not mapped:
+            TokenCache(cache_dir).scan(lexer)
+        else:
+            lexer.scan()
 
         if len(lexer.error_list) > 0:
             #TODO: Print error list in a nice way
             print("Lexical erros encountered!!")
         else:
-            parser = Parser(symbol_table, lexer)
+            parser = PARSERS[parser_mode](symbol_table, lexer)
+            parser.semantic_helpers = SyntaxOnlyHelpers(symbol_table)
             ast = parser.parse()
-            for key, value in symbol_table.hashtable.items():
-                print("Key: {0}  Scope: {1}  Type: {2}", key, value.scope, value.datatype)
+            if tree_path:
+                save_program(tree_path, ast, symbol_table, parser.error_list)
+            print_symbols(symbol_table)
             if len(parser.error_list) > 0:
                 for error in parser.error_list:
                     print(error)
+            if not syntax_only and not check_semantics(ast, symbol_table) and not parser.error_list:
+                backends(ast, fold, run, listing, show_ir)
     except Exception as e:
         print(e)
-        for key, value in symbol_table.hashtable.items():
-            # print(value)
-            if value[-1].token_class == TokenClass.ID and hasattr(value[-1], 'data_type'):
-                print("Key: {0}  Scope: {1}  Type: {2}".format(key, value[-1].scope, value[-1].data_type))
-            else:
-                print("key: {0}, Scope: {1} ".format(key, value[-1].scope))
+        print_symbols(symbol_table)
 
 # The source code file should be passed as command line parameter
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--file", help="Path to the C- source code file")
+    parser.add_argument("--file", nargs="+", help="Path to the C- source code file(s)")
+    parser.add_argument("--scanner", choices=sorted(SCANNERS), default="classic",
+                        help="Lexical analyzer implementation")
+    parser.add_argument("--parser", choices=sorted(PARSERS), default="recursive",
+                        help="Syntax analyzer implementation, iterative handles any nesting depth")
+    parser.add_argument("--save-tree", metavar="PATH",
+                        help="Write the syntax tree, symbol table and syntax errors to PATH (see tree_file.py)")
+    parser.add_argument("--syntax-only", action="store_true",
+                        help="Only parse, skip the semantic analysis of the syntax tree")
+    parser.add_argument("--fold", action="store_true",
+                        help="Fold constant expressions and prune constant if/while of a valid program (see folding.py)")
+    parser.add_argument("--run", nargs="?", const="vm", choices=["vm", "tree", "ir"],
+                        help="Run a valid program and print what main returns, compiled to bytecode (see bytecode.py), "
+                             "walking the syntax tree (see interpreter.py) or as optimized IR (see ir.py)")
+    parser.add_argument("--disassemble", action="store_true",
+                        help="Print the bytecode of a valid program")
+    parser.add_argument("--ir", action="store_true",
+                        help="Print the SSA IR of a valid program after the optimization passes, and what each pass "
+                             "did, loops included (see optimizer.py and loops.py)")
+    parser.add_argument("--index", metavar="DB",
+                        help="Record the declarations and name uses of every file in the SQLite database DB "
+                             "instead of compiling, unchanged files are skipped (see symbol_index.py)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Lex the file lazily while parsing (flat memory on huge inputs)")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Scan a memory map of the file by offset instead of reading its lines")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory of the token cache (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always scan the source, don't read or write the token cache")
     args = parser.parse_args()
     
-    if args.file:
-        main(args.file)
+    if args.file and args.index:
+        with SymbolIndex(args.index) as index:
+            for path in index.update(args.file):
+                print("Indexed {}".format(path))
+    elif args.file:
+        for path in args.file:
+            main(path, args.scanner, args.stream, args.mmap, None if args.no_cache else args.cache_dir,
+                 args.parser, args.save_tree, args.syntax_only, args.fold, args.run,
+                 args.disassemble, args.ir)
     else:
         #debug only
         main("./testfiles/semanticErrors.c")
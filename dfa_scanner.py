@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+from language import Token, TokenClass, PatternHelpers
+from scanner import Scanner
+
+# Character classes. The order of the checks in classify() is the same order
+# Scanner.scan tests its predicates, so both scanners agree on every char.
+OTHER, DIGIT, BLANK, QUOTE, SEPARATOR, SLASH, OPERATOR, ALPHA = range(8)
+CLASS_COUNT = 8
+
+# DFA states. STOP means the current lexeme ends before the char being read.
+STOP = -1
+START, IN_NUMBER, IN_WORD, IN_ALNUM, IN_BLANK, IN_CHAR, IN_SEPARATOR, \
+    IN_SLASH, IN_COMMENT, IN_OPERATOR, IN_ERROR = range(11)
+
+_helper = PatternHelpers()
+
+def classify(char):
+    if char.isdigit():
+        return DIGIT
+    if _helper.is_blank(char):
+        return BLANK
+    if char == "'":
+        return QUOTE
+    if _helper.is_separator(char):
+        return SEPARATOR
+    if char == "/":
+        return SLASH
+    if _helper.is_operator(char):
+        return OPERATOR
+    if char.isalpha():
+        return ALPHA
+    return OTHER
+
+def build_transitions():
+    table = [[STOP] * CLASS_COUNT for _ in range(IN_ERROR + 1)]
+    table[START] = [IN_ERROR, IN_NUMBER, IN_BLANK, IN_CHAR, IN_SEPARATOR,
+                    IN_SLASH, IN_OPERATOR, IN_WORD]
+    table[IN_NUMBER][DIGIT] = IN_NUMBER
+    table[IN_WORD][ALPHA] = IN_WORD
+    table[IN_WORD][DIGIT] = IN_ALNUM
+    table[IN_ALNUM][ALPHA] = IN_ALNUM
+    table[IN_ALNUM][DIGIT] = IN_ALNUM
+    table[IN_BLANK][BLANK] = IN_BLANK
+    table[IN_SLASH][SLASH] = IN_COMMENT
+    table[IN_COMMENT] = [IN_COMMENT] * CLASS_COUNT
+    return tuple(tuple(row) for row in table)
+
+class ClassMap(dict):
+    """str.translate table turning every char into its class code."""
+
+    def __missing__(self, code):
+        cls = classify(chr(code))
+        self[code] = cls
+        return cls
+
+# Precomputed once at import time
+CLASS_MAP = ClassMap((code, classify(chr(code))) for code in range(128))
+TRANSITIONS = build_transitions()
+TWO_CHAR_OPERATORS = frozenset(a + b for a in map(chr, range(128)) for b in map(chr, range(128))
+                               if _helper.is_operator(a) and _helper.is_operator(a + b))
+KEYWORDS = frozenset(["int", "record", "static", "bool", "char", "if",
+                      "else", "while", "return", "break", "true", "false"])
+LOGICAL_OPERATORS = frozenset(["and", "or", "not"])
+
+class DFAScanner(Scanner):
+    """Table-driven scanner. Produces the same tokens and errors as Scanner.scan."""
+
+    def scan_line(self, line, line_pos):
+        emit = self.emit
+        length = len(line)
+        # One C level pass maps the whole line to class codes (0-7)
+        classes = line.translate(CLASS_MAP).encode("latin-1")
+        position = 0
+        while position < length:
+            start = position
+            state = TRANSITIONS[START][classes[position]]
+            position += 1
+            alpha_end = None
+            row = TRANSITIONS[state]
+            while position < length:
+                next_state = row[classes[position]]
+                if next_state == STOP:
+                    break
+                if next_state != state:
+                    if next_state == IN_ALNUM:
+                        alpha_end = position
+                    state = next_state
+                    row = TRANSITIONS[state]
+                position += 1
+
+            if state == IN_BLANK or state == IN_COMMENT:
+                continue
+
+            if state == IN_WORD or state == IN_ALNUM:
+                if alpha_end is None:
+                    alpha_end = position
+                prefix = line[start:alpha_end]
+                if prefix in KEYWORDS:
+                    emit(TokenClass.KEYWORD, prefix, line_pos, alpha_end)
+                    position = alpha_end
+                elif prefix in LOGICAL_OPERATORS:
+                    emit(TokenClass.OPERATOR, prefix, line_pos, alpha_end)
+                    position = alpha_end
+                else:
+                    self.emit_id(line[start:position], line_pos, position)
+
+            elif state == IN_NUMBER:
+                if position < length and line[position].isalpha():
+                    self.register_error(line[position + 1], line_pos, position)
+                emit(TokenClass.NUMCONST, line[start:position], line_pos, position - 1)
+
+            elif state == IN_SEPARATOR:
+                emit(TokenClass.SEPARATOR, line[start], line_pos, position)
+
+            elif state == IN_OPERATOR or state == IN_SLASH:
+                if line[start:start + 2] in TWO_CHAR_OPERATORS:
+                    position += 1
+                emit(TokenClass.OPERATOR, line[start:position], line_pos, position)
+
+            elif state == IN_CHAR:
+                position = self.read_quoted(start, line_pos, line)
+
+            else:
+                self.register_error(line[start], line_pos, start)
+
+    def emit(self, token_class, value, line_pos, col):
+        self.tokens.append(Token(token_class, value, line_pos, col))
+
+    def emit_id(self, value, line_pos, col):
+        token = Token(TokenClass.ID, value, line_pos, col)
+        self.register_id(token)
+        self.tokens.append(token)
+
+    def register_id(self, token):
+        self.symbol_table.store(token)
+
+    def read_quoted(self, position, line_pos, line):
+        position += 1
+        if line[position] == "'":
+            self.emit(TokenClass.CHARCONST, '', line_pos, position)
+            return position + 1
+
+        value = line[position]
+        position += 1
+        if position < len(line) and line[position] == "'":
+            self.emit(TokenClass.CHARCONST, value, line_pos, position)
+            return position + 1
+        self.register_error(line[position - 1], line_pos, position)
+        return position + 1
+
+    def scan(self):
+        line_pos = 0
+        for line in self.code:
+            self.scan_line(line, line_pos)
+            line_pos += 1
+
+        if self.error_list:
+            for err in self.error_list:
+                print(err)
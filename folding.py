@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+import copy
+from language import *
+from precedence_parser import compact_program
+
+# Value of a local that is declared but not a known constant
+UNKNOWN = object()
+
+SCALAR_TYPES = {"int": int, "char": str, "bool": bool}
+
+def constant_value(token):
+    # Python value of a constant token: int, a one character str or bool
+    if token.token_class == TokenClass.NUMCONST:
+        return int(token.value)
+    if token.token_class == TokenClass.CHARCONST:
+        return token.value
+    return token.value == "true"
+
+def constant_leaf(value, at):
+    # A CONSTANT leaf for value, placed at the position of token `at`
+    if type(value) is bool:
+        token = Token(TokenClass.KEYWORD, "true" if value else "false", at.line - 1, at.column - 1)
+        data_type = "bool"
+    elif type(value) is int:
+        token = Token(TokenClass.NUMCONST, str(value), at.line - 1, at.column - 1)
+        data_type = "int"
+    else:
+        token = Token(TokenClass.CHARCONST, value, at.line - 1, at.column - 1)
+        data_type = "char"
+    leaf = LeafNode(SyntaxNodeTypes.CONSTANT, token)
+    leaf.data_type = data_type
+    return leaf
+
+def divide(left, right):
+    # C division truncates toward zero, Python's floors
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+def arithmetic(operator, left, right):
+    if operator == "+":
+        return left + right
+    if operator == "-":
+        return left - right
+    if operator == "*":
+        return left * right
+    if operator == "/":
+        return divide(left, right)
+    return left - right * divide(left, right)
+
+COMPARISONS = {
+    "<": lambda left, right: left < right,
+    "<=": lambda left, right: left <= right,
+    ">": lambda left, right: left > right,
+    ">=": lambda left, right: left >= right,
+    "==": lambda left, right: left == right,
+    "!=": lambda left, right: left != right,
+}
+
+def known(node):
+    # The constant a node stands for, UNKNOWN when it isn't one
+    if isinstance(node, LeafNode) and node.type == SyntaxNodeTypes.CONSTANT:
+        return constant_value(node.token)
+    return UNKNOWN
+
+def pure(node):
+    # Whether evaluating node can be skipped: no calls, assignments or '?'
+    for child in walk(node):
+        if child.type in (SyntaxNodeTypes.CALL, SyntaxNodeTypes.EXPRESSION):
+            return False
+        if isinstance(child, UnaryNode) and child.op.value == "?":
+            return False
+    return True
+
+def assigned_names(node):
+    # Names of the plain variables assigned anywhere under node
+    return {child.mutable.token.value for child in walk(node)
+            if child.type == SyntaxNodeTypes.EXPRESSION and isinstance(getattr(child, "mutable", None), LeafNode)}
+
+def empty_statement(at):
+    # What the parser builds for a lone ';'
+    node = SyntaxNode(SyntaxNodeTypes.STATEMENT)
+    node.expression_stmt = SyntaxNode(SyntaxNodeTypes.EXPRESSION_STATEMENT)
+    node.expression_stmt.expression = Token(TokenClass.SEPARATOR, ";", at.line - 1, at.column - 1)
+    return node
+
+def statement_token(node):
+    # Any token of a statement, to place what replaces it
+    for child in walk(node):
+        for name in child.fields:
+            value = getattr(child, name, None)
+            if isinstance(value, Token):
+                return value
+    return Token(TokenClass.SEPARATOR, ";", 0, 0)
+
+class ConstantFolder():
+    """Folds constant expressions and propagates constant locals.
+
+    Runs on a tree the semantic pass accepted. Concrete expressions are made
+    compact first (see precedence_parser.compact), then operators whose
+    operands are constants become CONSTANT leaves, locals of type int,
+    char or bool are replaced by their value where it is known on every
+    path, and if/while statements with a constant condition are reduced to
+    the branch that runs. Globals are never propagated: any call may change
+    them. Statements are visited recursively like in SemanticAnalyzer,
+    expressions without recursion.
+
+    After fold(), `removed` is how many tree nodes are gone, `folded` how
+    many expressions became constants and `pruned` how many if/while
+    statements were reduced.
+    """
+
+    def __init__(self):
+        self.removed = 0
+        self.folded = 0
+        self.pruned = 0
+        # One dict per open scope, local name to value or UNKNOWN
+        self.frames = []
+
+    def fold(self, tree):
+        """Folds the whole program in place, returns the number of nodes removed."""
+        compact_program(tree)
+        before = sum(1 for _ in walk(tree))
+        for declaration in top_level_declarations(tree):
+            if getattr(declaration, "var_declaration", None) is not None:
+                # Global initializers only fold their own constants
+                self.frames = []
+                self.var_declaration(declaration.var_declaration.type_specifier,
+                                     declaration.var_declaration.var_declaration_list)
+            elif getattr(declaration, "fun_declaration", None) is not None:
+                node = declaration.fun_declaration
+                self.frames = [{}]
+                if getattr(node, "statement", None) is not None:
+                    node.statement = self.required(self.statement(node.statement), node.statement)
+        self.frames = []
+        self.removed = before - sum(1 for _ in walk(tree))
+        return self.removed
+
+    # Locals
+
+    def lookup(self, name):
+        for frame in reversed(self.frames):
+            if name in frame:
+                return frame[name]
+        return UNKNOWN
+
+    def assign(self, name, value):
+        # Globals and parameters are in no frame, they stay unknown
+        for frame in reversed(self.frames):
+            if name in frame:
+                frame[name] = value
+                return
+
+    def forget(self, names):
+        for frame in self.frames:
+            for name in names:
+                if name in frame:
+                    frame[name] = UNKNOWN
+
+    def snapshot(self):
+        return [dict(frame) for frame in self.frames]
+
+    def merge(self, other):
+        # Keeps the values both paths agree on
+        for frame, other_frame in zip(self.frames, other):
+            for name, value in frame.items():
+                theirs = other_frame.get(name, UNKNOWN)
+                # True == 1, so the types must agree too
+                if theirs is not value and (type(theirs) is not type(value) or theirs != value):
+                    frame[name] = UNKNOWN
+
+    # Declarations
+
+    def var_declaration(self, type_specifier, var_decl_list):
+        data_type = getattr(getattr(type_specifier, "return_type_specifier", None), "return_type_specifier", None)
+        scalar = SCALAR_TYPES.get(data_type.value) if data_type is not None else None
+        if var_decl_list is None:
+            return
+        declarations = [var_decl_list.var_decl_initialize]
+        declarations += getattr(var_decl_list.list_var_decl, "list_var_decl", None) or []
+        for declaration in declarations:
+            token = getattr(declaration.var_decl_id, "id", None)
+            array = getattr(declaration.var_decl_id.id_decl_var, "id_decl_var", None) is not None
+            initialize = declaration.initialize_decl_var
+            value = UNKNOWN
+            if getattr(initialize, "simple_expression", None) is not None:
+                initialize.simple_expression = self.expression(initialize.simple_expression)
+                value = known(initialize.simple_expression)
+            if token is not None and self.frames:
+                if array or scalar is None or type(value) is not scalar:
+                    value = UNKNOWN
+                self.frames[-1][token.value] = value
+
+    # Statements
+
+    def required(self, node, replaced):
+        # Statement fields can't be empty, a removed statement becomes ';'
+        return node if node is not None else empty_statement(statement_token(replaced))
+
+    def statement(self, node):
+        """Folds a STATEMENT, returns what replaces it, None when it goes away."""
+        if node.type != SyntaxNodeTypes.STATEMENT:
+            return node
+        if getattr(node, "compound_stmt", None) is not None:
+            self.compound(node.compound_stmt)
+        elif getattr(node, "expression_stmt", None) is not None:
+            statement = node.expression_stmt
+            if isinstance(getattr(statement, "expression", None), SyntaxNode):
+                statement.expression = self.assignment(statement.expression)
+        elif getattr(node, "selection_stmt", None) is not None:
+            return self.selection(node, node.selection_stmt)
+        elif getattr(node, "iteration_stmt", None) is not None:
+            return self.iteration(node, node.iteration_stmt)
+        elif getattr(node, "return_statement", None) is not None:
+            statement = node.return_statement
+            if getattr(statement, "expression", None) is not None:
+                statement.expression = self.expression(statement.expression)
+        return node
+
+    def compound(self, node):
+        self.frames.append({})
+        for declaration in getattr(getattr(node, "local_declarations", None), "declarations_local", None) or []:
+            self.var_declaration(declaration.scoped_type_specifier.type_specifier, declaration.var_decl_list)
+        statement_list = getattr(node, "statement_list", None)
+        list_statement = getattr(statement_list, "list_statement", None)
+        statements = getattr(list_statement, "statement", None)
+        if statements is not None:
+            kept = []
+            for statement in statements:
+                statement = self.statement(statement)
+                if statement is not None:
+                    kept.append(statement)
+            if kept:
+                list_statement.statement = kept
+            else:
+                del list_statement.statement
+        self.frames.pop()
+
+    def selection(self, node, statement):
+        statement.simple_expression = self.expression(statement.simple_expression)
+        condition = known(statement.simple_expression)
+        otherwise = getattr(getattr(statement, "stmt_selection", None), "statement", None)
+        if type(condition) is bool:
+            self.pruned += 1
+            taken = statement.statement if condition else otherwise
+            return self.statement(taken) if taken is not None else None
+        before = self.snapshot()
+        statement.statement = self.required(self.statement(statement.statement), statement.statement)
+        after_then = self.frames
+        self.frames = before
+        if otherwise is not None:
+            statement.stmt_selection.statement = self.required(self.statement(otherwise), otherwise)
+        self.merge(after_then)
+        return node
+
+    def iteration(self, node, statement):
+        if pure(statement.simple_expression):
+            # A loop whose condition is false on entry never runs, test a copy
+            folded = self.folded
+            entry_test = known(self.rewrite(copy.deepcopy(statement.simple_expression)))
+            self.folded = folded
+            if entry_test is False:
+                self.pruned += 1
+                return None
+        # Whatever the loop assigns is unknown from its first test on
+        self.forget(assigned_names(statement))
+        statement.simple_expression = self.expression(statement.simple_expression)
+        entry = self.snapshot()
+        statement.statement = self.required(self.statement(statement.statement), statement.statement)
+        self.frames = entry
+        return node
+
+    # Expressions
+
+    def assignment(self, node):
+        # An expression statement, the target takes the new value afterwards
+        target = getattr(node, "mutable", None)
+        op = getattr(node, "op", None)
+        if op is None or not isinstance(target, LeafNode):
+            return self.expression(node)
+        name = target.token.value
+        self.forget(assigned_names(getattr(node, "expression", None)))
+        current = self.lookup(name)
+        node = self.rewrite(node)
+        value = known(getattr(node, "expression", None))
+        if op.value == "=":
+            current = value
+        elif op.value in ("++", "--"):
+            current = current + (1 if op.value == "++" else -1) if type(current) is int else UNKNOWN
+        elif type(current) is int and type(value) is int and (op.value != "/=" or value != 0):
+            current = arithmetic(op.value[0], current, value)
+        else:
+            current = UNKNOWN
+        self.assign(name, current)
+        return node
+
+    def expression(self, node):
+        """Folds an expression, returns the node that replaces it."""
+        # Variables it assigns are not known anywhere in it, nor after it
+        self.forget(assigned_names(node))
+        return self.rewrite(node)
+
+    def rewrite(self, node):
+        # Children first, each replaced by what it folded to
+        if node is None:
+            return None
+        replaced = {}
+        for child in reversed(list(walk(node))):
+            for name in child.fields:
+                value = getattr(child, name, None)
+                if type(value) is list:
+                    setattr(child, name, [replaced.get(id(item), item) for item in value])
+                elif isinstance(value, SyntaxNode):
+                    if name == "mutable" and child.type == SyntaxNodeTypes.EXPRESSION and isinstance(value, LeafNode):
+                        # An assignment target keeps its name
+                        continue
+                    setattr(child, name, replaced.get(id(value), value))
+            result = self.fold_node(child)
+            if result is not child:
+                replaced[id(child)] = result
+        return replaced.get(id(node), node)
+
+    def fold_node(self, node):
+        if isinstance(node, BinaryNode):
+            return self.binary(node)
+        if isinstance(node, UnaryNode):
+            return self.unary(node)
+        if isinstance(node, LeafNode) and node.type == SyntaxNodeTypes.MUTABLE:
+            value = self.lookup(node.token.value)
+            if value is not UNKNOWN:
+                return constant_leaf(value, node.token)
+        return node
+
+    def binary(self, node):
+        operator = node.op.value
+        left = known(node.left)
+        right = known(node.right)
+        if operator in ("and", "or"):
+            # C- evaluates the right operand only when it decides the result
+            deciding = operator == "or"
+            if type(left) is bool:
+                self.folded += 1
+                return constant_leaf(deciding, node.op) if left is deciding else node.right
+            if type(right) is bool:
+                if right is not deciding:
+                    # x and true, x or false
+                    self.folded += 1
+                    return node.left
+                if pure(node.left):
+                    self.folded += 1
+                    return constant_leaf(deciding, node.op)
+            return node
+        if left is UNKNOWN or right is UNKNOWN:
+            return node
+        if operator in COMPARISONS:
+            if type(left) is not type(right) or type(left) is bool and operator not in ("==", "!="):
+                return node
+            self.folded += 1
+            return constant_leaf(COMPARISONS[operator](left, right), node.op)
+        if type(left) is not int or type(right) is not int or operator in ("/", "%") and right == 0:
+            # Division by zero is left for run time
+            return node
+        self.folded += 1
+        return constant_leaf(arithmetic(operator, left, right), node.op)
+
+    def unary(self, node):
+        operator = node.op.value
+        operand = known(node.operand)
+        if operator == "not" and type(operand) is bool:
+            self.folded += 1
+            return constant_leaf(not operand, node.op)
+        if operator == "-" and type(operand) is int:
+            self.folded += 1
+            return constant_leaf(-operand, node.op)
+        return node
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+from language import TokenClass
+
+# C- as the parser implements it: the reference grammar with left recursion
+# removed and common prefixes factored out. Names starting with a lower case
+# letter are nonterminals, everything else is a terminal: token values, plus
+# ID, NUMCONST and CHARCONST which stand for whole token classes.
+GRAMMAR_TEXT = """
+program -> declarationList
+declarationList -> declaration listDeclaration
+listDeclaration -> declaration listDeclaration | EPSILON
+declaration -> varDeclaration | funDeclaration | recDeclaration
+recDeclaration -> record ID { localDeclarations }
+varDeclaration -> typeSpecifier varDeclList ;
+scopedVarDeclaration -> scopedTypeSpecifier varDeclList ;
+varDeclList -> varDeclInitialize listVarDecl
+listVarDecl -> , varDeclInitialize listVarDecl | EPSILON
+varDeclInitialize -> varDeclId initializeDeclVar
+initializeDeclVar -> = simpleExpression | EPSILON
+varDeclId -> ID idDeclVar
+idDeclVar -> [ NUMCONST ] | EPSILON
+scopedTypeSpecifier -> static typeSpecifier | typeSpecifier
+typeSpecifier -> returnTypeSpecifier | ID
+returnTypeSpecifier -> int | bool | char
+funDeclaration -> typeSpecifier ID ( params ) statement | ID ( params ) statement
+params -> paramList | EPSILON
+paramList -> paramTypeList listParam
+listParam -> ; paramTypeList listParam | EPSILON
+paramTypeList -> typeSpecifier paramIdList
+paramIdList -> paramId listIdParam
+listIdParam -> , paramId listIdParam | EPSILON
+paramId -> ID idParam
+idParam -> [ ] | EPSILON
+statement -> expressionStmt | compoundStmt | selectionStmt | iterationStmt | returnStmt | breakStmt
+expressionStmt -> expression ; | ;
+compoundStmt -> { localDeclarations statementList }
+localDeclarations -> scopedVarDeclaration localDeclarations | EPSILON
+statementList -> statement statementList | EPSILON
+selectionStmt -> if ( simpleExpression ) statement stmtSelection
+stmtSelection -> else statement | EPSILON
+iterationStmt -> while ( simpleExpression ) statement
+returnStmt -> return ; | return expression ;
+breakStmt -> break ;
+expression -> mutable expressionTail | simpleExpression
+expressionTail -> = expression | += expression | -= expression | *= expression | /= expression | ++ | -- | expressionSum
+simpleExpression -> andExpression expressionSimple
+expressionSimple -> or andExpression expressionSimple | EPSILON
+andExpression -> unaryRelExpression expressionAnd
+expressionAnd -> and unaryRelExpression expressionAnd | EPSILON
+unaryRelExpression -> not unaryRelExpression | relExpression
+relExpression -> sumExpression expressionRel
+expressionRel -> relop sumExpression | EPSILON
+relop -> <= | < | > | >= | == | !=
+sumExpression -> term expressionSum
+expressionSum -> sumop term expressionSum | EPSILON
+sumop -> + | -
+term -> unaryExpression newTerm
+newTerm -> mulop unaryExpression newTerm | EPSILON
+mulop -> * | / | %
+unaryExpression -> unaryop unaryExpression | factor
+unaryop -> - | * | ?
+factor -> immutable | mutable
+mutable -> ID newMutable
+newMutable -> [ expression ] newMutable | . ID newMutable | EPSILON
+immutable -> ( expression ) | call | constant
+call -> ID ( args )
+args -> argList | EPSILON
+argList -> expression listArg
+listArg -> , expression listArg | EPSILON
+constant -> NUMCONST | CHARCONST | true | false
+"""
+
+START = "program"
+END = "$"
+# Tokens of lookahead the prediction table may use
+MAX_K = 3
+
+CLASS_TERMINALS = {TokenClass.ID: "ID", TokenClass.NUMCONST: "NUMCONST",
+                   TokenClass.CHARCONST: "CHARCONST"}
+
+def read_grammar(text):
+    """Returns {nonterminal: [production, ...]}, productions are tuples of symbols."""
+    grammar = {}
+    for line in text.strip().splitlines():
+        head, body = line.split("->")
+        productions = grammar.setdefault(head.strip(), [])
+        for alternative in body.split(" | "):
+            symbols = tuple(symbol for symbol in alternative.split() if symbol != "EPSILON")
+            productions.append(symbols)
+    return grammar
+
+def terminal_of(token):
+    if token is None:
+        return END
+    return CLASS_TERMINALS.get(token.token_class) or token.value
+
+def concat(k, left, right):
+    """k-truncated concatenation of two sets of terminal tuples.
+
+    right[j] is the right hand set truncated to j terminals, for 1 <= j <= k.
+    """
+    result = set()
+    for prefix in left:
+        room = k - len(prefix)
+        if room <= 0 or (prefix and prefix[-1] == END):
+            result.add(prefix)
+            continue
+        result.update([prefix + suffix for suffix in right[room]])
+    return result
+
+class Grammar():
+    """FIRST_k/FOLLOW_k sets and a strong LL(k) prediction table for a grammar.
+
+    Every decision looks at as few tokens as it needs: one token when that
+    is enough, more only in the cells where the productions share a prefix.
+    Cells that stay ambiguous after k tokens are resolved in favour of the
+    production written first and recorded in `conflicts`.
+    """
+
+    def __init__(self, productions, start, k=MAX_K):
+        self.productions = productions
+        self.start = start
+        self.k = k
+        # first_levels[head][j] is FIRST_j(head), same for follow; level 0 is unused.
+        # Sets are computed one level at a time so truncating them is a lookup
+        self.terminal_levels = {}
+        self.first_levels = {head: [set() for _ in range(k + 1)] for head in productions}
+        self.follow_levels = {head: [set() for _ in range(k + 1)] for head in productions}
+        for level in range(1, k + 1):
+            self.compute_first(level)
+        for level in range(1, k + 1):
+            self.compute_follow(level)
+        self.first = {head: sets[k] for head, sets in self.first_levels.items()}
+        self.follow = {head: sets[k] for head, sets in self.follow_levels.items()}
+        self.conflicts = []
+        self.table = {head: self.build_row(head) for head in productions}
+
+    def is_nonterminal(self, symbol):
+        return symbol in self.productions
+
+    def levels(self, symbol):
+        if self.is_nonterminal(symbol):
+            return self.first_levels[symbol]
+        levels = self.terminal_levels.get(symbol)
+        if levels is None:
+            levels = self.terminal_levels[symbol] = [{(symbol,)}] * (self.k + 1)
+        return levels
+
+    def first_of(self, symbols, level=None):
+        level = level or self.k
+        result = {()}
+        for symbol in symbols:
+            result = concat(level, result, self.levels(symbol))
+            if not result:
+                break
+        return result
+
+    def compute_first(self, level):
+        changed = True
+        while changed:
+            changed = False
+            for head, productions in self.productions.items():
+                first = self.first_levels[head][level]
+                size = len(first)
+                for production in productions:
+                    first |= self.first_of(production, level)
+                changed = changed or len(first) != size
+
+    def compute_follow(self, level):
+        self.follow_levels[self.start][level].add((END,))
+        # FIRST is final by now, so the FIRST of every production suffix is too
+        rests = {}
+        changed = True
+        while changed:
+            changed = False
+            for head, productions in self.productions.items():
+                for production in productions:
+                    for position, symbol in enumerate(production):
+                        if not self.is_nonterminal(symbol):
+                            continue
+                        rest = rests.get((production, position))
+                        if rest is None:
+                            rest = rests[production, position] = self.first_of(production[position + 1:], level)
+                        follow = self.follow_levels[symbol][level]
+                        new = concat(level, rest, self.follow_levels[head]) - follow
+                        if new:
+                            follow |= new
+                            changed = True
+
+    def lookaheads(self, head, production, level=None):
+        level = level or self.k
+        return concat(level, self.first_of(production, level), self.follow_levels[head])
+
+    def build_row(self, head, candidates=None, prefix=()):
+        # Looks one token further only in the cells that are still ambiguous
+        productions = self.productions[head]
+        level = len(prefix) + 1
+        cells = {}
+        for index in candidates or range(len(productions)):
+            for lookahead in self.lookaheads(head, productions[index], level):
+                if lookahead[:-1] == prefix:
+                    cells.setdefault(lookahead[-1], set()).add(index)
+
+        row = {}
+        for terminal, indices in cells.items():
+            if len(indices) > 1 and level < self.k and terminal != END:
+                row[terminal] = self.build_row(head, sorted(indices), prefix + (terminal,))
+                continue
+            if len(indices) > 1:
+                self.conflicts.append((head, prefix + (terminal,), sorted(indices)))
+            row[terminal] = productions[min(indices)]
+        return row
+
+    def depth(self, row):
+        # Tokens of lookahead the deepest decision of a row needs
+        return 1 + max([self.depth(entry) for entry in row.values() if type(entry) is dict] or [0])
+
+    def conflict_report(self):
+        """Human readable summary of how far the grammar is from LL(1)."""
+        depths = {}
+        for head, row in self.table.items():
+            depths.setdefault(self.depth(row), []).append(head)
+        lines = ["{} nonterminals".format(len(self.table))]
+        for depth in sorted(depths):
+            lines.append("LL({}): {}".format(depth, ", ".join(sorted(depths[depth]))))
+
+        # The same ambiguity usually shows up under many lookaheads, report it once
+        grouped = {}
+        for head, lookahead, candidates in self.conflicts:
+            grouped.setdefault((head, tuple(candidates)), []).append(lookahead)
+        lines.append("{} ambiguous cells after {} tokens".format(len(self.conflicts), self.k))
+        for (head, candidates), lookaheads in grouped.items():
+            alternatives = " | ".join(" ".join(self.productions[head][index]) or "EPSILON"
+                                      for index in candidates)
+            example = " ".join(min(lookaheads))
+            lines.append("  {}: {} ({} lookaheads, e.g. '{}'), first one wins".format(
+                head, alternatives, len(lookaheads), example))
+        return lines
+
+C_MINUS = Grammar(read_grammar(GRAMMAR_TEXT), START)
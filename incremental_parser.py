@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+from language import *
+from parser import Parser
+
+class DeclarationRecord():
+    """What parsing one top level declaration produced besides its node."""
+    __slots__ = ("start", "end", "symbols", "errors", "state")
+
+    def __init__(self, start, end, symbols, errors, state):
+        # [start, end) token range, end is the first token of what follows
+        self.start = start
+        self.end = end
+        # (key, Symbol) of the scope 1 names it declared
+        self.symbols = symbols
+        # (token, expected) of its syntax errors
+        self.errors = errors
+        # last_* fields of the parser when it started
+        self.state = state
+
+class IncrementalParser(Parser):
+    """Parser that brings a tree up to date after an edit of its tokens.
+
+    parse() remembers, for every top level declaration, its token range, the
+    global names it declared, its syntax errors and the parser state it
+    started with. reparse(tree, diff) then takes the TokenDiff of
+    IncrementalScanner.relex and parses again only the declarations the edit
+    touched, reusing the nodes of every other one, so the cost follows the
+    size of the edited function and not the size of the file.
+
+    Names are visible to a reparsed declaration exactly as in a full parse:
+    the global names of the declarations before it are put back in scope
+    first, the ones after it are not, and are checked against what it
+    declared once it is parsed.
+    """
+
+    def __init__(self, symbol_table, scanner):
+        super().__init__(symbol_table, scanner)
+        self.records = []
+        self.error_records = []
+
+    def register_error(self, token, expected):
+        self.error_records.append((token, expected))
+        super().register_error(token, expected)
+
+    def format_errors(self):
+        # Tokens after an edit have moved, so messages are built again from them
+        self.error_list = []
+        for record in self.records:
+            for token, expected in record.errors:
+                super().register_error(token, expected)
+
+    def parse(self):
+        self.records = []
+        return super().parse()
+
+    def declaration(self):
+        node, record = self.parse_declaration()
+        self.records.append(record)
+        return node
+
+    def parse_declaration(self):
+        state = (self.last_data_type, self.last_constant, self.last_id, self.last_func_id)
+        start = self.scanner.last_token
+        journal = self.symbol_table.journal = []
+        self.error_records = []
+        try:
+            node = super().declaration()
+        finally:
+            self.symbol_table.journal = None
+        end = self.scanner.last_token
+        if end == len(self.scanner.tokens) - 1 and self.current_token is self.scanner.tokens[end]:
+            # next_token could not move past the last token, it is consumed
+            end += 1
+        symbols = [(key, symbol) for key, symbol in journal if symbol.scope == 1]
+        return node, DeclarationRecord(start, end, symbols, self.error_records, state)
+
+    def starts_declaration(self):
+        return self.helpers.is_data_type(self.current_token.value) or self.current_token.value == "record"
+
+    def reparse(self, tree, diff):
+        """Parses again the top level declarations the edit in `diff` touched.
+
+        `tree` is what parse() returned before the edit; its DECLARATION_LIST
+        is updated in place. Returns the range of indices, in the new list,
+        of the declarations that were parsed again.
+        """
+        records = self.records
+        if not records or not hasattr(tree, "declaration_list"):
+            fresh = self.fresh_parse(tree)
+            return range(len(top_level_declarations(fresh)))
+
+        edit_start = diff.start
+        delta = len(diff.inserted) - len(diff.removed)
+        edit_end = edit_start + len(diff.inserted)
+        tokens = self.scanner.tokens
+
+        # Declarations overlapping or touching the edit, in old positions
+        first = 0
+        while first < len(records) - 1 and records[first].end < edit_start:
+            first += 1
+        last = first + 1
+        while last < len(records) and records[last].start < edit_start + len(diff.removed):
+            last += 1
+        for record in records[last:]:
+            record.start += delta
+            record.end += delta
+        start = records[first].start
+
+        table = self.symbol_table
+        scope = table.current_scope
+        table.push_scope()
+        for record in records[:first]:
+            for key, symbol in record.symbols:
+                table.declare(key, symbol)
+        self.last_data_type, self.last_constant, self.last_id, self.last_func_id = records[first].state
+
+        nodes = []
+        fresh = []
+        following = last
+        try:
+            self.scanner.last_token = start - 1
+            self.current_token = self.scanner.next_token() if start < len(tokens) else None
+            while self.current_token is not None and (first == 0 and not fresh or self.starts_declaration()):
+                node, record = self.parse_declaration()
+                nodes.append(node)
+                fresh.append(record)
+                # Old declarations this one ran into are gone
+                while following < len(records) and records[following].start < record.end:
+                    following += 1
+                if record.end >= len(tokens):
+                    break
+                if following < len(records) and records[following].start == record.end and record.end >= edit_end:
+                    break
+            else:
+                # The list stops here in a full parse too, nothing after is kept
+                following = len(records)
+            if fresh and fresh[-1].end >= len(tokens):
+                following = len(records)
+            # The kept declarations now come after the parsed ones, their
+            # globals are declared again so a name the edit added clashes
+            # with them as it would in a full parse
+            for record in records[following:]:
+                for key, symbol in record.symbols:
+                    table.store_symbol(symbol)
+        finally:
+            while table.current_scope > scope:
+                table.kill_scope()
+
+        declarations = top_level_declarations(tree)
+        kept = declarations[following:] if following < len(records) else []
+        declarations[first:] = nodes + kept
+        records[first:] = fresh + (records[following:] if following < len(records) else [])
+        self.splice(tree, declarations)
+        self.format_errors()
+        return range(first, first + len(nodes))
+
+    def fresh_parse(self, tree):
+        self.scanner.last_token = -1
+        self.records = []
+        fresh = self.parse() if self.scanner.tokens else SyntaxNode(SyntaxNodeTypes.PROGRAM)
+        if hasattr(fresh, "declaration_list"):
+            tree.declaration_list = fresh.declaration_list
+        elif hasattr(tree, "declaration_list"):
+            del tree.declaration_list
+        self.format_errors()
+        return fresh
+
+    def splice(self, tree, declarations):
+        if not declarations:
+            del tree.declaration_list
+            return
+        declaration_list = tree.declaration_list
+        declaration_list.declaration = declarations[0]
+        if len(declarations) == 1:
+            declaration_list.list_declaration = None
+            return
+        if declaration_list.list_declaration is None:
+            declaration_list.list_declaration = SyntaxNode(SyntaxNodeTypes.LIST_DECLARATION)
+        declaration_list.list_declaration.list_declaration = declarations[1:]
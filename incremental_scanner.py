@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_right
+from itertools import accumulate, chain
+from language import Token, TokenClass
+from dfa_scanner import DFAScanner
+
+# Lines of a LineSpan, an edit renumbers the lines of at most two spans
+SPAN_LINES = 256
+# Tokens of a TokenList chunk, an edit copies the tokens of the chunks it touches
+CHUNK_TOKENS = 512
+
+class LineSpan():
+    """A run of consecutive source lines, `first` is the 0 based number of the first one."""
+    __slots__ = ("first", "lines")
+
+    def __init__(self, first, lines):
+        self.first = first
+        self.lines = lines
+        for offset, line in enumerate(lines):
+            line.span = self
+            line.offset = offset
+
+class SourceLine():
+    # A line is its span's first line plus offset
+    __slots__ = ("span", "offset")
+
+class LineToken(Token):
+    """Token whose line number is read through the source line it was scanned on.
+
+    An edit above it moves the line by renumbering spans, the token itself
+    never changes.
+    """
+    __slots__ = ("source_line",)
+
+    def __init__(self, token_class, value, source_line, column):
+        TokenClass.validate(token_class)
+        self.token_class = token_class
+        self.value = value
+        self.source_line = source_line
+        self.column = column + 1
+
+    @property
+    def line(self):
+        source_line = self.source_line
+        return source_line.span.first + source_line.offset + 1
+
+def split_spans(first, lines):
+    # Spans of at most SPAN_LINES lines, numbered from `first`
+    return [LineSpan(first + start, lines[start:start + SPAN_LINES]) for start in range(0, len(lines), SPAN_LINES)]
+
+def chunk_tokens(tokens):
+    return [tuple(tokens[start:start + CHUNK_TOKENS]) for start in range(0, len(tokens), CHUNK_TOKENS)]
+
+class TokenList():
+    """Token sequence that is never changed, stored as tuples of up to CHUNK_TOKENS tokens.
+
+    replace returns a new TokenList sharing every chunk the edit doesn't
+    touch, so an edit costs the chunks it touches plus one index per chunk.
+    """
+    __slots__ = ("chunks", "starts", "length")
+
+    def __init__(self, chunks, starts=None, length=None):
+        self.chunks = chunks
+        # Index of the first token of every chunk
+        if starts is None:
+            starts = [0]
+            starts.extend(accumulate(len(chunk) for chunk in chunks))
+            length = starts.pop()
+        self.starts = starts
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain.from_iterable(self.chunks)
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            return [self[position] for position in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("No token {}, there are {}".format(index, self.length))
+        chunk = bisect_right(self.starts, index) - 1
+        return self.chunks[chunk][index - self.starts[chunk]]
+
+    def replace(self, first, last, inserted):
+        """New TokenList with tokens [first, last) replaced by inserted."""
+        chunks = self.chunks
+        if not chunks:
+            return TokenList(chunk_tokens(inserted))
+        low = bisect_right(self.starts, first) - 1
+        high = max(low, bisect_right(self.starts, last - 1) - 1)
+        start = self.starts[low]
+        tokens = [token for chunk in chunks[low:high + 1] for token in chunk]
+        tokens[first - start:last - start] = inserted
+        replaced = chunk_tokens(tokens)
+        # Chunks after the edit keep their tokens and move by the same count
+        delta = len(inserted) - (last - first)
+        starts = self.starts[:low]
+        starts.extend(range(start, start + len(tokens), CHUNK_TOKENS))
+        starts.extend(map(delta.__add__, self.starts[high + 1:]))
+        return TokenList(chunks[:low] + replaced + chunks[high + 1:], starts, self.length + delta)
+
+def first_token_at(tokens, line_pos):
+    # Index of the first token on line_pos or after it, tokens are sorted by line
+    low, high = 0, len(tokens)
+    while low < high:
+        middle = (low + high) // 2
+        if tokens[middle].line - 1 < line_pos:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+class TokenDiff():
+    """Token level result of an edit: tokens[start:start + len(removed)] became inserted."""
+    __slots__ = ("start", "removed", "inserted", "line_delta")
+
+    def __init__(self, start, removed, inserted, line_delta):
+        self.start = start
+        self.removed = removed
+        self.inserted = inserted
+        self.line_delta = line_delta
+
+    def __repr__(self):
+        return "TokenDiff at {}: -{} +{} tokens, lines shifted by {}".format(
+            self.start, len(self.removed), len(self.inserted), self.line_delta)
+
+class IncrementalScanner(DFAScanner):
+    """Scanner that can re-lex only the lines touched by an edit.
+
+    Scanning is line local, so an edit of lines [start_line, end_line) can
+    only change the tokens of those lines; tokens after them keep their
+    value and only move by the number of lines added or removed. Tokens
+    are LineTokens, so that move is a change of the `first` line of every
+    later LineSpan, not of every later token.
+    """
+
+    def __init__(self, source_code, symbol_table):
+        super().__init__(list(source_code), symbol_table)
+        # (lexeme, line_pos, col) of every lexical error, sorted by line
+        self.error_records = []
+        self.spans = []
+        # SourceLine of the line scan_line is reading
+        self.source_line = None
+
+    def scan(self):
+        lines = [SourceLine() for _ in self.code]
+        self.spans = split_spans(0, lines)
+        for line_pos, line in enumerate(self.code):
+            self.source_line = lines[line_pos]
+            self.scan_line(line, line_pos)
+        self.tokens = TokenList(chunk_tokens(self.tokens))
+
+        if self.error_list:
+            for err in self.error_list:
+                print(err)
+
+    def emit(self, token_class, value, line_pos, col):
+        self.tokens.append(LineToken(token_class, value, self.source_line, col))
+
+    def emit_id(self, value, line_pos, col):
+        token = LineToken(TokenClass.ID, value, self.source_line, col)
+        self.register_id(token)
+        self.tokens.append(token)
+
+    def register_id(self, token):
+        # Runs after parsing too, when names may already have declarations
+        # stacked on them, so only names never seen before are added
+        self.symbol_table.store_global(token)
+
+    def register_error(self, lexeme, line, col):
+        self.error_records.append((lexeme, line, col))
+        super().register_error(lexeme, line, col)
+
+    def format_errors(self):
+        self.error_list = ["Could not understand '{}' near {}:{}".format(lexeme, line, col)
+                           for lexeme, line, col in self.error_records]
+
+    def span_at(self, line_pos):
+        # Index of the span holding line_pos, the last one past the end
+        spans = self.spans
+        low, high = 0, len(spans) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if spans[middle].first <= line_pos:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def renumber(self, start_line, end_line, new_lines):
+        # SourceLines of new_lines in place of lines [start_line, end_line)
+        spans = self.spans
+        added = [SourceLine() for _ in new_lines]
+        if not spans:
+            self.spans = split_spans(0, added)
+            return added
+        low = self.span_at(start_line)
+        high = self.span_at(max(start_line, end_line - 1))
+        first = spans[low].first
+        lines = [line for span in spans[low:high + 1] for line in span.lines]
+        spans[low:high + 1] = replaced = split_spans(first, lines[:start_line - first] + added +
+                                                     lines[end_line - first:])
+        line_delta = len(new_lines) - (end_line - start_line)
+        if line_delta:
+            for index in range(low + len(replaced), len(spans)):
+                spans[index].first += line_delta
+        return added
+
+    def relex(self, tokens, start_line, end_line, new_lines):
+        """Replaces lines [start_line, end_line) by new_lines (0 based lines).
+
+        `tokens` must be the scanner's current token list. Returns the new
+        TokenList along with a TokenDiff describing what changed. The
+        previous list keeps the same tokens and no token is written to, but
+        a token's line is read from the current source, so tokens after
+        the edit report the line they have now in both lists. That is why
+        an older list can't be edited again.
+        """
+        if tokens is not self.tokens:
+            raise Exception("Only the current tokens can be relexed, these are from before an edit")
+        if start_line < 0 or end_line < start_line or end_line > len(self.code):
+            raise Exception("Invalid edit range {}-{}".format(start_line, end_line))
+
+        line_delta = len(new_lines) - (end_line - start_line)
+        first = first_token_at(tokens, start_line)
+        last = first_token_at(tokens, end_line)
+
+        errors = self.error_records
+        first_error = 0
+        while first_error < len(errors) and errors[first_error][1] < start_line:
+            first_error += 1
+        last_error = first_error
+        while last_error < len(errors) and errors[last_error][1] < end_line:
+            last_error += 1
+        later_errors = [(lexeme, line + line_delta, col) for lexeme, line, col in errors[last_error:]]
+        self.error_records = errors[:first_error]
+
+        # scan_line appends to self.tokens, point it to a scratch list
+        self.tokens = []
+        source_lines = self.renumber(start_line, end_line, new_lines)
+        for offset, line in enumerate(new_lines):
+            self.source_line = source_lines[offset]
+            self.scan_line(line, start_line + offset)
+        inserted = self.tokens
+
+        removed = tokens[first:last]
+        tokens = self.tokens = tokens.replace(first, last, inserted)
+        self.code[start_line:end_line] = new_lines
+        self.error_records.extend(later_errors)
+        self.format_errors()
+        return tokens, TokenDiff(first, removed, inserted, line_delta)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+import operator
+import random
+import sys
+from language import *
+from precedence_parser import compact_program
+from semantic import type_name, items
+from folding import constant_value, divide
+
+# Value of a variable declared without an initializer, by type
+DEFAULT_VALUES = {"int": 0, "char": "\0", "bool": False}
+
+# C- calls are several Python calls deep, this is the Python limit while running
+RECURSION_LIMIT = 20000
+
+def remainder(left, right):
+    # Sign of the dividend, like C
+    return left - right * divide(left, right)
+
+BINARY_OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    "%": remainder,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+def copy_value(value):
+    # Records and arrays are assigned and passed by value, scalars are immutable
+    if type(value) is dict:
+        return {name: copy_value(field) for name, field in value.items()}
+    if type(value) is list:
+        return [copy_value(element) for element in value]
+    return value
+
+def position(token):
+    return "({}:{})".format(token.line, token.column)
+
+# Statement outcomes besides None, the next statement runs
+BREAK = "break"
+RETURN = "return"
+
+class Interpreter():
+    """Runs a program by walking its syntax tree.
+
+    The tree must have passed the semantic analysis; expressions are made
+    compact first, so every parser's tree runs. ints are Python ints, chars
+    one character strings and bools Python bools. Arrays are lists and
+    records dicts from field name to value. Arrays are passed to functions
+    by reference, records by value. Every call gets a list of scopes, one
+    dict per open block, and names that are in none of them are globals.
+    Run time errors (division by zero, index out of bounds, call stack
+    overflow) raise an Exception with the position of the operation.
+    """
+
+    def __init__(self, tree, seed=None):
+        compact_program(tree)
+        self.random = random.Random(seed)
+        self.functions = {}
+        self.parameters = {}
+        self.records = {}
+        self.declarations = []
+        self.globals = {}
+        self.scopes = []
+        self.returned = None
+        for declaration in top_level_declarations(tree):
+            if getattr(declaration, "fun_declaration", None) is not None:
+                node = declaration.fun_declaration
+                if getattr(node, "id", None) is not None:
+                    self.functions[node.id.value] = node
+                    self.parameters[node.id.value] = self.params(node)
+            elif getattr(declaration, "rec_declaration", None) is not None:
+                self.rec_declaration(declaration.rec_declaration)
+            elif getattr(declaration, "var_declaration", None) is not None:
+                self.declarations.append(declaration.var_declaration)
+        self.evaluators = {
+            BinaryNode: self.binary,
+            UnaryNode: self.unary,
+            LeafNode: self.leaf,
+            MutableNode: self.element,
+            CallNode: self.call,
+            ExpressionNode: self.assignment,
+        }
+        self.statements = {
+            SyntaxNodeTypes.EXPRESSION_STATEMENT: self.expression_stmt,
+            SyntaxNodeTypes.COMPOUND_STATEMENT: self.compound_stmt,
+            SyntaxNodeTypes.SELECTION_STATEMENT: self.selection_stmt,
+            SyntaxNodeTypes.ITERATION_STATEMENT: self.iteration_stmt,
+            SyntaxNodeTypes.RETURN_STATEMENT: self.return_stmt,
+            SyntaxNodeTypes.BREAK_STATEMENT: self.break_stmt,
+        }
+
+    def run(self, name="main", arguments=()):
+        """Initializes the globals and calls function `name`, returns what it returns."""
+        if name not in self.functions:
+            raise Exception("No function '{}' to run".format(name))
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+        try:
+            self.globals = {}
+            self.scopes = [self.globals]
+            for declaration in self.declarations:
+                self.var_declaration(declaration.type_specifier, declaration.var_declaration_list)
+            return self.invoke(name, list(arguments))
+        except RecursionError:
+            raise Exception("Call stack overflow running '{}'".format(name))
+        finally:
+            sys.setrecursionlimit(limit)
+
+    # Declarations
+
+    def params(self, node):
+        # (name, passed by reference) of every parameter, in order
+        found = []
+        param_list = getattr(getattr(node, "params", None), "param_list", None)
+        if param_list is None:
+            return found
+        for group in [param_list.param_type_list] + items(getattr(param_list.list_param, "list_param", None)):
+            param_ids = [group.param_id_list.param_id]
+            param_ids += items(getattr(group.param_id_list.list_id_param, "list_id_param", None))
+            for param_id in param_ids:
+                array = getattr(param_id.id_param, "id_param", None) is not None
+                found.append((param_id.id.value, type_name(group.type_specifier), array))
+        return found
+
+    def rec_declaration(self, node):
+        fields = []
+        for declaration in items(getattr(getattr(node, "local_declarations", None), "declarations_local", None)):
+            data_type = type_name(declaration.scoped_type_specifier.type_specifier)
+            for var_decl_id, _ in self.declared(declaration.var_decl_list):
+                fields.append((var_decl_id.id.value, data_type, self.array_size(var_decl_id)))
+        self.records[node.id.value] = fields
+
+    def declared(self, var_decl_list):
+        # (VAR_DEC_ID, initializer or None) of every name in a declaration
+        found = []
+        for declaration in [var_decl_list.var_decl_initialize] + items(
+                getattr(var_decl_list.list_var_decl, "list_var_decl", None)):
+            found.append((declaration.var_decl_id, getattr(declaration.initialize_decl_var, "simple_expression", None)))
+        return found
+
+    def array_size(self, var_decl_id):
+        size = getattr(var_decl_id.id_decl_var, "id_decl_var", None)
+        return int(size.value) if size is not None else None
+
+    def new_value(self, data_type, array_size=None):
+        if array_size is not None:
+            return [self.new_value(data_type) for _ in range(array_size)]
+        if data_type in DEFAULT_VALUES:
+            return DEFAULT_VALUES[data_type]
+        fields = self.records.get(data_type)
+        if fields is None:
+            return None
+        return {name: self.new_value(field_type, size) for name, field_type, size in fields}
+
+    def var_declaration(self, type_specifier, var_decl_list):
+        data_type = type_name(type_specifier)
+        scope = self.scopes[-1]
+        for var_decl_id, initializer in self.declared(var_decl_list):
+            if initializer is not None:
+                scope[var_decl_id.id.value] = copy_value(self.evaluate(initializer))
+            else:
+                scope[var_decl_id.id.value] = self.new_value(data_type, self.array_size(var_decl_id))
+
+    # Calls
+
+    def invoke(self, name, arguments):
+        node = self.functions[name]
+        frame = {}
+        for index, (param, data_type, array) in enumerate(self.parameters[name]):
+            if index < len(arguments):
+                frame[param] = arguments[index] if array else copy_value(arguments[index])
+            else:
+                frame[param] = self.new_value(data_type, 0 if array else None)
+        caller = self.scopes
+        self.scopes = [self.globals, frame]
+        try:
+            outcome = self.execute(node.statement)
+        finally:
+            self.scopes = caller
+        returned = self.returned
+        self.returned = None
+        if outcome is RETURN and returned is not None:
+            return returned
+        # Falling off the end returns the default value of the return type
+        return self.new_value(type_name(getattr(node, "type_specifier", None)))
+
+    def call(self, node):
+        arg_list = getattr(getattr(node, "args", None), "arg_list", None)
+        arguments = []
+        if arg_list is not None:
+            arguments = [self.evaluate(arg_list.expression)]
+            arguments += [self.evaluate(argument) for argument in items(getattr(arg_list.list_arg, "expression", None))]
+        return self.invoke(node.id.value, arguments)
+
+    # Statements
+
+    def execute(self, node):
+        """Runs a STATEMENT, returns None, BREAK or RETURN (the value is in self.returned)."""
+        for name in node.fields:
+            statement = getattr(node, name, None)
+            if statement is not None:
+                return self.statements[statement.type](statement)
+        return None
+
+    def expression_stmt(self, node):
+        expression = getattr(node, "expression", None)
+        if isinstance(expression, SyntaxNode):
+            self.evaluate(expression)
+        return None
+
+    def compound_stmt(self, node):
+        self.scopes.append({})
+        try:
+            for declaration in items(getattr(getattr(node, "local_declarations", None), "declarations_local", None)):
+                self.var_declaration(declaration.scoped_type_specifier.type_specifier, declaration.var_decl_list)
+            statement_list = getattr(node, "statement_list", None)
+            for statement in items(getattr(getattr(statement_list, "list_statement", None), "statement", None)):
+                outcome = self.execute(statement)
+                if outcome is not None:
+                    return outcome
+            return None
+        finally:
+            self.scopes.pop()
+
+    def selection_stmt(self, node):
+        if self.evaluate(node.simple_expression):
+            return self.execute(node.statement)
+        otherwise = getattr(getattr(node, "stmt_selection", None), "statement", None)
+        if otherwise is not None:
+            return self.execute(otherwise)
+        return None
+
+    def iteration_stmt(self, node):
+        while self.evaluate(node.simple_expression):
+            outcome = self.execute(node.statement)
+            if outcome is BREAK:
+                break
+            if outcome is RETURN:
+                return outcome
+        return None
+
+    def return_stmt(self, node):
+        expression = getattr(node, "expression", None)
+        self.returned = self.evaluate(expression) if expression is not None else None
+        return RETURN
+
+    def break_stmt(self, node):
+        return BREAK
+
+    # Expressions
+
+    def evaluate(self, node):
+        return self.evaluators[type(node)](node)
+
+    def scope_of(self, name):
+        scopes = self.scopes
+        for index in range(len(scopes) - 1, -1, -1):
+            if name in scopes[index]:
+                return scopes[index]
+        raise Exception("Variable '{}' has no value".format(name))
+
+    def leaf(self, node):
+        token = node.token
+        if node.type == SyntaxNodeTypes.CONSTANT:
+            return constant_value(token)
+        return self.scope_of(token.value)[token.value]
+
+    def target(self, node):
+        # Container and key of the variable or element node stands for
+        if isinstance(node, LeafNode):
+            return self.scope_of(node.token.value), node.token.value
+        token = node.id
+        container, key = self.scope_of(token.value), token.value
+        new_mutable = node.new_mutable
+        for index in items(getattr(new_mutable, "expressions", None)):
+            container = container[key]
+            key = self.evaluate(index)
+            if not 0 <= key < len(container):
+                raise Exception("Index {} out of bounds of '{}' {}".format(key, token.value, position(token)))
+        for field in items(getattr(new_mutable, "ids", None)):
+            container = container[key]
+            key = field.value
+        return container, key
+
+    def element(self, node):
+        container, key = self.target(node)
+        return container[key]
+
+    def assignment(self, node):
+        container, key = self.target(node.mutable)
+        op = node.op
+        if op.value == "=":
+            value = copy_value(self.evaluate(node.expression))
+        elif op.value == "++":
+            value = container[key] + 1
+        elif op.value == "--":
+            value = container[key] - 1
+        else:
+            value = self.arithmetic(op, container[key], self.evaluate(node.expression))
+        container[key] = value
+        return value
+
+    def arithmetic(self, op, left, right):
+        if right == 0 and (op.value[0] == "/" or op.value[0] == "%"):
+            raise Exception("Division by zero {}".format(position(op)))
+        return BINARY_OPERATIONS[op.value[0]](left, right)
+
+    def binary(self, node):
+        operator_name = node.op.value
+        # and/or only evaluate the right operand when it decides
+        if operator_name == "and":
+            return self.evaluate(node.left) and self.evaluate(node.right)
+        if operator_name == "or":
+            return self.evaluate(node.left) or self.evaluate(node.right)
+        left = self.evaluate(node.left)
+        right = self.evaluate(node.right)
+        if operator_name == "/" or operator_name == "%":
+            return self.arithmetic(node.op, left, right)
+        return BINARY_OPERATIONS[operator_name](left, right)
+
+    def unary(self, node):
+        operator_name = node.op.value
+        operand = self.evaluate(node.operand)
+        if operator_name == "-":
+            return -operand
+        if operator_name == "not":
+            return not operand
+        if operator_name == "*":
+            return len(operand)
+        # ?n is a random int from 0 to n - 1
+        if operand <= 0:
+            raise Exception("Operator '?' needs a positive operand {}".format(position(node.op)))
+        return self.random.randrange(operand)
@@ -0,0 +1,860 @@
+# -*- coding: utf-8 -*-
+
+import operator
+import random
+import sys
+from language import *
+from precedence_parser import compact_program
+from semantic import type_name, items
+from folding import constant_value, divide
+from interpreter import DEFAULT_VALUES, RECURSION_LIMIT, remainder, position
+from bytecode import copy_value, assigns
+
+# Binary operators of "binary" instructions; and/or become branches
+OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    "%": remainder,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# Unary operators of "unary" instructions, by C- operator
+UNARY_OPERATORS = {"-": "neg", "not": "not", "*": "size", "?": "random"}
+
+TERMINATORS = {"jump", "branch", "return"}
+
+# extra of an index or store_index whose index is known to be in bounds
+UNCHECKED = "unchecked"
+
+class Const():
+    """A constant operand. Variables are plain strings, so a char constant is never mistaken for one."""
+
+    __slots__ = ["value"]
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return type(other) is Const and type(other.value) is type(self.value) and other.value == self.value
+
+    def __hash__(self):
+        return hash((type(self.value), self.value))
+
+    def __repr__(self):
+        if type(self.value) is bool:
+            return "true" if self.value else "false"
+        return repr(self.value)
+
+class Instruction():
+    """One three-address instruction.
+
+    op is the kind ("copy", "binary", "phi", "branch", ...), dest the
+    variable it defines or None, args its operands. extra is what else the
+    kind needs: the operator of a binary, the callee of a call, the
+    predecessor labels of a phi (one per argument), the targets of a jump
+    or branch, UNCHECKED for an element access that can't be out of
+    bounds. site is the token a run time error reports.
+    """
+
+    __slots__ = ["op", "dest", "args", "extra", "site"]
+
+    def __init__(self, op, dest=None, args=(), extra=None, site=None):
+        self.op = op
+        self.dest = dest
+        self.args = list(args)
+        self.extra = extra
+        self.site = site
+
+    def __repr__(self):
+        op, args = self.op, [str(arg) for arg in self.args]
+        if op == "copy":
+            text = args[0]
+        elif op == "binary":
+            text = "{} {} {}".format(args[0], self.extra, args[1])
+        elif op == "unary" or op == "clone":
+            text = "{} {}".format(self.extra or op, args[0])
+        elif op == "index":
+            text = "{}[{}]".format(*args) + (" ; in bounds" if self.extra == UNCHECKED else "")
+        elif op == "store_index":
+            return "{}[{}] = {}".format(*args) + (" ; in bounds" if self.extra == UNCHECKED else "")
+        elif op == "field":
+            text = "{}.{}".format(args[0], self.extra[1])
+        elif op == "store_field":
+            return "{}.{} = {}".format(args[0], self.extra[1], args[1])
+        elif op == "load_global":
+            text = "@" + self.extra
+        elif op == "store_global":
+            return "@{} = {}".format(self.extra, args[0])
+        elif op == "new":
+            text = "new {}".format(self.extra[1])
+        elif op == "call":
+            text = "call {}({})".format(self.extra, ", ".join(args))
+        elif op == "phi":
+            text = "phi " + ", ".join("[{}, B{}]".format(arg, label) for arg, label in zip(args, self.extra))
+        elif op == "jump":
+            return "jump B{}".format(self.extra)
+        elif op == "branch":
+            return "branch {} B{} B{}".format(args[0], *self.extra)
+        else:
+            return "return {}".format(args[0])
+        return "{} = {}".format(self.dest, text)
+
+class Block():
+    """A basic block: phis first, one terminator last."""
+
+    __slots__ = ["label", "instructions", "preds", "succs"]
+
+    def __init__(self, label):
+        self.label = label
+        self.instructions = []
+        self.preds = []
+        self.succs = []
+
+    def terminator(self):
+        if self.instructions and self.instructions[-1].op in TERMINATORS:
+            return self.instructions[-1]
+        return None
+
+    def phis(self):
+        return [instruction for instruction in self.instructions if instruction.op == "phi"]
+
+class FunctionIR():
+    """The control flow graph of one function, blocks[0] is the entry."""
+
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params
+        self.blocks = []
+
+    def block(self, label):
+        for block in self.blocks:
+            if block.label == label:
+                return block
+        return None
+
+    def instruction_count(self):
+        return sum(len(block.instructions) for block in self.blocks)
+
+    def update_cfg(self):
+        """Recomputes preds and succs from the terminators, drops unreachable blocks and their phi arguments."""
+        labels = {block.label: block for block in self.blocks}
+        for block in self.blocks:
+            block.preds = []
+        reachable = set()
+        pending = [self.blocks[0]]
+        while pending:
+            block = pending.pop()
+            if block.label in reachable:
+                continue
+            reachable.add(block.label)
+            terminator = block.terminator()
+            if terminator is None or terminator.op == "return":
+                block.succs = []
+            elif terminator.op == "jump":
+                block.succs = [terminator.extra]
+            else:
+                # Both targets the same is a jump
+                block.succs = list(dict.fromkeys(terminator.extra))
+            pending.extend(labels[label] for label in block.succs)
+        self.blocks = [block for block in self.blocks if block.label in reachable]
+        for block in self.blocks:
+            for label in block.succs:
+                labels[label].preds.append(block.label)
+        for block in self.blocks:
+            for phi in block.phis():
+                kept = [(arg, label) for arg, label in zip(phi.args, phi.extra) if label in block.preds]
+                phi.args = [arg for arg, _ in kept]
+                phi.extra = [label for _, label in kept]
+
+class ProgramIR():
+    """Every function of a program in IR, functions["<init>"] stores the globals."""
+
+    def __init__(self):
+        self.functions = {}
+        self.global_names = []
+
+    def instruction_count(self):
+        return sum(function.instruction_count() for function in self.functions.values())
+
+def format_program(program):
+    lines = []
+    for function in program.functions.values():
+        lines.append("function {}({}):".format(function.name, ", ".join(function.params)))
+        for block in function.blocks:
+            lines.append("  B{}:{}".format(block.label, "" if not block.preds else "  ; preds " + ", ".join(
+                "B{}".format(label) for label in block.preds)))
+            lines.extend("    {}".format(instruction) for instruction in block.instructions)
+        lines.append("")
+    return "\n".join(lines)
+
+def is_variable(arg):
+    return type(arg) is str
+
+class IRBuilder():
+    """Lowers a checked syntax tree to three-address code, one CFG per function.
+
+    Locals are variables named after their declaration (a shadowing
+    declaration gets "#n" appended), temporaries are "%n". Globals are
+    memory, read and written with load_global/store_global, since a call
+    may change them. and/or and conditions become branches. The result is
+    not in SSA form yet: a local assigned in several places keeps its name.
+    """
+
+    def __init__(self, tree):
+        self.tree = compact_program(tree)
+        self.program = ProgramIR()
+        self.signatures = {}
+        self.records = {}
+        self.global_scope = {}
+        self.function = None
+        self.block = None
+        self.scopes = []
+        self.names = {}
+        self.temp_count = 0
+        self.loop_exits = []
+
+    def build(self):
+        functions = []
+        global_declarations = []
+        for declaration in top_level_declarations(self.tree):
+            if getattr(declaration, "fun_declaration", None) is not None:
+                node = declaration.fun_declaration
+                if getattr(node, "id", None) is not None:
+                    self.declare_function(node)
+                    functions.append(node)
+            elif getattr(declaration, "rec_declaration", None) is not None:
+                self.rec_declaration(declaration.rec_declaration)
+            elif getattr(declaration, "var_declaration", None) is not None:
+                global_declarations.append(declaration.var_declaration)
+
+        self.begin(FunctionIR("<init>", []))
+        for declaration in global_declarations:
+            self.var_declaration(declaration.type_specifier, declaration.var_declaration_list, self.store_global)
+        self.emit(Instruction("return", args=[Const(None)]))
+        self.end()
+
+        for node in functions:
+            self.fun_declaration(node)
+        return self.program
+
+    # Declarations
+
+    def declare_function(self, node):
+        params = []
+        param_list = getattr(getattr(node, "params", None), "param_list", None)
+        if param_list is not None:
+            for group in [param_list.param_type_list] + items(getattr(param_list.list_param, "list_param", None)):
+                param_ids = [group.param_id_list.param_id]
+                param_ids += items(getattr(group.param_id_list.list_id_param, "list_id_param", None))
+                for param_id in param_ids:
+                    data_type = type_name(group.type_specifier)
+                    if getattr(param_id.id_param, "id_param", None) is not None:
+                        data_type += "[]"
+                    params.append((param_id.id.value, data_type))
+        self.signatures[node.id.value] = (params, type_name(getattr(node, "type_specifier", None)))
+
+    def rec_declaration(self, node):
+        fields = {}
+        for declaration in items(getattr(getattr(node, "local_declarations", None), "declarations_local", None)):
+            data_type = type_name(declaration.scoped_type_specifier.type_specifier)
+            for var_decl_id, _ in self.declared(declaration.var_decl_list):
+                size = self.array_size(var_decl_id)
+                fields[var_decl_id.id.value] = (len(fields), data_type if size is None else data_type + "[]", size)
+        self.records[node.id.value] = fields
+
+    def declared(self, var_decl_list):
+        # (VAR_DEC_ID, initializer or None) of every name in a declaration
+        found = []
+        for declaration in [var_decl_list.var_decl_initialize] + items(
+                getattr(var_decl_list.list_var_decl, "list_var_decl", None)):
+            found.append((declaration.var_decl_id, getattr(declaration.initialize_decl_var, "simple_expression", None)))
+        return found
+
+    def array_size(self, var_decl_id):
+        size = getattr(var_decl_id.id_decl_var, "id_decl_var", None)
+        return int(size.value) if size is not None else None
+
+    def new_value(self, data_type, array_size=None):
+        if array_size is not None:
+            return [self.new_value(data_type) for _ in range(array_size)]
+        if data_type in DEFAULT_VALUES:
+            return DEFAULT_VALUES[data_type]
+        fields = self.records.get(data_type)
+        if fields is None:
+            return None
+        return [self.new_value(field_type if size is None else field_type[:-2], size)
+                for _, field_type, size in fields.values()]
+
+    def default(self, data_type, array_size=None):
+        # Operand holding a fresh default value of a type
+        value = self.new_value(data_type, array_size)
+        if type(value) is not list:
+            return Const(value)
+        description = data_type if array_size is None else "{}[{}]".format(data_type, array_size)
+        return self.emit(Instruction("new", self.temp(), extra=(value, description))).dest
+
+    def var_declaration(self, type_specifier, var_decl_list, declare):
+        data_type = type_name(type_specifier)
+        for var_decl_id, initializer in self.declared(var_decl_list):
+            size = self.array_size(var_decl_id)
+            if initializer is not None:
+                value = self.aggregate_copy(initializer, self.expression(initializer))
+            else:
+                value = self.default(data_type, size)
+            # The initializer still sees the outer name
+            declare(var_decl_id.id.value, data_type if size is None else data_type + "[]", value)
+
+    def store_global(self, name, data_type, value):
+        self.program.global_names.append(name)
+        self.global_scope[name] = data_type
+        self.emit(Instruction("store_global", args=[value], extra=name))
+
+    def declare_local(self, name, data_type, value=None):
+        count = self.names.get(name, 0)
+        self.names[name] = count + 1
+        variable = name if count == 0 else "{}#{}".format(name, count + 1)
+        self.scopes[-1][name] = (variable, data_type)
+        if value is not None:
+            self.emit(Instruction("copy", variable, [value]))
+        return variable
+
+    # Functions and blocks
+
+    def begin(self, function):
+        self.function = function
+        self.scopes = [{}]
+        self.names = {}
+        self.temp_count = 0
+        self.block = self.new_block()
+
+    def end(self):
+        self.function.update_cfg()
+        self.program.functions[self.function.name] = self.function
+        self.function = None
+
+    def new_block(self):
+        block = Block(len(self.function.blocks))
+        self.function.blocks.append(block)
+        return block
+
+    def emit(self, instruction):
+        if self.block.terminator() is not None:
+            # Code after return or break, update_cfg drops it
+            self.block = self.new_block()
+        self.block.instructions.append(instruction)
+        return instruction
+
+    def jump(self, block):
+        self.emit(Instruction("jump", extra=block.label))
+
+    def temp(self):
+        self.temp_count += 1
+        return "%{}".format(self.temp_count)
+
+    def fun_declaration(self, node):
+        name = node.id.value
+        params, return_type = self.signatures[name]
+        self.begin(FunctionIR(name, []))
+        for param, data_type in params:
+            self.function.params.append(self.declare_local(param, data_type))
+        self.statement(node.statement)
+        # Falling off the end returns the default value of the return type
+        self.emit(Instruction("return", args=[self.default(return_type)]))
+        self.end()
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    # Statements
+
+    def statement(self, node):
+        for name in node.fields:
+            statement = getattr(node, name, None)
+            if statement is not None:
+                self.STATEMENTS[statement.type](self, statement)
+                return
+
+    def expression_stmt(self, node):
+        expression = getattr(node, "expression", None)
+        if isinstance(expression, SyntaxNode):
+            self.expression(expression)
+
+    def compound_stmt(self, node):
+        self.scopes.append({})
+        for declaration in items(getattr(getattr(node, "local_declarations", None), "declarations_local", None)):
+            self.var_declaration(declaration.scoped_type_specifier.type_specifier, declaration.var_decl_list,
+                                 self.declare_local)
+        statement_list = getattr(node, "statement_list", None)
+        for statement in items(getattr(getattr(statement_list, "list_statement", None), "statement", None)):
+            self.statement(statement)
+        self.scopes.pop()
+
+    def selection_stmt(self, node):
+        condition = self.expression(node.simple_expression)
+        then_block = self.new_block()
+        otherwise = getattr(getattr(node, "stmt_selection", None), "statement", None)
+        else_block = self.new_block() if otherwise is not None else None
+        done = self.new_block()
+        self.emit(Instruction("branch", args=[condition], extra=(then_block.label, (else_block or done).label)))
+        self.block = then_block
+        self.statement(node.statement)
+        self.jump(done)
+        if otherwise is not None:
+            self.block = else_block
+            self.statement(otherwise)
+            self.jump(done)
+        self.block = done
+
+    def iteration_stmt(self, node):
+        header = self.new_block()
+        self.jump(header)
+        self.block = header
+        condition = self.expression(node.simple_expression)
+        body = self.new_block()
+        done = self.new_block()
+        self.emit(Instruction("branch", args=[condition], extra=(body.label, done.label)))
+        self.loop_exits.append(done)
+        self.block = body
+        self.statement(node.statement)
+        self.jump(header)
+        self.loop_exits.pop()
+        self.block = done
+
+    def return_stmt(self, node):
+        expression = getattr(node, "expression", None)
+        if expression is not None:
+            value = self.expression(expression)
+        else:
+            value = self.default(self.signatures[self.function.name][1])
+        self.emit(Instruction("return", args=[value]))
+
+    def break_stmt(self, node):
+        self.jump(self.loop_exits[-1])
+
+    STATEMENTS = {
+        SyntaxNodeTypes.EXPRESSION_STATEMENT: expression_stmt,
+        SyntaxNodeTypes.COMPOUND_STATEMENT: compound_stmt,
+        SyntaxNodeTypes.SELECTION_STATEMENT: selection_stmt,
+        SyntaxNodeTypes.ITERATION_STATEMENT: iteration_stmt,
+        SyntaxNodeTypes.RETURN_STATEMENT: return_stmt,
+        SyntaxNodeTypes.BREAK_STATEMENT: break_stmt,
+    }
+
+    # Expressions
+
+    def expression(self, node):
+        """Emits the code of an expression, returns the operand holding its value."""
+        if isinstance(node, ExpressionNode):
+            return self.assignment(node)
+        if isinstance(node, BinaryNode):
+            if node.op.value == "and" or node.op.value == "or":
+                return self.logical(node)
+            left = self.operand(node.left, node.right)
+            right = self.expression(node.right)
+            return self.emit(Instruction("binary", self.temp(), [left, right], node.op.value, node.op)).dest
+        if isinstance(node, UnaryNode):
+            operand = self.expression(node.operand)
+            return self.emit(Instruction("unary", self.temp(), [operand], UNARY_OPERATORS[node.op.value],
+                                         node.op)).dest
+        if isinstance(node, LeafNode):
+            if node.type == SyntaxNodeTypes.CONSTANT:
+                return Const(constant_value(node.token))
+            return self.variable(node.token.value)
+        if isinstance(node, MutableNode):
+            container, key, site, _ = self.target(node)
+            return self.load(container, key, site)
+        return self.call(node)
+
+    def operand(self, node, *later):
+        # A local read before an expression that may assign it keeps the value it had
+        value = self.expression(node)
+        if is_variable(value) and not value.startswith("%") and any(assigns(other) for other in later):
+            return self.emit(Instruction("copy", self.temp(), [value])).dest
+        return value
+
+    def logical(self, node):
+        # The right operand only runs when the left does not decide
+        result = self.temp()
+        self.emit(Instruction("copy", result, [self.expression(node.left)]))
+        right_block = self.new_block()
+        done = self.new_block()
+        targets = (right_block.label, done.label) if node.op.value == "and" else (done.label, right_block.label)
+        self.emit(Instruction("branch", args=[result], extra=targets))
+        self.block = right_block
+        self.emit(Instruction("copy", result, [self.expression(node.right)]))
+        self.jump(done)
+        self.block = done
+        return result
+
+    def variable(self, name):
+        local = self.lookup(name)
+        if local is not None:
+            return local[0]
+        return self.emit(Instruction("load_global", self.temp(), extra=name)).dest
+
+    def variable_type(self, name):
+        local = self.lookup(name)
+        return local[1] if local is not None else self.global_scope[name]
+
+    def aggregate_copy(self, node, value):
+        # Assigning or passing a record or an array copies it
+        data_type = getattr(node, "data_type", None)
+        if data_type is not None and data_type not in DEFAULT_VALUES:
+            return self.emit(Instruction("clone", self.temp(), [value])).dest
+        return value
+
+    def target(self, node):
+        """(container, key, site, data type) of the element node stands for, the container loaded.
+
+        key is None for a plain variable, an operand for an index and
+        (field index, field name) for a field.
+        """
+        token = node.token if isinstance(node, LeafNode) else node.id
+        data_type = self.variable_type(token.value)
+        new_mutable = getattr(node, "new_mutable", None)
+        steps = [("index", index) for index in items(getattr(new_mutable, "expressions", None))]
+        steps += [("field", field) for field in items(getattr(new_mutable, "ids", None))]
+        if not steps:
+            return token.value, None, token, data_type
+        container = self.variable(token.value)
+        key = None
+        for number, (kind, step) in enumerate(steps):
+            if number > 0:
+                container = self.load(container, key, token)
+            if kind == "index":
+                key = self.expression(step)
+                data_type = data_type[:-2]
+            else:
+                index, data_type, _ = self.records[data_type][step.value]
+                key = (index, step.value)
+        return container, key, token, data_type
+
+    def load(self, container, key, site):
+        if type(key) is tuple:
+            return self.emit(Instruction("field", self.temp(), [container], key)).dest
+        return self.emit(Instruction("index", self.temp(), [container, key], site=site)).dest
+
+    def store(self, container, key, site, value):
+        if type(key) is tuple:
+            self.emit(Instruction("store_field", args=[container, value], extra=key))
+        else:
+            self.emit(Instruction("store_index", args=[container, key, value], site=site))
+
+    def assignment(self, node):
+        container, key, site, data_type = self.target(node.mutable)
+        op = node.op.value
+        local = self.lookup(container) if key is None else None
+        if op == "=":
+            value = self.aggregate_copy(node.expression, self.expression(node.expression))
+        else:
+            if key is not None:
+                current = self.load(container, key, site)
+            elif local is not None:
+                current = local[0]
+            else:
+                current = self.emit(Instruction("load_global", self.temp(), extra=container)).dest
+            right = Const(1) if op in ("++", "--") else self.expression(node.expression)
+            value = self.emit(Instruction("binary", self.temp(), [current, right], op[0], node.op)).dest
+        if key is not None:
+            self.store(container, key, site, value)
+        elif local is not None:
+            self.emit(Instruction("copy", local[0], [value]))
+            return local[0]
+        else:
+            self.emit(Instruction("store_global", args=[value], extra=container))
+        return value
+
+    def call(self, node):
+        name = node.id.value
+        params = self.signatures[name][0]
+        arg_list = getattr(getattr(node, "args", None), "arg_list", None)
+        arguments = []
+        if arg_list is not None:
+            arguments = [arg_list.expression] + items(getattr(arg_list.list_arg, "expression", None))
+        values = []
+        for number, (argument, (_, data_type)) in enumerate(zip(arguments, params)):
+            value = self.operand(argument, *arguments[number + 1:])
+            # Records are passed by value, arrays by reference
+            values.append(value if data_type.endswith("[]") else self.aggregate_copy(argument, value))
+        return self.emit(Instruction("call", self.temp(), values, name)).dest
+
+def build_program(tree):
+    return IRBuilder(tree).build()
+
+# SSA
+
+def reverse_postorder(function):
+    labels = {block.label: block for block in function.blocks}
+    order = []
+    visited = {function.blocks[0].label}
+    pending = [(function.blocks[0], iter(function.blocks[0].succs))]
+    while pending:
+        block, successors = pending[-1]
+        for label in successors:
+            if label not in visited:
+                visited.add(label)
+                pending.append((labels[label], iter(labels[label].succs)))
+                break
+        else:
+            pending.pop()
+            order.append(block)
+    order.reverse()
+    return order
+
+def dominators(function):
+    """Immediate dominator of every block label (the entry has None), Cooper, Harvey and Kennedy's iteration."""
+    order = reverse_postorder(function)
+    number = {block.label: index for index, block in enumerate(order)}
+    entry = order[0].label
+    idom = {entry: entry}
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            new = None
+            for pred in block.preds:
+                if pred not in idom:
+                    continue
+                if new is None:
+                    new = pred
+                    continue
+                # Intersect, walking up from the later block
+                finger, other = pred, new
+                while finger != other:
+                    while number[finger] > number[other]:
+                        finger = idom[finger]
+                    while number[other] > number[finger]:
+                        other = idom[other]
+                new = finger
+            if idom.get(block.label) != new:
+                idom[block.label] = new
+                changed = True
+    idom[entry] = None
+    return idom
+
+def dominator_tree(idom):
+    children = {label: [] for label in idom}
+    for label, parent in idom.items():
+        if parent is not None:
+            children[parent].append(label)
+    return children
+
+def dominance_frontiers(function, idom):
+    frontiers = {block.label: set() for block in function.blocks}
+    for block in function.blocks:
+        if len(block.preds) < 2:
+            continue
+        for pred in block.preds:
+            runner = pred
+            while runner != idom[block.label]:
+                frontiers[runner].add(block.label)
+                runner = idom[runner]
+    return frontiers
+
+def to_ssa(function):
+    """Puts a function in SSA form: phis where definitions meet, every variable defined once.
+
+    Only names used in some block before that block defines them get phis
+    (semi-pruned SSA); the first definition of x keeps its name, the n-th
+    is renamed x.n, and so is the first when x is a parameter.
+    """
+    idom = dominators(function)
+    frontiers = dominance_frontiers(function, idom)
+    labels = {block.label: block for block in function.blocks}
+
+    live_across = set()
+    definitions = {}
+    for block in function.blocks:
+        defined = set()
+        for instruction in block.instructions:
+            for arg in instruction.args:
+                if is_variable(arg) and arg not in defined:
+                    live_across.add(arg)
+            if instruction.dest is not None:
+                defined.add(instruction.dest)
+                definitions.setdefault(instruction.dest, set()).add(block.label)
+
+    phi_names = {}
+    for name in live_across & set(definitions):
+        pending = list(definitions[name])
+        placed = set()
+        while pending:
+            for label in frontiers[pending.pop()]:
+                if label in placed:
+                    continue
+                placed.add(label)
+                block = labels[label]
+                phi = Instruction("phi", name, [name] * len(block.preds), list(block.preds))
+                block.instructions.insert(0, phi)
+                phi_names[id(phi)] = name
+                if label not in definitions[name]:
+                    pending.append(label)
+
+    versions = {}
+    stacks = {name: [name] for name in function.params}
+
+    def current(name):
+        stack = stacks.get(name)
+        # A use no definition reaches only happens on a path the program never takes
+        return stack[-1] if stack else Const(None)
+
+    children = dominator_tree(idom)
+    pending = [(function.blocks[0].label, False)]
+    pushed = {}
+    while pending:
+        label, leaving = pending.pop()
+        if leaving:
+            for name in pushed.pop(label):
+                stacks[name].pop()
+            continue
+        block = labels[label]
+        names = []
+        for instruction in block.instructions:
+            if instruction.op != "phi":
+                instruction.args = [current(arg) if is_variable(arg) else arg for arg in instruction.args]
+            if instruction.dest is not None:
+                name = phi_names.get(id(instruction), instruction.dest)
+                versions[name] = versions.get(name, 0) + 1
+                if versions[name] > 1 or name in stacks:
+                    instruction.dest = "{}.{}".format(name, versions[name])
+                stacks.setdefault(name, []).append(instruction.dest)
+                names.append(name)
+        for successor in block.succs:
+            for phi in labels[successor].phis():
+                for index, pred in enumerate(phi.extra):
+                    if pred == label:
+                        phi.args[index] = current(phi_names[id(phi)])
+        pushed[label] = names
+        pending.append((label, True))
+        pending.extend((child, False) for child in reversed(children[label]))
+
+class IRInterpreter():
+    """Runs a ProgramIR, in or out of SSA form.
+
+    Values are those of the VirtualMachine (records are lists); phis read
+    their arguments for the edge just taken, all at once. Run time errors
+    are the Interpreter's, with the same positions. executed counts the
+    instructions run.
+    """
+
+    def __init__(self, program, seed=None):
+        self.program = program
+        self.random = random.Random(seed)
+        self.globals = {}
+        self.layouts = {}
+        self.executed = 0
+
+    def run(self, name="main", arguments=()):
+        """Initializes the globals and calls function `name`, returns what it returns."""
+        if name not in self.program.functions:
+            raise Exception("No function '{}' to run".format(name))
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+        try:
+            self.globals = {}
+            self.call(self.program.functions["<init>"], [])
+            return self.call(self.program.functions[name], list(arguments))
+        except RecursionError:
+            raise Exception("Call stack overflow running '{}'".format(name))
+        finally:
+            sys.setrecursionlimit(limit)
+
+    def layout(self, function):
+        # label: (phis as (dest, {pred: arg}), the other instructions) of every block, made once per function
+        layout = self.layouts.get(function.name)
+        if layout is None:
+            layout = {}
+            for block in function.blocks:
+                phis = block.phis()
+                layout[block.label] = ([(phi.dest, dict(zip(phi.extra, phi.args))) for phi in phis],
+                                       block.instructions[len(phis):])
+            self.layouts[function.name] = layout
+        return layout
+
+    def call(self, function, arguments):
+        values = dict(zip(function.params, list(arguments) + [None] * len(function.params)))
+        layout = self.layout(function)
+
+        def value(arg):
+            return arg.value if type(arg) is Const else values[arg]
+
+        label = function.blocks[0].label
+        previous = None
+        while True:
+            phis, body = layout[label]
+            # A block runs to its terminator, phis included
+            self.executed += len(phis) + len(body)
+            if phis:
+                incoming = [value(args[previous]) for _, args in phis]
+                for (dest, _), result in zip(phis, incoming):
+                    values[dest] = result
+            for instruction in body:
+                op = instruction.op
+                if op == "binary":
+                    left, right = value(instruction.args[0]), value(instruction.args[1])
+                    if right == 0 and instruction.extra in ("/", "%"):
+                        raise Exception("Division by zero {}".format(position(instruction.site)))
+                    values[instruction.dest] = OPERATIONS[instruction.extra](left, right)
+                elif op == "copy":
+                    values[instruction.dest] = value(instruction.args[0])
+                elif op == "branch":
+                    previous = label
+                    label = instruction.extra[0] if value(instruction.args[0]) else instruction.extra[1]
+                    break
+                elif op == "jump":
+                    previous = label
+                    label = instruction.extra
+                    break
+                elif op == "return":
+                    return value(instruction.args[0])
+                elif op == "index" or op == "store_index":
+                    container, key = value(instruction.args[0]), value(instruction.args[1])
+                    if instruction.extra != UNCHECKED and not 0 <= key < len(container):
+                        token = instruction.site
+                        raise Exception("Index {} out of bounds of '{}' {}".format(key, token.value, position(token)))
+                    if op == "index":
+                        values[instruction.dest] = container[key]
+                    else:
+                        container[key] = value(instruction.args[2])
+                elif op == "field":
+                    values[instruction.dest] = value(instruction.args[0])[instruction.extra[0]]
+                elif op == "store_field":
+                    value(instruction.args[0])[instruction.extra[0]] = value(instruction.args[1])
+                elif op == "unary":
+                    values[instruction.dest] = self.unary(instruction, value(instruction.args[0]))
+                elif op == "call":
+                    values[instruction.dest] = self.call(self.program.functions[instruction.extra],
+                                                         [value(arg) for arg in instruction.args])
+                elif op == "load_global":
+                    values[instruction.dest] = self.globals[instruction.extra]
+                elif op == "store_global":
+                    self.globals[instruction.extra] = value(instruction.args[0])
+                elif op == "new":
+                    values[instruction.dest] = copy_value(instruction.extra[0])
+                elif op == "clone":
+                    values[instruction.dest] = copy_value(value(instruction.args[0]))
+                else:
+                    raise Exception("Unknown instruction '{}' in '{}'".format(op, function.name))
+
+    def unary(self, instruction, operand):
+        operator_name = instruction.extra
+        if operator_name == "neg":
+            return -operand
+        if operator_name == "not":
+            return not operand
+        if operator_name == "size":
+            return len(operand)
+        # ?n is a random int from 0 to n - 1
+        if operand <= 0:
+            raise Exception("Operator '?' needs a positive operand {}".format(position(instruction.site)))
+        return self.random.randrange(operand)
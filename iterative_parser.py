@@ -0,0 +1,579 @@
+# -*- coding: utf-8 -*-
+
+from language import *
+from grammar import terminal_of
+from parser import Parser
+
+class IterativeParser(Parser):
+    """Parser that keeps its own work stack instead of recursing in Python.
+
+    Every rule that can nest is a generator that yields the rule it wants
+    to call and is resumed with that rule's result, so `run` drives the
+    whole parse from one flat loop and nesting depth is bounded by memory,
+    not by the recursion limit. The rules are the recursive parser's, line
+    for line, so the tree and error_list are the same.
+    """
+
+    def parse(self):
+        return self.run(self.program())
+
+    def run(self, routine):
+        stack = [routine]
+        value = None
+        error = None
+        while stack:
+            try:
+                if error is None:
+                    call = stack[-1].send(value)
+                else:
+                    pending, error = error, None
+                    call = stack[-1].throw(pending)
+            except StopIteration as finished:
+                stack.pop()
+                value = finished.value
+                continue
+            except Exception as raised:
+                # Unwind one rule at a time, like the exception would through calls
+                stack.pop()
+                if not stack:
+                    raise
+                error = raised
+                continue
+            stack.append(call)
+            value = None
+        return value
+
+    def program(self):
+        self.current_token = self.scanner.next_token()
+        node = SyntaxNode(SyntaxNodeTypes.PROGRAM)
+        # empty source code should just return the root node
+        if self.current_token == None:
+            return node
+        self.symbol_table.push_scope()
+        node.declaration_list = yield self.declaration_list()
+        self.symbol_table.kill_scope()
+        return node
+
+    def declaration_list(self):
+        node = SyntaxNode(SyntaxNodeTypes.DECLARATION_LIST)
+        node.declaration = yield self.declaration()
+        node.list_declaration = yield self.list_declaration()
+        return node
+
+    def list_declaration(self):
+        node = SyntaxNode(SyntaxNodeTypes.LIST_DECLARATION)
+        declarations = []
+
+        # check if next node is a declaration
+        while self.helpers.is_data_type(self.current_token.value) or self.current_token.value == "record":
+            declaration = yield self.declaration()
+            declarations.append(declaration)
+        
+        if len(declarations) > 0:
+            node.list_declaration = declarations
+            return node
+        return None
+
+    def declaration(self):
+        node = SyntaxNode(SyntaxNodeTypes.DECLARATION)
+        production = self.predict("declaration")
+        if production is not None:
+            rule = production[0]
+            if rule == "funDeclaration":
+                node.fun_declaration = yield self.fun_declaration()
+            elif rule == "varDeclaration":
+                node.var_declaration = yield self.var_declaration()
+            else:
+                node.rec_declaration = yield self.rec_declaration()
+            return node
+
+        # Nothing predicted, report the error where the old lookahead did
+        if self.current_token.token_class == TokenClass.ID:
+            node.fun_declaration = yield self.fun_declaration()
+            return node
+        if self.helpers.is_data_type(self.current_token.value):
+            if terminal_of(self.scanner.see_token(1)) == "ID":
+                node.var_declaration = yield self.var_declaration()
+                return node
+            self.current_token = self.scanner.next_token()
+            self.register_error(self.current_token, "identifier")
+            return node
+
+        self.register_error(self.current_token, "type declaration")
+        return node
+
+    def rec_declaration(self):
+        node = SyntaxNode(SyntaxNodeTypes.REC_DECLARATION)
+        self.register_error_if_current_is_not("record")
+        if self.current_token.token_class != TokenClass.ID:
+            self.register_error(self.current_token, "identifier")
+        else:
+            node.id = self.current_token
+            self.symbol_table.set_type(node.id, node.id.value, SymbolKind.RECORD)
+        self.register_error_if_next_is_not("{")
+        self.current_token = self.scanner.next_token()
+        self.symbol_table.push_scope()
+        node.local_declarations = yield self.local_declarations()
+        self.register_error_if_current_is_not("}")
+        self.symbol_table.kill_scope()
+        return node
+
+    def fun_declaration(self):
+        node = SyntaxNode(SyntaxNodeTypes.FUN_DECLARATION)
+        if self.helpers.is_data_type(self.current_token.value):
+            node.type_specifier = self.type_specifier()
+            self.current_token = self.scanner.next_token()
+        
+        if self.current_token.token_class == TokenClass.ID:
+            node.id = self.current_token
+            self.symbol_table.set_type(node.id, self.last_data_type, SymbolKind.FUNC)
+            self.last_id = node.id
+            self.last_func_id = node.id
+            self.register_error_if_next_is_not("(")
+            self.current_token = self.scanner.next_token()
+            # Parameters get a scope of their own, the body block opens inside it
+            self.symbol_table.push_scope()
+            node.params = self.params()
+            self.register_error_if_current_is_not(")")
+            node.statement = yield self.statement()
+            self.symbol_table.kill_scope()
+            return node
+
+        self.register_error(self.current_token, "identifier or type specifier")
+
+    def var_declaration(self):
+        node = SyntaxNode(SyntaxNodeTypes.VAR_DECLARATION)
+        node.type_specifier = self.type_specifier()
+        node.var_declaration_list = yield self.var_decl_list()
+        self.register_error_if_current_is_not(";")
+        return node
+
+    def local_declarations(self):
+        return (yield self.declarations_local())
+
+    def declarations_local(self):
+        node = SyntaxNode(SyntaxNodeTypes.DECLARATIONS_LOCAL)
+        token = self.current_token
+        declarations = []
+        while self.starts_local_declaration():
+            declaration = yield self.scoped_var_declaration()
+            declarations.append(declaration)
+        if len(declarations) > 0:
+            node.declarations_local = declarations
+        return node
+
+    def scoped_var_declaration(self):
+        node = SyntaxNode(SyntaxNodeTypes.SCOPED_VAR_DECLARATION)
+        node.scoped_type_specifier = self.scoped_type_specifier()
+        node.var_decl_list = yield self.var_decl_list()
+        self.register_error_if_current_is_not(";")
+        return node
+
+    def var_decl_list(self):
+        node = SyntaxNode(SyntaxNodeTypes.VAR_DEC_LIST)
+        node.var_decl_initialize = yield self.var_decl_initialize()
+        node.list_var_decl = yield self.list_var_decl()
+        return node
+
+    def var_decl_initialize(self):
+        node = SyntaxNode(SyntaxNodeTypes.VAR_DEC_INITIALIZE)
+        node.var_decl_id = self.var_decl_id()
+        node.initialize_decl_var = yield self.initialize_decl_var()
+        if hasattr(node.initialize_decl_var, "simple_expression"):
+            self.semantic_helpers.assign_value(self.last_id, self.last_constant)
+        return node
+
+    def initialize_decl_var(self):
+        node = SyntaxNode(SyntaxNodeTypes.INITIALIZE_DECL_VAR)
+        if self.current_token.value == "=":
+            self.current_token = self.scanner.next_token()
+            node.simple_expression = yield self.simple_expression()
+            return node
+        return node
+
+    def list_var_decl(self):
+        node = SyntaxNode(SyntaxNodeTypes.LIST_VAR_DECL)
+        var_declarations = []
+        while True:
+            production = self.predict("listVarDecl")
+            if production is None and terminal_of(self.scanner.see_token(1)) == "ID":
+                # Missing comma between two names
+                self.register_error(self.current_token, ",")
+            elif not production:
+                break
+            decl = yield self.var_decl_initialize()
+            var_declarations.append(decl)
+        
+        if len(var_declarations) > 0:
+            node.list_var_decl = var_declarations
+        return node
+
+    def arg_list(self):
+        node = SyntaxNode(SyntaxNodeTypes.ARG_LIST)
+        node.expression = yield self.expression()
+        node.list_arg = yield self.list_arg()
+        return node
+
+    def list_arg(self):
+        node = SyntaxNode(SyntaxNodeTypes.LIST_ARG)
+        expressions = []
+        while self.current_token.value == ",":
+            self.current_token = self.scanner.next_token()
+            expression = yield self.expression()
+            expressions.append(expression)
+        
+        if len(expressions) > 0:
+            node.expression = expressions
+        return node
+
+    def call(self):
+        node = SyntaxNode(SyntaxNodeTypes.CALL)
+        if self.current_token.token_class != TokenClass.ID:
+            self.register_error(self.current_token, "identifier")
+        else:
+            node.id = self.current_token
+            self.last_id = node.id
+        self.register_error_if_next_is_not("(")
+        self.current_token = self.scanner.next_token()
+        node.args = yield self.args()
+        self.register_error_if_current_is_not(")")
+        return node
+
+    def args(self):
+        node = SyntaxNode(SyntaxNodeTypes.ARGS)
+        if self.current_token.value != ")":
+            node.arg_list = yield self.arg_list()
+        return node
+
+    def simple_expression(self):
+        node = SyntaxNode(SyntaxNodeTypes.SIMPLE_EXPRESSION)
+        node.and_expression = yield self.and_expression()
+        node.expression_simple = yield self.expression_simple()
+        return node
+
+    def expression_simple(self):
+        node = SyntaxNode(SyntaxNodeTypes.EXPRESSION_SIMPLE)
+        exprs = []
+        while self.current_token.value == "or":
+            node.or_op = self.current_token
+            self.current_token = self.scanner.next_token()
+            expr = yield self.and_expression()
+            exprs.append(expr)
+        
+        if len(exprs) > 0:
+            node.expression_simple = exprs
+        return node
+
+    def and_expression(self):
+        node = SyntaxNode(SyntaxNodeTypes.AND_EXPRESSION)
+        node.unary_rel_expression = yield self.unary_rel_expression()
+        node.expression_and = yield self.expression_and()
+        return node
+
+    def expression_and(self):
+        node = SyntaxNode(SyntaxNodeTypes.EXPRESSION_AND)
+        exprs = []
+        while self.current_token.value == "and":
+            node.and_op = self.current_token
+            self.current_token = self.scanner.next_token()
+            expr = yield self.unary_rel_expression()
+            exprs.append(expr)
+        
+        if len(exprs) > 0:
+            node.expression_and = exprs
+        return node
+
+    def unary_rel_expression(self):
+        node = SyntaxNode(SyntaxNodeTypes.UNARY_REL_EXPRESSION)
+        if self.current_token.value == "not":
+            node.not_op = self.current_token
+            self.current_token = self.scanner.next_token()
+            node.unary_rel_expression = yield self.unary_rel_expression()
+            return node
+
+        if self.helpers.is_rel_expression_token(self.current_token):
+            node.rel_expression = yield self.rel_expression()
+            return node
+        if self.current_token.value in ["true", "false"]:
+            node.rel_expression = yield self.rel_expression()
+            return node
+
+        self.register_error(self.current_token, "relational operator")
+        return node
+
+    def rel_expression(self):
+        node = SyntaxNode(SyntaxNodeTypes.REL_EXPRESSION)
+        node.sum_expression = yield self.sum_expression()
+        node.expression_rel = yield self.expression_rel()
+        return node
+
+    def expression_rel(self):
+        node = SyntaxNode(SyntaxNodeTypes.EXPRESSION_REL)
+        if self.helpers.is_relational_operator(self.current_token.value):
+            node.relop = self.relop()
+            self.current_token = self.scanner.next_token()
+            node.sum_expression = yield self.sum_expression()
+            return node
+        return node
+
+    def immutable(self):
+        node = SyntaxNode(SyntaxNodeTypes.IMMUTABLE)
+        if self.current_token.value == "(":
+            self.current_token = self.scanner.next_token()
+            node.expression = yield self.expression()
+            self.register_error_if_current_is_not(")")
+            return node
+        elif self.current_token.token_class == TokenClass.ID:
+            node.call = yield self.call()
+            return node
+        elif self.helpers.is_constant_token(self.current_token):
+            node.constant = self.constant()
+            self.current_token = self.scanner.next_token()
+            return node
+        else:
+            self.register_error(self.current_token, "immutable expression")
+            return node
+
+    def mutable(self):
+        node = SyntaxNode(SyntaxNodeTypes.MUTABLE)
+        if self.current_token.token_class == TokenClass.ID:
+            node.id = self.current_token
+            self.semantic_helpers.is_valid_variable(node.id)
+            self.last_id = node.id
+            self.current_token = self.scanner.next_token()
+            node.new_mutable = yield self.new_mutable()
+            return node
+
+        self.register_error(self.current_token, "identification")
+        return node
+
+    def new_mutable(self):
+        node = SyntaxNode(SyntaxNodeTypes.NEW_MUTABLE)
+        ids = []
+        expressions = []
+        while self.current_token.value == "[" or self.current_token.value == ".":
+            if self.current_token.value == "[":
+                self.current_token = self.scanner.next_token()
+                expression = yield self.expression()
+                expressions.append(expression)
+                self.register_error_if_current_is_not("]")
+            elif self.current_token.value == ".":
+                self.current_token = self.scanner.next_token()
+                tk_id = self.current_token
+                ids.append(tk_id)
+                self.current_token = self.scanner.next_token()
+        
+        if len(ids) > 0:
+            node.ids = ids
+        if len(expressions) > 0:
+            node.expressions = expressions
+        return node
+
+    def factor(self):
+        node = SyntaxNode(SyntaxNodeTypes.FACTOR)
+        production = self.predict("factor")
+        if production is None:
+            return None
+        if production[0] == "immutable":
+            node.immutable = yield self.immutable()
+        else:
+            node.mutable = yield self.mutable()
+        return node
+
+    def term(self):
+        node = SyntaxNode(SyntaxNodeTypes.TERM)
+        node.unary_expression = yield self.unary_expression()
+        node.new_term = yield self.new_term()
+        return node
+
+    def new_term(self):
+        node = SyntaxNode(SyntaxNodeTypes.NEW_TERM)
+        ops = []
+        unary_expressions = []
+        while self.helpers.is_mulop(self.current_token.value):
+            op = self.mulop()
+            ops.append(op)
+            unary_expression = yield self.unary_expression()
+            unary_expressions.append(unary_expression)
+        
+        if len(ops) > 0:
+            node.mulop = ops
+        if len(unary_expressions) > 0:
+            node.unary_expression = unary_expressions
+        return node
+
+    def unary_expression(self):
+        node = SyntaxNode(SyntaxNodeTypes.UNARY_EXPRESSION)
+        ops = []
+        while self.helpers.is_unary_operator(self.current_token.value):
+            op = self.unary_op()
+            ops.append(op)
+        if len(ops) > 0:
+            node.unary_op = ops
+        node.factor = yield self.factor()
+        return node
+
+    def sum_expression(self):
+        node = SyntaxNode(SyntaxNodeTypes.SUM_EXPRESSION)
+        node.term = yield self.term()
+        node.expression_sum = yield self.expression_sum()
+        return node
+
+    def expression_sum(self):
+        node = SyntaxNode(SyntaxNodeTypes.EXPRESSION_SUM)
+        ops = []
+        terms = []
+        while self.helpers.is_sumop(self.current_token.value):
+            op = self.sumop()
+            ops.append(op)
+            term = yield self.term()
+            terms.append(term)
+        
+        if len(ops) > 0:
+            node.sumop = ops
+        if len(terms) > 0:
+            node.term = terms
+        return node
+
+    def statement_list(self):
+        node = SyntaxNode(SyntaxNodeTypes.STATEMENT_LIST)
+        node.list_statement = yield self.list_statement()
+        return node
+
+    def expression_stmt(self):
+        node = SyntaxNode(SyntaxNodeTypes.EXPRESSION_STATEMENT)
+        if self.current_token.value == ";":
+            node.expression = self.current_token
+            return node
+        elif self.current_token.token_class == TokenClass.ID:
+            node.expression = yield self.expression()
+            self.register_error_if_current_is_not(';')
+            return node
+        else:
+            self.register_error(self.current_token, "; or identifier")
+            return node
+
+    def compound_stmt(self):
+        node = SyntaxNode(SyntaxNodeTypes.COMPOUND_STATEMENT)
+        self.register_error_if_current_is_not("{")
+        self.symbol_table.push_scope()
+        node.local_declarations = yield self.local_declarations()
+        node.statement_list = yield self.statement_list()
+        if self.current_token.value == "}":
+            self.symbol_table.kill_scope()
+            # The brace closing the last function ends the source
+            if self.scanner.see_next_token() is not None:
+                self.current_token = self.scanner.next_token()
+        return node
+
+    def selection_stmt(self):
+        node = SyntaxNode(SyntaxNodeTypes.SELECTION_STATEMENT)
+        self.register_error_if_current_is_not("if")
+        self.register_error_if_current_is_not("(")
+        node.simple_expression = yield self.simple_expression()
+        self.register_error_if_current_is_not(")")
+        node.statement = yield self.statement()
+        node.stmt_selection = yield self.stmt_selection()
+        return node
+
+    def stmt_selection(self):
+        node = SyntaxNode(SyntaxNodeTypes.STATEMENT_SELECTION)
+        if self.current_token.value == "else":
+            self.current_token = self.scanner.next_token()
+            node.statement = yield self.statement()
+            return node
+        return node
+
+    def return_statement(self):
+        node = SyntaxNode(SyntaxNodeTypes.RETURN_STATEMENT)
+        if self.current_token.value != "return":
+            self.register_error(self.current_token, "return")
+        self.current_token = self.scanner.next_token()
+        
+        if self.current_token.value == ";":
+            return node
+        else:
+            node.expression = yield self.expression()
+            if(self.scanner.see_prior_token().token_class == TokenClass.ID):
+                self.semantic_helpers.validate_type(self.last_func_id, self.last_id)
+            else:
+                self.semantic_helpers.validate_type(self.last_func_id, self.last_constant)
+            if self.current_token.value != ";":
+                self.register_error(self.current_token, ";")
+            self.current_token = self.scanner.next_token()
+            return node
+
+    def iteration_stmt(self):
+        node = SyntaxNode(SyntaxNodeTypes.ITERATION_STATEMENT)
+        if self.current_token.value != "while":
+            self.register_error(self.current_token, "while statement")
+        self.register_error_if_next_is_not("(")
+        self.current_token = self.scanner.next_token()
+        node.simple_expression = yield self.simple_expression()
+        self.register_error_if_current_is_not(")")
+        node.statement = yield self.statement()
+        return node
+
+    def list_statement(self):
+        node = SyntaxNode(SyntaxNodeTypes.LIST_STATEMENT)
+        statements = []
+        while self.helpers.is_statement_token(self.current_token):
+            statement = yield self.statement()
+            statements.append(statement)
+        
+        if len(statements) > 0:
+            node.statement = statements
+        return node
+
+    def statement(self):
+        node = SyntaxNode(SyntaxNodeTypes.STATEMENT)
+        if self.current_token.token_class == TokenClass.ID:
+            node.expression_stmt = yield self.expression_stmt()
+            return node
+        if self.current_token.value == "{":
+            node.compound_stmt = yield self.compound_stmt()
+            return node
+        if self.current_token.value == "if":
+            node.selection_stmt = yield self.selection_stmt()
+            return node
+        if self.current_token.value == "while":
+            node.iteration_stmt = yield self.iteration_stmt()
+            return node
+        if self.current_token.value == "return":
+            node.return_statement = yield self.return_statement()
+            return node
+        if self.current_token.value == "break":
+            node.break_statement = self.break_statement()
+            return node
+        self.register_error(self.current_token, "valid statement")
+        return node
+
+    def expression(self):
+        node = SyntaxNode(SyntaxNodeTypes.EXPRESSION)
+        production = self.predict("expression")
+        if production is None:
+            self.register_error(self.current_token, 'valid expression')
+            return None
+        if production[0] == "simpleExpression":
+            node.simple_expression = yield self.simple_expression()
+            return node
+        # Ambiguous lookaheads, e.g. a[i] = ... against a[i] + ..., start as an assignment
+        node.mutable = yield self.mutable()
+        if self.helpers.is_contracted_operator(self.current_token.value):
+            node.op = self.current_token
+            self.current_token = self.scanner.next_token()
+            return node
+        if self.helpers.is_assignment_operator(self.current_token.value):
+            node.op = self.current_token
+            self.current_token = self.scanner.next_token()
+            left_id = self.last_id
+            node.expression = yield self.expression()
+            if self.symbol_table.key_of(left_id) == self.symbol_table.key_of(self.last_id):
+                self.semantic_helpers.assign_value(left_id, self.last_constant)
+            else:
+                self.semantic_helpers.assign_value(left_id, self.last_id)
+            return node
+        if self.helpers.is_sumop(self.current_token.value):
+            node.expression_sum = yield self.expression_sum()
+        return node
+
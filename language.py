@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from enum import Enum
-import copy
+
+# Bump whenever scanner or parser output changes, it invalidates cached results
+COMPILER_VERSION = "0.3.0"
 
 class TokenClass(Enum):
     ID = 1
@@ -16,6 +18,10 @@ class TokenClass(Enum):
 
     @classmethod
     def validate(classes, value):
+        # Fast path, scanners always pass the enum members themselves
+        if type(value) is classes:
+            return
+
         if isinstance(value, int):
             if (any(value == id.value for id in classes)):
                 return
@@ -30,6 +36,9 @@ class TokenClass(Enum):
         raise Exception("Token class identifier is not valid: '{}'".format(value))
 
 class Token():
+    # symbol_id is the interned name, what a name means lives in the symbol table
+    __slots__ = ("token_class", "value", "line", "column", "symbol_id")
+
     def __init__(self, token_class, value, line, column):
         TokenClass.validate(token_class)
 
@@ -122,49 +131,168 @@ class PatternHelpers():
         return self.is_unary_operator(token.value) or token.value == "("
 
 
+class InternTable():
+    """Maps every distinct lexeme to a small integer id and back."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, text):
+        symbol_id = self.ids.get(text)
+        if symbol_id is None:
+            symbol_id = len(self.strings)
+            self.strings.append(text)
+            self.ids[text] = symbol_id
+        return symbol_id
+
+    def get(self, text):
+        return self.ids.get(text)
+
+    def __getitem__(self, symbol_id):
+        return self.strings[symbol_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+class SymbolKind(Enum):
+    VAR = 1
+    FUNC = 2
+    PARAM = 3
+    RECORD = 4
+
+class Symbol():
+    """What a name means in one scope.
+
+    Scanners register every name they read as a symbol without kind (seen
+    but not declared); declarations push one with their kind and type on top.
+    array_size is the declared size, 0 for array parameters and None for
+    scalars. variable_value is the last constant token assigned, or the name
+    of the variable it was assigned from.
+    """
+    __slots__ = ("symbol_id", "scope", "kind", "data_type", "array_size", "token", "variable_value")
+
+    def __init__(self, symbol_id, scope, kind, data_type, token, array_size=None):
+        self.symbol_id = symbol_id
+        self.scope = scope
+        self.kind = kind
+        self.data_type = data_type
+        self.array_size = array_size
+        self.token = token
+        self.variable_value = None
+
+    @property
+    def value(self):
+        return self.token.value
+
+    @property
+    def declared(self):
+        return self.kind is not None
+
+    def __repr__(self):
+        return "Symbol '{}' scope: {}, kind: {}, type: {}".format(self.token.value, self.scope,
+            self.kind and self.kind.name, self.data_type)
+
 class SymbolTable():
+    """Names in scope, as a stack of Symbols per name.
+
+    Every scope keeps an undo log of the names declared in it, so leaving a
+    scope only touches those names instead of the whole table.
+    """
+
     def __init__(self):
+        # Keys are symbol ids from self.names, the text is only needed for diagnostics
         self.hashtable = {}
+        self.names = InternTable()
         self.current_scope = 0
-    
+        # Keys declared in each open scope, scopes[0] is never undone
+        self.scopes = [[]]
+        # When a list, every (key, Symbol) store_symbol() adds is appended to it
+        self.journal = None
+        # A ScopeRecorder, told about every scope and declaration
+        self.recorder = None
+
+    def key_of(self, token):
+        try:
+            return token.symbol_id
+        except AttributeError:
+            token.symbol_id = self.names.intern(token.value)
+            return token.symbol_id
+
     def store(self, token):
-        token.scope = self.current_scope
-        if token.value not in self.hashtable:
-            self.hashtable[token.value] = [token]
-        else:
-            # Verify if that id exists in the same scope
-            tk_list = self.hashtable[token.value]
-            if len(tk_list) == 1 and token.scope == 0:
+        # Registers a name the scanner read in the current scope, undeclared
+        self.store_symbol(Symbol(self.key_of(token), self.current_scope, None, None, token))
+
+    def store_symbol(self, symbol):
+        key = symbol.symbol_id
+        tk_list = self.hashtable.get(key)
+        if tk_list:
+            if len(tk_list) == 1 and symbol.scope == 0:
                 return
-            for tk in tk_list:
-                if tk.scope == self.current_scope:
-                    raise Exception("Name already exists in scope! ({0}:{1})".format(token.line, token.column))
-            tk_list.append(token)
-    
+            # Declarations are stacked by scope, a clash can only be on top
+            if tk_list[-1].scope == symbol.scope:
+                token = symbol.token
+                raise Exception("Name already exists in scope! ({0}:{1})".format(token.line, token.column))
+        self.declare(key, symbol)
+        if self.journal is not None:
+            self.journal.append((key, symbol))
+        if self.recorder is not None:
+            self.recorder.declare(symbol)
+
+    def declare(self, key, symbol):
+        # Pushes a symbol of the current scope without any check
+        tk_list = self.hashtable.get(key)
+        if tk_list is None:
+            self.hashtable[key] = [symbol]
+        else:
+            tk_list.append(symbol)
+        self.scopes[-1].append(key)
+
+    def store_global(self, token):
+        # Registers an id like Scanner.scan does before parsing, whatever the current scope is
+        key = self.key_of(token)
+        if key not in self.hashtable:
+            self.hashtable[key] = [Symbol(key, 0, None, None, token)]
+
     def lookup(self, value):
-        if self.hashtable[value]:
-            tk_list = self.hashtable[value]
+        # Accepts a symbol id or the name itself, None when nothing is declared
+        key = value if isinstance(value, int) else self.names.get(value)
+        tk_list = self.hashtable.get(key)
+        if tk_list:
             return tk_list[-1] #pop of the stack
         return None
 
-    def set_type(self, token, data_type):
-        new_token = copy.copy(token)
-        new_token.data_type = data_type
-        self.store(new_token)
+    def lookup_token(self, token):
+        return self.lookup(self.key_of(token))
+
+    def set_type(self, token, data_type, kind=SymbolKind.VAR):
+        # Declares token's name in the current scope, returns the new Symbol
+        symbol = Symbol(self.key_of(token), self.current_scope, kind, data_type, token)
+        self.store_symbol(symbol)
+        return symbol
     
     def push_scope(self):
         self.current_scope += 1
+        self.scopes.append([])
+        if self.recorder is not None:
+            self.recorder.push()
     
     def kill_scope(self):
-        for key, tk_list in self.hashtable.items():
-            if tk_list[-1].scope == self.current_scope:
+        if len(self.scopes) > 1:
+            hashtable = self.hashtable
+            for key in self.scopes.pop():
+                tk_list = hashtable[key]
                 tk_list.pop()
+                if not tk_list:
+                    del hashtable[key]
         self.current_scope -= 1
+        if self.recorder is not None:
+            self.recorder.pop()
     
     def __str__(self):
         representation = ""
         for key in self.hashtable.keys():
-            representation += "Key: {} \n".format(key)
+            representation += "Key: {} \n".format(self.names[key])
         
         return representation
 
@@ -233,16 +361,205 @@ class SyntaxNodeTypes(Enum):
     LIST_STATEMENT = 62,
     STATEMENT_SELECTION = 63,
 
+# Attributes the parser sets on each kind of node, in source order. Kinds
+# the parser never builds have none.
+NODE_FIELDS = {
+    SyntaxNodeTypes.PROGRAM: ("declaration_list",),
+    SyntaxNodeTypes.DECLARATION_LIST: ("declaration", "list_declaration"),
+    SyntaxNodeTypes.LIST_DECLARATION: ("list_declaration",),
+    SyntaxNodeTypes.DECLARATION: ("fun_declaration", "var_declaration", "rec_declaration"),
+    SyntaxNodeTypes.REC_DECLARATION: ("id", "local_declarations"),
+    SyntaxNodeTypes.VAR_DECLARATION: ("type_specifier", "var_declaration_list"),
+    SyntaxNodeTypes.SCOPED_VAR_DECLARATION: ("scoped_type_specifier", "var_decl_list"),
+    SyntaxNodeTypes.VAR_DEC_LIST: ("var_decl_initialize", "list_var_decl"),
+    SyntaxNodeTypes.VAR_DEC_INITIALIZE: ("var_decl_id", "initialize_decl_var"),
+    SyntaxNodeTypes.VAR_DEC_ID: ("id", "id_decl_var"),
+    SyntaxNodeTypes.SCOPED_TYPE_SPECIFIER: ("type_specifier",),
+    SyntaxNodeTypes.TYPE_SPECIFIER: ("id", "return_type_specifier"),
+    SyntaxNodeTypes.RETURN_TYPE_SPECIFIER: ("return_type_specifier",),
+    SyntaxNodeTypes.FUN_DECLARATION: ("type_specifier", "id", "params", "statement"),
+    SyntaxNodeTypes.PARAMS: ("param_list",),
+    SyntaxNodeTypes.PARAM_LIST: ("param_type_list", "list_param"),
+    SyntaxNodeTypes.PARAM_TYPE_LIST: ("type_specifier", "param_id_list"),
+    SyntaxNodeTypes.PARAM_ID_LIST: ("param_id", "list_id_param"),
+    SyntaxNodeTypes.PARAM_ID: ("id", "id_param"),
+    SyntaxNodeTypes.STATEMENT: ("expression_stmt", "compound_stmt", "selection_stmt", "iteration_stmt",
+                                "return_statement", "break_statement"),
+    SyntaxNodeTypes.COMPOUND_STATEMENT: ("local_declarations", "statement_list"),
+    SyntaxNodeTypes.LOCAL_DECLARATIONS: (),
+    SyntaxNodeTypes.STATEMENT_LIST: ("list_statement",),
+    SyntaxNodeTypes.EXPRESSION_STATEMENT: ("expression",),
+    SyntaxNodeTypes.SELECTION_STATEMENT: ("simple_expression", "statement", "stmt_selection"),
+    SyntaxNodeTypes.ITERATION_STATEMENT: ("simple_expression", "statement"),
+    SyntaxNodeTypes.RETURN_STATEMENT: ("expression",),
+    SyntaxNodeTypes.BREAK_STATEMENT: ("break_statement",),
+    SyntaxNodeTypes.EXPRESSION: ("mutable", "op", "simple_expression", "expression", "expression_sum"),
+    SyntaxNodeTypes.SIMPLE_EXPRESSION: ("and_expression", "expression_simple"),
+    SyntaxNodeTypes.AND_EXPRESSION: ("unary_rel_expression", "expression_and"),
+    SyntaxNodeTypes.UNARY_REL_EXPRESSION: ("not_op", "unary_rel_expression", "rel_expression"),
+    SyntaxNodeTypes.REL_EXPRESSION: ("sum_expression", "expression_rel"),
+    SyntaxNodeTypes.RELOP: ("relop",),
+    SyntaxNodeTypes.SUM_EXPRESSION: ("term", "expression_sum"),
+    SyntaxNodeTypes.SUMOP: ("sumop",),
+    SyntaxNodeTypes.TERM: ("unary_expression", "new_term"),
+    SyntaxNodeTypes.MULOP: ("mulop",),
+    SyntaxNodeTypes.UNARY_EXPRESSION: ("unary_op", "factor"),
+    SyntaxNodeTypes.UNARY_OP: ("unary_op",),
+    SyntaxNodeTypes.FACTOR: ("immutable", "mutable"),
+    SyntaxNodeTypes.MUTABLE: ("id", "new_mutable"),
+    SyntaxNodeTypes.IMMUTABLE: ("expression", "call", "constant"),
+    SyntaxNodeTypes.CALL: ("id", "args"),
+    SyntaxNodeTypes.ARGS: ("arg_list",),
+    SyntaxNodeTypes.ARG_LIST: ("expression", "list_arg"),
+    SyntaxNodeTypes.CONSTANT: ("num_const", "char_const", "boolean"),
+    SyntaxNodeTypes.DECLARATIONS_LOCAL: ("declarations_local",),
+    SyntaxNodeTypes.LIST_PARAM: ("list_param",),
+    SyntaxNodeTypes.LIST_ID_PARAM: ("list_id_param",),
+    SyntaxNodeTypes.ID_PARAM: ("id_param",),
+    SyntaxNodeTypes.LIST_VAR_DECL: ("list_var_decl",),
+    SyntaxNodeTypes.ID_DECL_VAR: ("id_decl_var",),
+    SyntaxNodeTypes.INITIALIZE_DECL_VAR: ("simple_expression",),
+    SyntaxNodeTypes.EXPRESSION_SIMPLE: ("or_op", "expression_simple"),
+    SyntaxNodeTypes.EXPRESSION_AND: ("and_op", "expression_and"),
+    SyntaxNodeTypes.EXPRESSION_REL: ("relop", "sum_expression"),
+    SyntaxNodeTypes.NEW_MUTABLE: ("expressions", "ids"),
+    SyntaxNodeTypes.LIST_ARG: ("expression",),
+    SyntaxNodeTypes.NEW_TERM: ("mulop", "unary_expression"),
+    SyntaxNodeTypes.EXPRESSION_SUM: ("sumop", "term"),
+    SyntaxNodeTypes.LIST_STATEMENT: ("statement",),
+    SyntaxNodeTypes.STATEMENT_SELECTION: ("statement",),
+}
+
 class SyntaxNode():
+    """Base of every tree node.
+
+    SyntaxNode(kind) builds an instance of the class for that kind, which
+    has a slot per attribute in NODE_FIELDS and the kind as a class
+    attribute, so nodes carry no __dict__. Attributes the parser didn't set
+    are missing, like they were before.
+    """
+    __slots__ = ()
+    fields = ()
+    classes = {}
+
+    def __new__(cls, *args):
+        if cls is SyntaxNode:
+            if args[0] not in SyntaxNode.classes:
+                raise Exception("Syntax Tree node type is invalid: '{}'".format(args[0]))
+            cls = SyntaxNode.classes[args[0]]
+        return object.__new__(cls)
+
     def __init__(self, node_type):
-        if not node_type:
-            Exception("Syntax Tree node type does is invalid!")
-        
-        self.type = node_type
-    
+        pass
+
     def __str__(self):
         return "{}".format(self.type)
 
+# Kinds whose nodes are expressions, they get a data_type slot where the
+# semantic pass caches the type it computed ("int", "bool", "int[]", ...)
+TYPED_NODE_TYPES = {
+    SyntaxNodeTypes.EXPRESSION, SyntaxNodeTypes.SIMPLE_EXPRESSION, SyntaxNodeTypes.AND_EXPRESSION,
+    SyntaxNodeTypes.UNARY_REL_EXPRESSION, SyntaxNodeTypes.REL_EXPRESSION, SyntaxNodeTypes.SUM_EXPRESSION,
+    SyntaxNodeTypes.TERM, SyntaxNodeTypes.UNARY_EXPRESSION, SyntaxNodeTypes.FACTOR, SyntaxNodeTypes.MUTABLE,
+    SyntaxNodeTypes.IMMUTABLE, SyntaxNodeTypes.CALL, SyntaxNodeTypes.CONSTANT,
+}
+
+for node_type, fields in NODE_FIELDS.items():
+    name = "".join(part.capitalize() for part in node_type.name.split("_")) + "Node"
+    slots = fields + ("data_type",) if node_type in TYPED_NODE_TYPES else fields
+    node_class = type(name, (SyntaxNode,), {"__slots__": slots, "fields": fields, "type": node_type})
+    SyntaxNode.classes[node_type] = node_class
+    # Module level, so the classes can be found by name
+    globals()[name] = node_class
+for node_type in SyntaxNodeTypes:
+    if node_type not in SyntaxNode.classes:
+        raise Exception("No fields declared for node type '{}'".format(node_type))
+
+# Compact expression nodes, `type` is the grammar level the concrete tree would
+# have used for the same operator (SUM_EXPRESSION for +, TERM for *, ...)
+class BinaryNode(SyntaxNode):
+    __slots__ = ("type", "op", "left", "right", "data_type")
+    fields = ("left", "op", "right")
+
+    def __init__(self, node_type, op, left, right):
+        self.type = node_type
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def __str__(self):
+        return "{} '{}'".format(self.type, self.op.value)
+
+class UnaryNode(SyntaxNode):
+    __slots__ = ("type", "op", "operand", "data_type")
+    fields = ("op", "operand")
+
+    def __init__(self, node_type, op, operand):
+        self.type = node_type
+        self.op = op
+        self.operand = operand
+
+    def __str__(self):
+        return "{} '{}'".format(self.type, self.op.value)
+
+class LeafNode(SyntaxNode):
+    __slots__ = ("type", "token", "data_type")
+    fields = ("token",)
+
+    def __init__(self, node_type, token):
+        self.type = node_type
+        self.token = token
+
+    def __str__(self):
+        return "{} '{}'".format(self.type, self.token.value)
+
+def children(node):
+    # Child nodes in source order, tokens and unset fields are skipped
+    found = []
+    for name in node.fields:
+        child = getattr(node, name, None)
+        if type(child) is list:
+            found.extend(item for item in child if isinstance(item, SyntaxNode))
+        elif isinstance(child, SyntaxNode):
+            found.append(child)
+    return found
+
+def walk(tree):
+    """Yields every node of the tree, parents before their children.
+
+    Uses its own stack, so it works on trees of any depth.
+    """
+    pending = [tree] if tree is not None else []
+    while pending:
+        node = pending.pop()
+        yield node
+        found = children(node)
+        found.reverse()
+        pending.extend(found)
+
+def top_level_declarations(tree):
+    # DECLARATION nodes of a PROGRAM, in source order
+    if tree is None or not hasattr(tree, "declaration_list"):
+        return []
+    declarations = [tree.declaration_list.declaration]
+    if tree.declaration_list.list_declaration is not None:
+        declarations += tree.declaration_list.list_declaration.list_declaration
+    return declarations
+
+class NodeVisitor():
+    """Calls visit_<kind>(node) for every node that has one, e.g.
+    visit_fun_declaration or visit_sum_expression, in walk order."""
+
+    def visit(self, tree):
+        handlers = {}
+        for node in walk(tree):
+            kind = node.type
+            if kind not in handlers:
+                handlers[kind] = getattr(self, "visit_" + kind.name.lower(), None)
+            handler = handlers[kind]
+            if handler is not None:
+                handler(node)
+
 class SemanticHelpers():
     def __init__(self, symbol_table):
         self.symbol_table = symbol_table
@@ -253,30 +570,32 @@ class SemanticHelpers():
         if const.token_class == TokenClass.ID:
             return self.assign_id_to_id(token, const)
 
-        token = self.symbol_table.lookup(token.value)
-        if const.token_class == TokenClass.CHARCONST and token.data_type == "char":
-            token.variable_value = const
+        symbol = self.symbol_table.lookup_token(token)
+        if const.token_class == TokenClass.CHARCONST and symbol.data_type == "char":
+            symbol.variable_value = const
             return
-        if const.token_class == TokenClass.NUMCONST and token.data_type == "int":
-            token.variable_value = const
+        if const.token_class == TokenClass.NUMCONST and symbol.data_type == "int":
+            symbol.variable_value = const
             return
-        if const.value == "true" or const.value == "false" and token.data_type == "bool":
-            token.variable_value = const
+        if const.value == "true" or const.value == "false" and symbol.data_type == "bool":
+            symbol.variable_value = const
             return
+        token = symbol.token
         raise Exception("Invalid type assignment at '" + token.value + "' (" + str(token.line) + ":" + str(token.column) + ")")
     
     def assign_id_to_id(self, left_id, right_id):
-        left_token = self.symbol_table.lookup(left_id.value)
-        right_token = self.symbol_table.lookup(right_id.value)
-        if left_token.data_type != right_token.data_type:
+        left_symbol = self.symbol_table.lookup_token(left_id)
+        right_symbol = self.symbol_table.lookup_token(right_id)
+        if left_symbol.data_type != right_symbol.data_type:
+            right_token = right_symbol.token
             raise Exception("Invalid type assignment at '" + right_token.value + "' (" + str(right_token.line) + ":" + str(right_token.column) + ")")
-        left_token.variable_value = right_token.value
+        left_symbol.variable_value = right_symbol.value
         return
 
     def validate_type(self, func_id, return_token):
-        func_type = self.symbol_table.lookup(func_id.value).data_type
+        func_type = self.symbol_table.lookup_token(func_id).data_type
         if return_token.token_class == TokenClass.ID:
-            return_type = self.symbol_table.lookup(return_token.value).data_type
+            return_type = self.symbol_table.lookup_token(return_token).data_type
             if func_type == return_type:
                 return
         if return_token.token_class == TokenClass.CHARCONST:
@@ -288,7 +607,23 @@ class SemanticHelpers():
         raise Exception("Return type should be '{0}'".format(func_type))
     
     def is_valid_variable(self, variable_id):
-        var_token = self.symbol_table.lookup(variable_id.value)
-        if hasattr(var_token, "data_type"):
+        symbol = self.symbol_table.lookup_token(variable_id)
+        if symbol is not None and symbol.declared:
             return
-        raise Exception("Variable '{0}' wasn't declared ({1}:{2})".format(variable_id.value, variable_id.line, variable_id.column))
\ No newline at end of file
+        raise Exception("Variable '{0}' wasn't declared ({1}:{2})".format(variable_id.value, variable_id.line, variable_id.column))
+
+class SyntaxOnlyHelpers(SemanticHelpers):
+    """SemanticHelpers that check nothing, for parsing without inline
+    semantics (`--syntax-only`, or when semantic.py checks the tree)."""
+
+    def assign_value(self, token, const):
+        pass
+
+    def assign_id_to_id(self, left_id, right_id):
+        pass
+
+    def validate_type(self, func_id, return_token):
+        pass
+
+    def is_valid_variable(self, variable_id):
+        pass
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+from ir import Block, Const, Instruction, UNCHECKED, is_variable, dominators
+from optimizer import PASSES, PURE_UNARY, propagate_copies, traps
+
+class Loop():
+    """A natural loop: its header, the blocks of its body and the blocks jumping back to the header."""
+
+    def __init__(self, header):
+        self.header = header
+        self.blocks = {header}
+        self.latches = []
+        self.depth = 1
+        self.preheader = None
+
+def dominates(idom, dominator, label):
+    while label is not None:
+        if label == dominator:
+            return True
+        label = idom[label]
+    return False
+
+def find_loops(function, idom=None):
+    """Natural loops of a function, innermost first.
+
+    An edge to a block that dominates its source is a back edge; the loop
+    of a header is every block that reaches one of its back edges without
+    going through the header. preheader is the only block outside the loop
+    jumping to the header, when there is one and it jumps nowhere else.
+    """
+    idom = idom or dominators(function)
+    labels = {block.label: block for block in function.blocks}
+    loops = {}
+    for block in function.blocks:
+        for label in block.succs:
+            if not dominates(idom, label, block.label):
+                continue
+            loop = loops.setdefault(label, Loop(label))
+            loop.latches.append(block.label)
+            pending = [block.label]
+            while pending:
+                member = pending.pop()
+                if member not in loop.blocks:
+                    loop.blocks.add(member)
+                    pending.extend(labels[member].preds)
+    found = sorted(loops.values(), key=lambda loop: len(loop.blocks))
+    for loop in found:
+        loop.depth = sum(1 for other in found if loop.header in other.blocks)
+        outside = [pred for pred in labels[loop.header].preds if pred not in loop.blocks]
+        if len(outside) == 1 and labels[outside[0]].succs == [loop.header]:
+            loop.preheader = outside[0]
+    return found
+
+def insert_preheaders(function):
+    """Gives every loop a preheader, returns how many blocks were added."""
+    added = 0
+    while True:
+        # Adding a block changes the loops around it, so they are found again
+        missing = [loop for loop in find_loops(function) if loop.preheader is None]
+        if not missing:
+            return added
+        loop = missing[0]
+        labels = {block.label: block for block in function.blocks}
+        header = labels[loop.header]
+        outside = [pred for pred in header.preds if pred not in loop.blocks]
+        preheader = Block(max(labels) + 1)
+        for pred in outside:
+            terminator = labels[pred].terminator()
+            if terminator.op == "jump":
+                terminator.extra = preheader.label
+            else:
+                terminator.extra = tuple(preheader.label if target == loop.header else target
+                                         for target in terminator.extra)
+        for phi in header.phis():
+            entering = [(arg, label) for arg, label in zip(phi.args, phi.extra) if label in outside]
+            staying = [(arg, label) for arg, label in zip(phi.args, phi.extra) if label not in outside]
+            if len(entering) == 1:
+                incoming = entering[0][0]
+            else:
+                # The values entering the loop meet in the preheader
+                incoming = phi.dest + ".pre"
+                preheader.instructions.append(Instruction("phi", incoming, [arg for arg, _ in entering],
+                                                          [label for _, label in entering]))
+            phi.args = [incoming] + [arg for arg, _ in staying]
+            phi.extra = [preheader.label] + [label for _, label in staying]
+        preheader.instructions.append(Instruction("jump", extra=loop.header))
+        function.blocks.insert(function.blocks.index(header), preheader)
+        function.update_cfg()
+        added += 1
+
+def hoistable(instruction):
+    # Computes the same value wherever it runs, and can't fail
+    if instruction.op == "copy":
+        return True
+    if instruction.op == "unary":
+        return instruction.extra in PURE_UNARY
+    return instruction.op == "binary" and not traps(instruction)
+
+def induction_variables(function, loop, definitions):
+    """(variable, initial value, step, next value) of every basic induction variable of a loop.
+
+    That is a header phi whose value around the only back edge is itself
+    plus or minus a constant.
+    """
+    if loop.preheader is None or len(loop.latches) != 1:
+        return []
+    found = []
+    header = function.block(loop.header)
+    for phi in header.phis():
+        incoming = dict(zip(phi.extra, phi.args))
+        initial, following = incoming.get(loop.preheader), incoming.get(loop.latches[0])
+        update = definitions.get(following) if is_variable(following) else None
+        if update is None or update.op != "binary" or update.extra not in ("+", "-"):
+            continue
+        left, right = update.args
+        if left == phi.dest and type(right) is Const and type(right.value) is int:
+            step = right.value if update.extra == "+" else -right.value
+        elif right == phi.dest and update.extra == "+" and type(left) is Const and type(left.value) is int:
+            step = left.value
+        else:
+            continue
+        found.append((phi.dest, initial, step, following))
+    return found
+
+class LoopOptimizer():
+    """Loop invariant code motion, strength reduction and bounds check elimination on SSA functions.
+
+    hoist_invariants and reduce_strength are function passes for a
+    PassManager (see loop_passes). loops holds (function, header, blocks,
+    depth, induction variables) of every loop found, applied a line per
+    transformation.
+    """
+
+    def __init__(self):
+        self.loops = []
+        self.applied = []
+
+    def hoist_invariants(self, function):
+        """Moves the instructions of a loop whose operands don't change in it to its preheader.
+
+        Inner loops go first, so an invariant of several nested loops
+        ends up in front of the outermost one.
+        """
+        insert_preheaders(function)
+        for loop in find_loops(function):
+            if loop.preheader is None:
+                continue
+            labels = {block.label: block for block in function.blocks}
+            defined = {instruction.dest for label in loop.blocks for instruction in labels[label].instructions
+                       if instruction.dest is not None}
+            invariant = []
+            changed = True
+            while changed:
+                changed = False
+                for label in sorted(loop.blocks):
+                    block = labels[label]
+                    for instruction in list(block.instructions):
+                        if not hoistable(instruction) or not all(
+                                not is_variable(arg) or arg not in defined for arg in instruction.args):
+                            continue
+                        # Its value is now known before the loop
+                        block.instructions.remove(instruction)
+                        defined.discard(instruction.dest)
+                        invariant.append(instruction)
+                        changed = True
+            preheader = labels[loop.preheader]
+            preheader.instructions[-1:-1] = invariant
+            for instruction in invariant:
+                self.applied.append("{}: hoisted {} out of the loop at B{}".format(
+                    function.name, instruction, loop.header))
+
+    def reduce_strength(self, function):
+        """Recognizes induction variables, turns their products into sums and drops the bounds checks they pass.
+
+        A product i * c of a basic induction variable i and a loop invariant
+        c gets its own header phi, starting at initial * c and growing by
+        step * c each time around. An element v[i] in the part of the loop
+        that runs after the header checked i < *v can't be out of bounds
+        when i starts at zero or more and never goes down.
+        """
+        for loop in find_loops(function):
+            labels = {block.label: block for block in function.blocks}
+            definitions = {instruction.dest: instruction for block in function.blocks
+                           for instruction in block.instructions if instruction.dest is not None}
+            inside = {instruction.dest for label in loop.blocks for instruction in labels[label].instructions
+                      if instruction.dest is not None}
+            variables = induction_variables(function, loop, definitions)
+            self.loops.append((function.name, loop.header, sorted(loop.blocks), loop.depth,
+                               [(name, initial, step) for name, initial, step, _ in variables]))
+            for name, initial, step, _ in variables:
+                self.reduce_products(function, loop, labels, inside, name, initial, step)
+                self.drop_bounds_checks(function, loop, labels, definitions, name, initial, step)
+
+    def reduce_products(self, function, loop, labels, inside, name, initial, step):
+        preheader, latch = labels[loop.preheader], labels[loop.latches[0]]
+        products = []
+        for label in sorted(loop.blocks):
+            for instruction in labels[label].instructions:
+                if instruction.op != "binary" or instruction.extra != "*" or name not in instruction.args:
+                    continue
+                factor = instruction.args[1] if instruction.args[0] == name else instruction.args[0]
+                if factor != name and not (is_variable(factor) and factor in inside):
+                    products.append((labels[label], instruction, factor))
+        for block, instruction, factor in products:
+            start = self.product(preheader, initial, factor, instruction.dest + ".start")
+            increment = self.product(preheader, Const(step), factor, instruction.dest + ".step")
+            reduced = instruction.dest + ".iv"
+            labels[loop.header].instructions.insert(0, Instruction(
+                "phi", reduced, [start, reduced + ".next"], [loop.preheader, loop.latches[0]]))
+            latch.instructions.insert(len(latch.instructions) - 1, Instruction(
+                "binary", reduced + ".next", [reduced, increment], "+"))
+            block.instructions[block.instructions.index(instruction)] = Instruction("copy", instruction.dest,
+                                                                                    [reduced])
+            self.applied.append("{}: reduced {} to {} += {}".format(function.name, instruction, reduced, increment))
+
+    def product(self, preheader, left, right, dest):
+        # left * right, computed once in front of the loop
+        if type(left) is Const and type(right) is Const:
+            return Const(left.value * right.value)
+        if left == Const(0):
+            return left
+        if left == Const(1):
+            return right
+        preheader.instructions.insert(len(preheader.instructions) - 1,
+                                      Instruction("binary", dest, [left, right], "*"))
+        return dest
+
+    def drop_bounds_checks(self, function, loop, labels, definitions, name, initial, step):
+        if type(initial) is not Const or type(initial.value) is not int or initial.value < 0 or step < 0:
+            return
+        branch = labels[loop.header].terminator()
+        if branch.op != "branch" or not is_variable(branch.args[0]):
+            return
+        condition = definitions.get(branch.args[0])
+        if condition is None or condition.op != "binary":
+            return
+        if condition.extra == "<" and condition.args[0] == name:
+            bound = condition.args[1]
+        elif condition.extra == ">" and condition.args[1] == name:
+            bound = condition.args[0]
+        else:
+            return
+        size = definitions.get(bound) if is_variable(bound) else None
+        body = branch.extra[0]
+        if size is None or size.op != "unary" or size.extra != "size" or body not in loop.blocks:
+            return
+        array = size.args[0]
+        idom = dominators(function)
+        for label in sorted(loop.blocks):
+            if not dominates(idom, body, label):
+                continue
+            for instruction in labels[label].instructions:
+                if instruction.op in ("index", "store_index") and instruction.args[:2] == [array, name] \
+                        and instruction.extra != UNCHECKED:
+                    instruction.extra = UNCHECKED
+                    self.applied.append("{}: dropped the bounds check of {}[{}]".format(function.name, array, name))
+
+    def format_report(self):
+        lines = []
+        for name, header, blocks, depth, variables in self.loops:
+            lines.append("{}: loop at B{}, depth {}, blocks {}".format(
+                name, header, depth, " ".join("B{}".format(label) for label in blocks)))
+            for variable, initial, step in variables:
+                lines.append("  induction variable {} from {} step {}".format(variable, initial, step))
+        lines.extend(self.applied)
+        return "\n".join(lines)
+
+def loop_passes(optimizer):
+    """PASSES with the loop passes of `optimizer` before dead code elimination."""
+    return PASSES[:-1] + [
+        ("licm", optimizer.hoist_invariants),
+        ("strength-reduction", optimizer.reduce_strength),
+        ("copy-propagation", propagate_copies),
+    ] + PASSES[-1:]
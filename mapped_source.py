@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+from array import array
+from bisect import bisect_right
+from language import TokenClass
+from tokenbuffer import TOKEN_CLASSES
+from dfa_scanner import DFAScanner, classify, TRANSITIONS, START, STOP, IN_WORD, IN_ALNUM, \
+    IN_BLANK, IN_COMMENT, IN_NUMBER, IN_SEPARATOR, IN_OPERATOR, IN_SLASH, IN_CHAR, OTHER, BLANK, \
+    TWO_CHAR_OPERATORS, KEYWORDS, LOGICAL_OPERATORS
+
+# bytes.translate table, non ASCII bytes are never part of a valid lexeme.
+# open() in text mode turns \r\n into \n, so \r is a blank here.
+BYTE_CLASSES = bytes(BLANK if code == 13 else classify(chr(code)) if code < 128 else OTHER
+                     for code in range(256))
+BYTE_KEYWORDS = frozenset(keyword.encode() for keyword in KEYWORDS)
+BYTE_LOGICAL_OPERATORS = frozenset(operator.encode() for operator in LOGICAL_OPERATORS)
+BYTE_TWO_CHAR_OPERATORS = frozenset(operator.encode() for operator in TWO_CHAR_OPERATORS)
+QUOTE = ord("'")
+NEWLINE = b"\n"
+
+class MappedSource():
+    """Read only memory map of a source file plus the offset of every line start."""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise Exception("Source code file is empty")
+        self.line_starts = array('Q', [0])
+        size = len(self.data)
+        position = self.data.find(NEWLINE)
+        while position != -1 and position + 1 < size:
+            self.line_starts.append(position + 1)
+            position = self.data.find(NEWLINE, position + 1)
+
+    def __len__(self):
+        return len(self.line_starts)
+
+    def line_span(self, line_pos):
+        start = self.line_starts[line_pos]
+        if line_pos + 1 < len(self.line_starts):
+            return start, self.line_starts[line_pos + 1]
+        return start, len(self.data)
+
+    def line_of(self, offset):
+        # 0 based line holding the given offset
+        return bisect_right(self.line_starts, offset) - 1
+
+    def text(self, start, end):
+        return self.data[start:end].decode("utf-8", "replace")
+
+    def char_at(self, offset):
+        # Text mode reading would have turned \r\n into \n
+        if self.data[offset:offset + 2] == b"\r\n":
+            return "\n"
+        return self.text(offset, offset + 1)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+class SpanToken():
+    """Token holding a (start, end) span of a MappedSource.
+
+    The lexeme is decoded the first time `value` is read; line and column are
+    computed from the line start index. Columns follow Scanner's conventions.
+    """
+    __slots__ = ("source", "token_class", "start", "end", "cached_value", "symbol_id")
+
+    def __init__(self, source, token_class, start, end):
+        self.source = source
+        self.token_class = token_class
+        self.start = start
+        self.end = end
+        self.cached_value = None
+
+    @property
+    def value(self):
+        if self.cached_value is None:
+            self.cached_value = self.source.text(self.start, self.end)
+        return self.cached_value
+
+    @property
+    def line(self):
+        return self.source.line_of(self.start) + 1
+
+    @property
+    def column(self):
+        end = self.end - 1 if self.token_class == TokenClass.NUMCONST else self.end
+        return end - self.source.line_starts[self.line - 1] + 1
+
+    def __str__(self):
+        return "Token '{}' with value '{}' in line: {}, col: {}".format(self.token_class,
+            self.value, self.line, self.column)
+
+    def __repr__(self):
+        return "Token class: {}, Value: {}".format(self.token_class, self.value)
+
+class SpanBuffer():
+    """Token list of a MappedScanner: kind and span of every token in three arrays.
+
+    Indexing returns a fresh SpanToken, like TokenBuffer returns TokenViews.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('Q')
+        self.ends = array('Q')
+
+    def add(self, token_class, start, end):
+        self.kinds.append(token_class.value)
+        self.starts.append(start)
+        self.ends.append(end)
+        return len(self.kinds) - 1
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.kinds)
+        if index < 0 or index >= len(self.kinds):
+            raise IndexError("No token {}, {} tokens were scanned".format(index, len(self.kinds)))
+        return SpanToken(self.source, TOKEN_CLASSES[self.kinds[index]], self.starts[index], self.ends[index])
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield self[index]
+
+class MappedScanner(DFAScanner):
+    """DFA scanner working on the bytes of a MappedSource by offset.
+
+    Non ASCII bytes are reported one by one as lexical errors, where the str
+    based scanners report one error per character.
+    """
+
+    def __init__(self, source, symbol_table):
+        super().__init__(source, symbol_table)
+        self.source = source
+        self.tokens = SpanBuffer(source)
+
+    def scan(self):
+        for line_pos in range(len(self.source)):
+            self.scan_span(line_pos)
+
+        if self.error_list:
+            for err in self.error_list:
+                print(err)
+
+    def scan_span(self, line_pos):
+        data = self.source.data
+        source = self.source
+        tokens = self.tokens
+        add = tokens.add
+        line_start, line_end = source.line_span(line_pos)
+        classes = data[line_start:line_end].translate(BYTE_CLASSES)
+        position = line_start
+        while position < line_end:
+            start = position
+            state = TRANSITIONS[START][classes[position - line_start]]
+            position += 1
+            alpha_end = None
+            row = TRANSITIONS[state]
+            while position < line_end:
+                next_state = row[classes[position - line_start]]
+                if next_state == STOP:
+                    break
+                if next_state != state:
+                    if next_state == IN_ALNUM:
+                        alpha_end = position
+                    state = next_state
+                    row = TRANSITIONS[state]
+                position += 1
+
+            if state == IN_BLANK or state == IN_COMMENT:
+                continue
+
+            if state == IN_WORD or state == IN_ALNUM:
+                if alpha_end is None:
+                    alpha_end = position
+                prefix = data[start:alpha_end]
+                if prefix in BYTE_KEYWORDS:
+                    add(TokenClass.KEYWORD, start, alpha_end)
+                    position = alpha_end
+                elif prefix in BYTE_LOGICAL_OPERATORS:
+                    add(TokenClass.OPERATOR, start, alpha_end)
+                    position = alpha_end
+                else:
+                    self.register_id(tokens[add(TokenClass.ID, start, position)])
+
+            elif state == IN_NUMBER:
+                if position < line_end and data[position:position + 1].isalpha():
+                    # The letter itself when nothing follows it on the line
+                    bad = position + 1 if position + 1 < line_end else position
+                    self.register_error(source.char_at(bad), line_pos, position - line_start)
+                add(TokenClass.NUMCONST, start, position)
+
+            elif state == IN_SEPARATOR:
+                add(TokenClass.SEPARATOR, start, position)
+
+            elif state == IN_OPERATOR or state == IN_SLASH:
+                if data[start:start + 2] in BYTE_TWO_CHAR_OPERATORS:
+                    position += 1
+                add(TokenClass.OPERATOR, start, position)
+
+            elif state == IN_CHAR:
+                position = self.read_quoted_span(start, line_pos, line_end)
+
+            else:
+                self.register_error(source.char_at(start), line_pos, start - line_start)
+
+    def read_quoted_span(self, position, line_pos, line_end):
+        data = self.source.data
+        position += 1
+        if position >= line_end:
+            # A quote ending the line opens no char constant
+            line_start = self.source.line_starts[line_pos]
+            self.register_error(self.source.char_at(position - 1), line_pos, position - 1 - line_start)
+            return position
+        if data[position] == QUOTE:
+            self.tokens.add(TokenClass.CHARCONST, position, position)
+            return position + 1
+
+        position += 1
+        if position < line_end and data[position] == QUOTE:
+            self.tokens.add(TokenClass.CHARCONST, position - 1, position)
+            return position + 1
+        line_start = self.source.line_starts[line_pos]
+        self.register_error(self.source.char_at(position - 1), line_pos, position - line_start)
+        return position + 1
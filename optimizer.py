@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+import time
+from ir import Const, Instruction, OPERATIONS, UNCHECKED, is_variable, to_ssa, dominators, dominator_tree
+
+# Lattice values of sparse conditional constant propagation besides a Const
+TOP = "top"
+BOTTOM = "bottom"
+
+# Operators whose operands can be swapped
+COMMUTATIVE = {"+", "*", "==", "!="}
+
+# unary instructions that compute a value from their operand and nothing else
+PURE_UNARY = {"neg", "not", "size"}
+
+def uses(function):
+    """Instructions using every variable, by name."""
+    found = {}
+    for block in function.blocks:
+        for instruction in block.instructions:
+            for arg in instruction.args:
+                if is_variable(arg):
+                    found.setdefault(arg, []).append(instruction)
+    return found
+
+def replace_uses(function, replacements):
+    # Follows chains, a replacement may itself be replaced
+    def resolve(arg):
+        while is_variable(arg) and arg in replacements:
+            arg = replacements[arg]
+        return arg
+    for block in function.blocks:
+        for instruction in block.instructions:
+            instruction.args = [resolve(arg) for arg in instruction.args]
+
+def traps(instruction):
+    # Whether an instruction may stop the program with a run time error
+    if instruction.op == "index":
+        return instruction.extra != UNCHECKED
+    if instruction.op == "unary" and instruction.extra == "random":
+        return True
+    if instruction.op == "binary" and instruction.extra in ("/", "%"):
+        divisor = instruction.args[1]
+        return not (type(divisor) is Const and divisor.value != 0)
+    return False
+
+def evaluate(instruction, value):
+    """Lattice value of what an instruction defines, given `value` of its operands."""
+    op = instruction.op
+    if op not in ("copy", "binary", "unary"):
+        return BOTTOM
+    if op == "unary" and instruction.extra not in ("neg", "not"):
+        return BOTTOM
+    operands = [value(arg) for arg in instruction.args]
+    if BOTTOM in operands:
+        return BOTTOM
+    if TOP in operands:
+        return TOP
+    if op == "copy":
+        return operands[0]
+    try:
+        if op == "unary":
+            operand = operands[0].value
+            return Const(-operand if instruction.extra == "neg" else not operand)
+        left, right = operands[0].value, operands[1].value
+        if right == 0 and instruction.extra in ("/", "%"):
+            # Left for the program to report
+            return BOTTOM
+        return Const(OPERATIONS[instruction.extra](left, right))
+    except Exception:
+        # Undefined operands of code that never runs
+        return BOTTOM
+
+def propagate_constants(function):
+    """Sparse conditional constant propagation (Wegman and Zadeck).
+
+    Values start at TOP and only go down to a Const then BOTTOM; blocks
+    start unreachable and become executable through the branches whose
+    condition allows it. Uses of constants are replaced, branches on a
+    constant become jumps and the blocks no edge reaches are removed.
+    """
+    labels = {block.label: block for block in function.blocks}
+    definitions = {}
+    owner = {}
+    for block in function.blocks:
+        for instruction in block.instructions:
+            owner[id(instruction)] = block.label
+            if instruction.dest is not None:
+                definitions[instruction.dest] = instruction
+    users = uses(function)
+    values = {param: BOTTOM for param in function.params}
+    executable = set()
+    edges = set()
+
+    def value(arg):
+        if type(arg) is Const:
+            return arg
+        return values.get(arg, TOP)
+
+    def meet(phi):
+        result = TOP
+        for arg, pred in zip(phi.args, phi.extra):
+            if (pred, owner[id(phi)]) not in edges:
+                continue
+            incoming = value(arg)
+            if incoming == TOP:
+                continue
+            if result == TOP:
+                result = incoming
+            elif incoming != result:
+                return BOTTOM
+        return result
+
+    flow = [(None, function.blocks[0].label)]
+    ssa = []
+
+    def visit(instruction):
+        label = owner[id(instruction)]
+        if instruction.op == "phi":
+            result = meet(instruction)
+        elif instruction.op == "branch":
+            condition = value(instruction.args[0])
+            if condition == BOTTOM:
+                flow.extend((label, target) for target in instruction.extra)
+            elif condition != TOP:
+                flow.append((label, instruction.extra[0] if condition.value else instruction.extra[1]))
+            return
+        elif instruction.op == "jump":
+            flow.append((label, instruction.extra))
+            return
+        elif instruction.dest is None:
+            return
+        else:
+            result = evaluate(instruction, value)
+        if result != values.get(instruction.dest, TOP):
+            values[instruction.dest] = result
+            ssa.extend(users.get(instruction.dest, []))
+
+    while flow or ssa:
+        if flow:
+            edge = flow.pop()
+            if edge in edges:
+                continue
+            edges.add(edge)
+            block = labels[edge[1]]
+            if block.label in executable:
+                for phi in block.phis():
+                    visit(phi)
+                continue
+            executable.add(block.label)
+            for instruction in block.instructions:
+                visit(instruction)
+        else:
+            instruction = ssa.pop()
+            if owner[id(instruction)] in executable:
+                visit(instruction)
+
+    for block in function.blocks:
+        if block.label not in executable:
+            continue
+        kept = []
+        for instruction in block.instructions:
+            instruction.args = [value(arg) if is_variable(arg) and type(value(arg)) is Const else arg
+                                for arg in instruction.args]
+            if instruction.dest is not None and type(values.get(instruction.dest)) is Const:
+                # Every use now has the constant
+                continue
+            if instruction.op == "branch":
+                condition = instruction.args[0]
+                if type(condition) is Const or value(condition) == TOP:
+                    taken = [target for target in instruction.extra if (block.label, target) in edges]
+                    instruction = Instruction("jump", extra=taken[0] if taken else instruction.extra[1])
+            kept.append(instruction)
+        block.instructions = kept
+    function.blocks = [block for block in function.blocks if block.label in executable]
+    function.update_cfg()
+    merge_blocks(function)
+
+def merge_blocks(function):
+    """Appends every block whose only predecessor jumps to it alone to that predecessor."""
+    labels = {block.label: block for block in function.blocks}
+    for block in list(function.blocks):
+        if block.label not in labels or len(block.preds) != 1 or block is function.blocks[0]:
+            continue
+        pred = labels[block.preds[0]]
+        if pred.succs != [block.label]:
+            continue
+        # A phi with a single predecessor is a copy
+        body = [Instruction("copy", instruction.dest, instruction.args) if instruction.op == "phi" else instruction
+                for instruction in block.instructions]
+        pred.instructions[-1:] = body
+        pred.succs = block.succs
+        for label in block.succs:
+            successor = labels[label]
+            successor.preds = [pred.label if other == block.label else other for other in successor.preds]
+            for phi in successor.phis():
+                phi.extra = [pred.label if other == block.label else other for other in phi.extra]
+        del labels[block.label]
+    function.blocks = [block for block in function.blocks if block.label in labels]
+
+def propagate_copies(function):
+    """Replaces variables defined by a copy, or a phi of one value, by that value."""
+    changed = True
+    while changed:
+        changed = False
+        replacements = {}
+        for block in function.blocks:
+            kept = []
+            for instruction in block.instructions:
+                if instruction.op == "copy":
+                    replacements[instruction.dest] = instruction.args[0]
+                    continue
+                if instruction.op == "phi":
+                    # A phi may use itself around a loop
+                    incoming = {arg for arg in instruction.args if arg != instruction.dest}
+                    if len(incoming) == 1:
+                        replacements[instruction.dest] = incoming.pop()
+                        continue
+                kept.append(instruction)
+            block.instructions = kept
+        if replacements:
+            replace_uses(function, replacements)
+            changed = True
+
+def operand_key(arg):
+    return (type(arg).__name__, repr(arg))
+
+def eliminate_common_subexpressions(function):
+    """Dominator based value numbering: an expression already computed in a dominating block is reused."""
+    idom = dominators(function)
+    children = dominator_tree(idom)
+    labels = {block.label: block for block in function.blocks}
+    replacements = {}
+    available = {}
+    pending = [(function.blocks[0].label, None)]
+    while pending:
+        label, leaving = pending.pop()
+        if leaving is not None:
+            for key in leaving:
+                del available[key]
+            continue
+        block = labels[label]
+        added = []
+        kept = []
+        for instruction in block.instructions:
+            args = [replacements.get(arg, arg) if is_variable(arg) else arg for arg in instruction.args]
+            instruction.args = args
+            if instruction.op == "binary" or (instruction.op == "unary" and instruction.extra in PURE_UNARY):
+                if instruction.extra in COMMUTATIVE:
+                    args = sorted(args, key=operand_key)
+                key = (instruction.op, instruction.extra) + tuple(operand_key(arg) for arg in args)
+                if key in available:
+                    replacements[instruction.dest] = available[key]
+                    continue
+                available[key] = instruction.dest
+                added.append(key)
+            kept.append(instruction)
+        block.instructions = kept
+        pending.append((label, added))
+        pending.extend((child, None) for child in children[label])
+    # Phis of later blocks may use a replaced name
+    replace_uses(function, replacements)
+
+def eliminate_dead_code(function):
+    """Removes instructions whose value is never used and that have no effect of their own.
+
+    Stores, calls, control flow and whatever may trap stay, with every
+    definition they use, transitively.
+    """
+    definitions = {}
+    live = set()
+    pending = []
+    for block in function.blocks:
+        for instruction in block.instructions:
+            if instruction.dest is not None:
+                definitions[instruction.dest] = instruction
+            if instruction.dest is None or instruction.op == "call" or traps(instruction):
+                live.add(id(instruction))
+                pending.append(instruction)
+    while pending:
+        for arg in pending.pop().args:
+            definition = definitions.get(arg) if is_variable(arg) else None
+            if definition is not None and id(definition) not in live:
+                live.add(id(definition))
+                pending.append(definition)
+    for block in function.blocks:
+        block.instructions = [instruction for instruction in block.instructions if id(instruction) in live]
+
+# Name and function of every pass, in the order they run
+PASSES = [
+    ("ssa", to_ssa),
+    ("sccp", propagate_constants),
+    ("copy-propagation", propagate_copies),
+    ("cse", eliminate_common_subexpressions),
+    ("dce", eliminate_dead_code),
+]
+
+class PassManager():
+    """Runs passes over every function of a ProgramIR and reports what each did.
+
+    report holds (pass, milliseconds, instructions before, instructions
+    after) of every pass run, all functions together.
+    """
+
+    def __init__(self, passes=PASSES):
+        self.passes = passes
+        self.report = []
+
+    def run(self, program):
+        for name, function_pass in self.passes:
+            before = program.instruction_count()
+            start = time.perf_counter()
+            for function in program.functions.values():
+                function_pass(function)
+            elapsed = (time.perf_counter() - start) * 1000
+            self.report.append((name, elapsed, before, program.instruction_count()))
+        return program
+
+    def format_report(self):
+        lines = ["{:<18} {:>9} {:>8} {:>8}".format("pass", "ms", "before", "after")]
+        for name, elapsed, before, after in self.report:
+            lines.append("{:<18} {:>9.2f} {:>8} {:>8}".format(name, elapsed, before, after))
+        return "\n".join(lines)
+
+def optimize_program(program, passes=PASSES):
+    """Optimizes a ProgramIR in place, returns the PassManager that did it."""
+    manager = PassManager(passes)
+    manager.run(program)
+    return manager
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from language import *
+from scanner import Scanner
+from parser import Parser
+from tokenbuffer import TOKEN_CLASSES
+from tree_file import TreeWriter, ProgramFile
+
+# Measured in-process on benchmarks.py parallel-parse's source, the parent's
+# share (skim pass, sending the tokens of every body, reading the trees back)
+# is about 0.73 of a serial parse and the workers' about 1.6, so the pool only
+# breaks even from about 6 workers. 200000 tokens is about 2.5 s of serial
+# parsing, where forking the workers costs next to nothing.
+PARALLEL_THRESHOLD = 200000
+
+def body_end(tokens, start):
+    # Index after the statement starting at tokens[start], by brace matching
+    depth = 0
+    for index in range(start, len(tokens)):
+        token = tokens[index]
+        if token.token_class == TokenClass.CHARCONST:
+            continue
+        if token.value == "{":
+            depth += 1
+        elif token.value == "}":
+            depth -= 1
+            if depth <= 0:
+                return index + 1
+        elif token.value == ";" and depth == 0:
+            return index + 1
+    return len(tokens)
+
+def token_tuple(token):
+    if token is None:
+        return None
+    return (token.token_class.value, token.value, token.line - 1, token.column - 1)
+
+def tuple_token(fields):
+    if fields is None:
+        return None
+    code, value, line, column = fields
+    return Token(TOKEN_CLASSES[code], value, line, column)
+
+class BodyScanner(Scanner):
+    """Cursor over tokens a worker received, nothing is lexed here."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.error_list = []
+        self.last_token = -1
+
+class BodyReader(ProgramFile):
+    """Decodes the body blocks workers send back onto the parent's tokens."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+class BodyJob():
+    """A function body the skim pass left for a worker."""
+    __slots__ = ("node", "start", "end", "symbols", "errors", "state")
+
+    def __init__(self, node, start, end, symbols, errors, state):
+        self.node = node
+        # [start, end) token range of the body
+        self.start = start
+        self.end = end
+        # how many global symbols and syntax errors came before it
+        self.symbols = symbols
+        self.errors = errors
+        # parser fields at the start of the body
+        self.state = state
+
+class ParallelParser(Parser):
+    """Parser that parses function bodies in a process pool.
+
+    A skim pass runs the top level rules as usual, so the global scope is
+    filled with every function signature, record and global variable, but
+    instead of parsing a function body it only finds where it ends by brace
+    matching. The bodies are then parsed and checked in worker processes,
+    each seeing the global symbols declared before it and its parameters, and their
+    nodes and syntax errors are merged back in source order, so the tree,
+    error_list and the first exception raised are the ones Parser gives.
+    """
+
+    def __init__(self, symbol_table, scanner, workers=None, threshold=PARALLEL_THRESHOLD):
+        super().__init__(symbol_table, scanner)
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.skimming = False
+        self.in_signature = False
+        self.jobs = []
+
+    def parse(self):
+        tokens = getattr(self.scanner, "tokens", None)
+        if self.workers < 2 or type(tokens) is not list or len(tokens) < self.threshold:
+            return super().parse()
+
+        self.skimming = True
+        self.jobs = []
+        self.symbol_table.journal = []
+        failure = None
+        try:
+            tree = super().parse()
+        except Exception as raised:
+            # Bodies before the failing declaration still come first
+            tree = None
+            failure = raised
+        finally:
+            self.skimming = False
+            symbols = self.symbol_table.journal
+            self.symbol_table.journal = None
+
+        if self.jobs and not self.parse_bodies(tokens, symbols):
+            # The braces of some body don't match how it parses (it has
+            # syntax errors), only a full parse can tell where it stops
+            while self.symbol_table.current_scope > 0:
+                self.symbol_table.kill_scope()
+            self.scanner.last_token = -1
+            self.error_list = []
+            self.last_data_type = self.last_constant = self.last_id = self.last_func_id = None
+            return super().parse()
+        if failure is not None:
+            raise failure
+        return tree
+
+    def fun_declaration(self):
+        self.in_signature = self.skimming
+        node = super().fun_declaration()
+        self.in_signature = False
+        if self.jobs and self.jobs[-1].node is None:
+            self.jobs[-1].node = node
+        return node
+
+    def statement(self):
+        if not self.in_signature:
+            return super().statement()
+        self.in_signature = False
+        tokens = self.scanner.tokens
+        start = self.scanner.last_token
+        end = body_end(tokens, start)
+        if end < len(tokens) and tokens[end].token_class == TokenClass.ID:
+            # A declaration without type specifier takes the last type the
+            # body read, so this body has to be parsed before going on
+            return super().statement()
+
+        state = (self.last_data_type, token_tuple(self.last_constant), token_tuple(self.last_id),
+                 token_tuple(self.last_func_id))
+        self.jobs.append(BodyJob(None, start, end, len(self.symbol_table.journal), len(self.error_list), state))
+        if end < len(tokens):
+            self.scanner.last_token = end - 1
+            self.current_token = self.scanner.next_token()
+        else:
+            self.scanner.last_token = len(tokens) - 1
+            self.current_token = tokens[-1]
+        return None
+
+    def split(self, jobs):
+        # Contiguous runs of bodies with about the same number of tokens
+        chunk_count = self.workers * 4
+        total = sum(job.end - job.start for job in jobs)
+        size = max(1, -(-total // chunk_count))
+        chunks = [[]]
+        filled = 0
+        for job in jobs:
+            if filled >= size:
+                chunks.append([])
+                filled = 0
+            chunks[-1].append(job)
+            filled += job.end - job.start
+        return chunks
+
+    def parse_bodies(self, tokens, symbols):
+        # Globals, and the parameters and record fields one scope below them
+        symbol_fields = [(token_tuple(symbol.token), symbol.kind.value, symbol.data_type, symbol.array_size,
+                          symbol.scope) if symbol.scope <= 2 and symbol.declared else None for key, symbol in symbols]
+        chunks = self.split(self.jobs)
+        work = []
+        for chunk in chunks:
+            # Lookahead may peek a few tokens past the body, as in a full parse
+            bodies = [(job.start, [token_tuple(token) for token in tokens[job.start:job.end + 3]], job.symbols,
+                       job.state) for job in chunk]
+            work.append((symbol_fields[:chunk[-1].symbols], bodies, type(self.semantic_helpers)))
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(parse_chunk, work))
+
+        reader = BodyReader(tokens)
+        errors = []
+        merged = 0
+        failure = None
+        for chunk, (parsed, raised) in zip(chunks, results):
+            for job, (body, body_errors, end) in zip(chunk, parsed):
+                if end != job.end:
+                    return False
+                job.node.statement = reader.read(body, 0)[0]
+                errors.extend(self.error_list[merged:job.errors])
+                errors.extend(body_errors)
+                merged = job.errors
+            if raised is not None:
+                # A serial parse stops in the failing body, the declarations after it never report
+                body_errors, failure = raised
+                errors.extend(self.error_list[merged:chunk[len(parsed)].errors])
+                errors.extend(body_errors)
+                break
+        else:
+            errors.extend(self.error_list[merged:])
+        self.error_list = errors
+        if failure is not None:
+            raise failure
+        return True
+
+def declare_fields(symbol_table, symbol_fields):
+    token_fields, kind, data_type, array_size, scope = symbol_fields
+    token = tuple_token(token_fields)
+    symbol_table.store_global(token)
+    key = symbol_table.key_of(token)
+    symbol_table.declare(key, Symbol(key, scope, SymbolKind(kind), data_type, token, array_size))
+
+def parse_chunk(work):
+    symbols, bodies, helpers_class = work
+    symbol_table = SymbolTable()
+    symbol_table.push_scope()
+    declared = 0
+    parsed = []
+    for start, fields, symbol_count, state in bodies:
+        tokens = [tuple_token(token_fields) for token_fields in fields]
+        for token in tokens:
+            if token.token_class == TokenClass.ID:
+                symbol_table.store_global(token)
+        # Global symbols are added in declaration order, as the full parse does;
+        # record fields and parameters are gone again after their declaration
+        for symbol_fields in symbols[declared:symbol_count]:
+            if symbol_fields is not None and symbol_fields[4] == 1:
+                declare_fields(symbol_table, symbol_fields)
+        declared = max(declared, symbol_count)
+        # The parameters of this body are the last symbols before it
+        params = symbol_count
+        while params > 0 and symbols[params - 1] is not None and symbols[params - 1][4] == 2:
+            params -= 1
+        symbol_table.push_scope()
+        for symbol_fields in symbols[params:symbol_count]:
+            declare_fields(symbol_table, symbol_fields)
+
+        scanner = BodyScanner(tokens)
+        parser = Parser(symbol_table, scanner)
+        parser.semantic_helpers = helpers_class(symbol_table)
+        parser.last_data_type = state[0]
+        parser.last_constant, parser.last_id, parser.last_func_id = [tuple_token(fields) for fields in state[1:]]
+        try:
+            parser.current_token = scanner.next_token()
+            body = parser.statement()
+        except Exception as raised:
+            # The syntax errors before the exception are part of the outcome
+            return parsed, (parser.error_list, raised)
+        while symbol_table.current_scope > 1:
+            symbol_table.kill_scope()
+        end = scanner.last_token
+        if end == len(tokens) - 1 and parser.current_token is tokens[end]:
+            end += 1
+        # Bodies go back in the tree file encoding, with tokens written as
+        # their index in the parent's token list
+        writer = TreeWriter()
+        writer.token_ids = {id(token): start + index for index, token in enumerate(tokens)}
+        block = bytearray()
+        writer.write(block, body)
+        parsed.append((bytes(block), parser.error_list, start + end))
+    return parsed, None
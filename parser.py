@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from language import *
+from grammar import C_MINUS, terminal_of
 
 class Parser():
     def __init__(self, symbol_table, scanner):
@@ -15,6 +16,16 @@ class Parser():
         self.last_id = None
         self.last_func_id = None
         self.helpers = PatternHelpers()
+        self.grammar = C_MINUS
+
+    def predict(self, nonterminal):
+        # Production chosen by the LL(k) table, None when nothing can start here
+        entry = self.grammar.table[nonterminal].get(terminal_of(self.current_token))
+        offset = 1
+        while type(entry) is dict:
+            entry = entry.get(terminal_of(self.scanner.see_token(offset)))
+            offset += 1
+        return entry
     
     def register_error(self, token, expected):
         self.error_list.append("Syntax Error in {}:{} expected:'{}' found:'{}'".format(
@@ -76,27 +87,27 @@ class Parser():
 
     def declaration(self):
         node = SyntaxNode(SyntaxNodeTypes.DECLARATION)
-        if self.current_token.token_class == TokenClass.ID:
-            node.fun_declaration = self.fun_declaration()
+        production = self.predict("declaration")
+        if production is not None:
+            rule = production[0]
+            if rule == "funDeclaration":
+                node.fun_declaration = self.fun_declaration()
+            elif rule == "varDeclaration":
+                node.var_declaration = self.var_declaration()
+            else:
+                node.rec_declaration = self.rec_declaration()
             return node
 
-        token_value = self.current_token.value
-        if token_value == "record":
-            node.rec_declaration = self.rec_declaration()
+        # Nothing predicted, report the error where the old lookahead did
+        if self.current_token.token_class == TokenClass.ID:
+            node.fun_declaration = self.fun_declaration()
             return node
-        
-        #This verification is tricky. One has to walk to tokens foward to know which rule to apply
-        if self.helpers.is_data_type(token_value):
+        if self.helpers.is_data_type(self.current_token.value):
+            if terminal_of(self.scanner.see_token(1)) == "ID":
+                node.var_declaration = self.var_declaration()
+                return node
             self.current_token = self.scanner.next_token()
-            if self.current_token.token_class == TokenClass.ID:
-                next_token = self.scanner.see_next_token()
-                self.current_token = self.scanner.prior_token()
-                if next_token.value == "(":
-                    node.fun_declaration = self.fun_declaration()
-                else:
-                    node.var_declaration = self.var_declaration()
-            else:
-                self.register_error(self.current_token, "identifier")
+            self.register_error(self.current_token, "identifier")
             return node
 
         self.register_error(self.current_token, "type declaration")
@@ -110,7 +121,9 @@ class Parser():
             # self.current_token = self.scanner.next_token()
         else:
             node.id = self.current_token
+            self.symbol_table.set_type(node.id, node.id.value, SymbolKind.RECORD)
         self.register_error_if_next_is_not("{")
+        self.current_token = self.scanner.next_token()
         self.symbol_table.push_scope()
         node.local_declarations = self.local_declarations()
         self.register_error_if_current_is_not("}")
@@ -125,36 +138,46 @@ class Parser():
         
         if self.current_token.token_class == TokenClass.ID:
             node.id = self.current_token
-            self.symbol_table.set_type(node.id, self.last_data_type)
+            self.symbol_table.set_type(node.id, self.last_data_type, SymbolKind.FUNC)
             self.last_id = node.id
             self.last_func_id = node.id
             self.register_error_if_next_is_not("(")
             self.current_token = self.scanner.next_token()
+            # Parameters get a scope of their own, the body block opens inside it
+            self.symbol_table.push_scope()
             node.params = self.params()
             self.register_error_if_current_is_not(")")
             node.statement = self.statement()
+            self.symbol_table.kill_scope()
             return node
 
         self.register_error(self.current_token, "identifier or type specifier")
     
     def var_declaration(self):
-        node = SyntaxNodeTypes(SyntaxNodeTypes.VAR_DECLARATION)
+        node = SyntaxNode(SyntaxNodeTypes.VAR_DECLARATION)
         node.type_specifier = self.type_specifier()
         node.var_declaration_list = self.var_decl_list()
-        self.register_error_if_next_is_not(";")
+        self.register_error_if_current_is_not(";")
         return node
 
     def local_declarations(self):
-        node = SyntaxNodeTypes(SyntaxNodeTypes.LOCAL_DECLARATIONS)
         # node.declarations_local = self.declarations_local()
         return self.declarations_local()
 
+    def starts_local_declaration(self):
+        token = self.current_token
+        if self.helpers.is_data_type(token.value) or token.value == "static":
+            return True
+        # A record type, `point p;`, where a statement would have an operator
+        following = self.scanner.see_next_token()
+        return token.token_class == TokenClass.ID and following is not None and following.token_class == TokenClass.ID
+
     def declarations_local(self):
         node = SyntaxNode(SyntaxNodeTypes.DECLARATIONS_LOCAL)
         # self.current_token = self.scanner.next_token()
         token = self.current_token
         declarations = []
-        while self.helpers.is_data_type(self.current_token.value) or self.current_token.value == "static":
+        while self.starts_local_declaration():
             declaration = self.scoped_var_declaration()
             declarations.append(declaration)
         if len(declarations) > 0:
@@ -180,7 +203,8 @@ class Parser():
         node = SyntaxNode(SyntaxNodeTypes.VAR_DEC_INITIALIZE)
         node.var_decl_id = self.var_decl_id()
         node.initialize_decl_var = self.initialize_decl_var()
-        self.semantic_helpers.assign_value(self.last_id, self.last_constant)
+        if hasattr(node.initialize_decl_var, "simple_expression"):
+            self.semantic_helpers.assign_value(self.last_id, self.last_constant)
         return node
 
     def initialize_decl_var(self):
@@ -196,10 +220,13 @@ class Parser():
         self.register_error_if_next_is_not(expected_class=TokenClass.ID)
         node.id = self.current_token
         # Sets the datatype in the symboltable for future reference
-        self.symbol_table.set_type(node.id, self.last_data_type)
+        symbol = self.symbol_table.set_type(node.id, self.last_data_type)
         self.last_id = node.id
         self.current_token = self.scanner.next_token()
         node.id_decl_var = self.id_decl_var()
+        size = getattr(node.id_decl_var, "id_decl_var", None)
+        if size is not None and size.token_class == TokenClass.NUMCONST:
+            symbol.array_size = int(size.value)
         return node
 
     def id_decl_var(self):
@@ -215,15 +242,15 @@ class Parser():
     def list_var_decl(self):
         node = SyntaxNode(SyntaxNodeTypes.LIST_VAR_DECL)
         var_declarations = []
-        # next_token = self.scanner.see_next_token()
-        while self.scanner.see_next_token().token_class == TokenClass.ID:
-            if self.current_token.value != ",":
+        while True:
+            production = self.predict("listVarDecl")
+            if production is None and terminal_of(self.scanner.see_token(1)) == "ID":
+                # Missing comma between two names
                 self.register_error(self.current_token, ",")
-            # last_token.value = ""
-            # self.current_token = self.scanner.next_token()
+            elif not production:
+                break
             decl = self.var_decl_initialize()
             var_declarations.append(decl)
-            # self.current_token = self.scanner.next_token()
         
         if len(var_declarations) > 0:
             node.list_var_decl = var_declarations
@@ -262,8 +289,12 @@ class Parser():
         node.param_list = self.param_list()
         return node
 
+    def starts_param_type(self, token):
+        # Parameters can be of a record type too
+        return token is not None and (self.helpers.is_data_type(token.value) or token.token_class == TokenClass.ID)
+
     def param_list(self):
-        if self.helpers.is_data_type(self.current_token.value):
+        if self.starts_param_type(self.current_token):
             node = SyntaxNode(SyntaxNodeTypes.PARAM_LIST)
             node.param_type_list = self.param_type_list()
             # self.register_error_if_current_is_not(")")
@@ -289,10 +320,12 @@ class Parser():
         node = SyntaxNode(SyntaxNodeTypes.PARAM_ID)
         self.register_error_if_next_is_not(expected_class=TokenClass.ID)
         node.id = self.current_token
-        self.symbol_table.set_type(node.id, self.last_data_type)
+        symbol = self.symbol_table.set_type(node.id, self.last_data_type, SymbolKind.PARAM)
         self.last_id = node.id
         self.current_token = self.scanner.next_token()
-        node.idParam = self.id_param()
+        node.id_param = self.id_param()
+        if hasattr(node.id_param, "id_param"):
+            symbol.array_size = 0
         return node
 
     def id_param(self):
@@ -300,6 +333,7 @@ class Parser():
         if self.current_token.value == "[":
             self.register_error_if_next_is_not("]")
             node.id_param = self.current_token
+            self.current_token = self.scanner.next_token()
             return node
         return node
 
@@ -307,11 +341,9 @@ class Parser():
         node = SyntaxNode(SyntaxNodeTypes.LIST_ID_PARAM)
         ids = []
         
-        while self.scanner.see_next_token().token_class == TokenClass.ID:
+        while self.current_token.value == ",":
             id_param = self.param_id()
             ids.append(id_param)
-            self.register_error_if_next_is_not(",")
-            self.current_token = self.scanner.next_token()
         
         if len(ids) > 0:
             node.list_id_param = ids
@@ -319,13 +351,11 @@ class Parser():
 
     def list_param(self):
         node = SyntaxNode(SyntaxNodeTypes.LIST_PARAM)
-        if self.helpers.is_data_type(self.scanner.see_next_token().value):
-            self.register_error_if_current_is_not(";")
         list_params = []
-        while self.helpers.is_data_type(self.current_token.value):
+        while self.current_token.value == ";" and self.starts_param_type(self.scanner.see_next_token()):
+            self.current_token = self.scanner.next_token()
             param_type_list = self.param_type_list()
             list_params.append(param_type_list)
-            # self.current_token = self.scanner.next_token()
         
         if len(list_params) > 0:
             node.list_param = list_params
@@ -361,7 +391,6 @@ class Parser():
             self.current_token = self.scanner.next_token()
             expression = self.expression()
             expressions.append(expression)
-            self.current_token = self.scanner.next_token()
         
         if len(expressions) > 0:
             node.expression = expressions
@@ -373,17 +402,16 @@ class Parser():
         else:
             node.id = self.current_token
             self.last_id = node.id
-        self.current_token = self.scanner.next_token()
         self.register_error_if_next_is_not("(")
+        self.current_token = self.scanner.next_token()
         node.args = self.args()
-        self.register_error_if_next_is_not(")")
+        self.register_error_if_current_is_not(")")
         return node
 
     def args(self):
         node = SyntaxNode(SyntaxNodeTypes.ARGS)
-        if self.current_token.token_class == TokenClass.ID:
+        if self.current_token.value != ")":
             node.arg_list = self.arg_list()
-            self.current_token = self.scanner.next_token()
         return node
 
     def break_statement(self):
@@ -411,7 +439,6 @@ class Parser():
             self.current_token = self.scanner.next_token()
             expr = self.and_expression()
             exprs.append(expr)
-            self.current_token = self.scanner.next_token()
         
         if len(exprs) > 0:
             node.expression_simple = exprs
@@ -431,7 +458,6 @@ class Parser():
             self.current_token = self.scanner.next_token()
             expr = self.unary_rel_expression()
             exprs.append(expr)
-            self.current_token = self.scanner.next_token()
         
         if len(exprs) > 0:
             node.expression_and = exprs
@@ -513,8 +539,9 @@ class Parser():
     def immutable(self):
         node = SyntaxNode(SyntaxNodeTypes.IMMUTABLE)
         if self.current_token.value == "(":
+            self.current_token = self.scanner.next_token()
             node.expression = self.expression()
-            self.register_error_if_next_is_not(")")
+            self.register_error_if_current_is_not(")")
             return node
         elif self.current_token.token_class == TokenClass.ID:
             node.call = self.call()
@@ -565,27 +592,15 @@ class Parser():
 
     def factor(self):
         node = SyntaxNode(SyntaxNodeTypes.FACTOR)
-        token = self.current_token
-        # next_token = self.scanner.see_next_token()
-        if self.helpers.is_constant_token(token) or token.value == "(":
-            # self.current_token = self.scanner.next_token()
+        production = self.predict("factor")
+        if production is None:
+            return None
+        if production[0] == "immutable":
             node.immutable = self.immutable()
-            return node
-        
-        elif self.current_token.token_class == TokenClass.ID:
-            next_token = self.scanner.see_next_token()
-            if next_token.value == "(":
-                node.immutable = self.immutable()
-                return node
-            elif next_token.value == "[" or next_token.value == ".":
-                node.mutable = self.mutable()
-                return node
-            else:
-                node.id = self.current_token
-                self.current_token = self.scanner.next_token()
-                # self.register_error(self.current_token, "mutable or immutable structure")
-                return node
-        
+        else:
+            node.mutable = self.mutable()
+        return node
+
     def term(self):
         node = SyntaxNode(SyntaxNodeTypes.TERM)
         node.unary_expression = self.unary_expression()
@@ -612,15 +627,12 @@ class Parser():
     def unary_expression(self):
         node = SyntaxNode(SyntaxNodeTypes.UNARY_EXPRESSION)
         ops = []
-        if self.helpers.is_unary_operator(self.current_token.value):
-            while self.helpers.is_unary_operator(self.current_token.value):
-                op = self.unary_op()
-                ops.append(op)
-                self.current_token = self.scanner.next_token()
-            if len(ops) > 0:
-                node.unary_op = ops
-        else:
-            node.factor = self.factor()
+        while self.helpers.is_unary_operator(self.current_token.value):
+            op = self.unary_op()
+            ops.append(op)
+        if len(ops) > 0:
+            node.unary_op = ops
+        node.factor = self.factor()
         return node
 
     def sum_expression(self):
@@ -671,7 +683,9 @@ class Parser():
         node.statement_list = self.statement_list()
         if self.current_token.value == "}":
             self.symbol_table.kill_scope()
-            self.current_token = self.scanner.next_token()
+            # The brace closing the last function ends the source
+            if self.scanner.see_next_token() is not None:
+                self.current_token = self.scanner.next_token()
         # self.register_error_if_current_is_not("}")
         return node
 
@@ -760,34 +774,29 @@ class Parser():
 
     def expression(self):
         node = SyntaxNode(SyntaxNodeTypes.EXPRESSION)
-        if self.current_token.token_class == TokenClass.ID:
-            next_token = self.scanner.see_next_token()
-            if next_token.value == '(':
-                node.simple_expression = self.simple_expression()
-                return node
-            node.mutable = self.mutable()
-            if self.helpers.is_contracted_operator(self.current_token.value):
-                node.op = self.current_token
-                self.current_token = self.scanner.next_token()
-                return node
-            if self.helpers.is_assignment_operator(self.current_token.value):
-                node.op = self.current_token
-                self.current_token = self.scanner.next_token()
-                left_id = self.last_id
-                node.expression = self.expression()
-                if left_id.value == self.last_id.value:
-                    self.semantic_helpers.assign_value(left_id, self.last_constant)
-                else:
-                    self.semantic_helpers.assign_value(left_id, self.last_id)
-                return node
-            if self.helpers.is_sumop(self.current_token.value):
-                node.expression_sum = self.expression_sum()
-                return node
-            return node
-        if self.current_token.value == '(' or self.helpers.is_constant_token(self.current_token):
+        production = self.predict("expression")
+        if production is None:
+            self.register_error(self.current_token, 'valid expression')
+            return None
+        if production[0] == "simpleExpression":
             node.simple_expression = self.simple_expression()
             return node
-        if self.helpers.is_logical_operator(self.current_token.value):
-            node.simple_expression = self.simple_expression()
+        # Ambiguous lookaheads, e.g. a[i] = ... against a[i] + ..., start as an assignment
+        node.mutable = self.mutable()
+        if self.helpers.is_contracted_operator(self.current_token.value):
+            node.op = self.current_token
+            self.current_token = self.scanner.next_token()
             return node
-        self.register_error(self.current_token, 'valid expression')
\ No newline at end of file
+        if self.helpers.is_assignment_operator(self.current_token.value):
+            node.op = self.current_token
+            self.current_token = self.scanner.next_token()
+            left_id = self.last_id
+            node.expression = self.expression()
+            if self.symbol_table.key_of(left_id) == self.symbol_table.key_of(self.last_id):
+                self.semantic_helpers.assign_value(left_id, self.last_constant)
+            else:
+                self.semantic_helpers.assign_value(left_id, self.last_id)
+            return node
+        if self.helpers.is_sumop(self.current_token.value):
+            node.expression_sum = self.expression_sum()
+        return node
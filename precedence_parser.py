@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+from language import *
+from parser import Parser
+
+# Binding power and node type of every operator, higher binds tighter.
+# Relational operators don't chain: a < b < c is not C-.
+BINARY_OPERATORS = {
+    "or": (1, SyntaxNodeTypes.SIMPLE_EXPRESSION, True),
+    "and": (2, SyntaxNodeTypes.AND_EXPRESSION, True),
+    "<=": (4, SyntaxNodeTypes.REL_EXPRESSION, False),
+    "<": (4, SyntaxNodeTypes.REL_EXPRESSION, False),
+    ">": (4, SyntaxNodeTypes.REL_EXPRESSION, False),
+    ">=": (4, SyntaxNodeTypes.REL_EXPRESSION, False),
+    "==": (4, SyntaxNodeTypes.REL_EXPRESSION, False),
+    "!=": (4, SyntaxNodeTypes.REL_EXPRESSION, False),
+    "+": (5, SyntaxNodeTypes.SUM_EXPRESSION, True),
+    "-": (5, SyntaxNodeTypes.SUM_EXPRESSION, True),
+    "*": (6, SyntaxNodeTypes.TERM, True),
+    "/": (6, SyntaxNodeTypes.TERM, True),
+    "%": (6, SyntaxNodeTypes.TERM, True),
+}
+
+# Prefix operators, the operand is parsed at their binding power
+PREFIX_OPERATORS = {
+    "not": (3, SyntaxNodeTypes.UNARY_REL_EXPRESSION),
+    "-": (7, SyntaxNodeTypes.UNARY_EXPRESSION),
+    "*": (7, SyntaxNodeTypes.UNARY_EXPRESSION),
+    "?": (7, SyntaxNodeTypes.UNARY_EXPRESSION),
+}
+
+class PrecedenceParser(Parser):
+    """Parser that reads expressions by precedence climbing.
+
+    Instead of one node per grammar level (SIMPLE_EXPRESSION down to FACTOR
+    for a bare `5`), an expression becomes BinaryNode, UnaryNode and LeafNode
+    objects only where there is an operator or an operand. Indexed and
+    dotted variables and calls keep their concrete MUTABLE and CALL nodes.
+    With concrete=True expressions go through the recursive rules instead,
+    giving the same tree as Parser.
+    """
+
+    def __init__(self, symbol_table, scanner, concrete=False):
+        super().__init__(symbol_table, scanner)
+        self.concrete = concrete
+
+    def expression(self):
+        if self.concrete:
+            return super().expression()
+        production = self.predict("expression")
+        if production is None:
+            self.register_error(self.current_token, 'valid expression')
+            return None
+        if production[0] == "simpleExpression":
+            return self.climb(0)
+        # Starts with a variable, only assignments keep their EXPRESSION node
+        target = self.variable()
+        if self.helpers.is_contracted_operator(self.current_token.value):
+            node = SyntaxNode(SyntaxNodeTypes.EXPRESSION)
+            node.mutable = target
+            node.op = self.current_token
+            self.current_token = self.scanner.next_token()
+            return node
+        if self.helpers.is_assignment_operator(self.current_token.value):
+            node = SyntaxNode(SyntaxNodeTypes.EXPRESSION)
+            node.mutable = target
+            node.op = self.current_token
+            self.current_token = self.scanner.next_token()
+            left_id = self.last_id
+            node.expression = self.expression()
+            if self.symbol_table.key_of(left_id) == self.symbol_table.key_of(self.last_id):
+                self.semantic_helpers.assign_value(left_id, self.last_constant)
+            else:
+                self.semantic_helpers.assign_value(left_id, self.last_id)
+            return node
+        return self.climb(0, target)
+
+    def simple_expression(self):
+        if self.concrete:
+            return super().simple_expression()
+        return self.climb(0)
+
+    def climb(self, min_power, left=None):
+        # `left` is an operand the caller already read
+        if left is None:
+            left = self.prefix()
+        blocked = None
+        while self.current_token.token_class == TokenClass.OPERATOR:
+            entry = BINARY_OPERATORS.get(self.current_token.value)
+            if entry is None or entry[0] < min_power or entry[0] == blocked:
+                break
+            power, node_type, chains = entry
+            op = self.current_token
+            self.current_token = self.scanner.next_token()
+            left = BinaryNode(node_type, op, left, self.climb(power + 1))
+            if not chains:
+                blocked = power
+        return left
+
+    def prefix(self):
+        if self.current_token.token_class == TokenClass.OPERATOR:
+            entry = PREFIX_OPERATORS.get(self.current_token.value)
+            if entry is not None:
+                op = self.current_token
+                self.current_token = self.scanner.next_token()
+                return UnaryNode(entry[1], op, self.climb(entry[0]))
+        return self.operand()
+
+    def operand(self):
+        production = self.predict("factor")
+        token = self.current_token
+        if production is None:
+            self.register_error(token, "valid expression")
+            return None
+        if production[0] == "mutable":
+            return self.variable()
+        if token.value == "(":
+            self.current_token = self.scanner.next_token()
+            node = self.expression()
+            self.register_error_if_current_is_not(")")
+            return node
+        if token.token_class == TokenClass.ID:
+            return self.call()
+        self.last_constant = token
+        self.current_token = self.scanner.next_token()
+        return LeafNode(SyntaxNodeTypes.CONSTANT, token)
+
+    def variable(self):
+        # Plain names are leaves, only indexed and dotted ones need a MUTABLE node
+        token = self.current_token
+        self.semantic_helpers.is_valid_variable(token)
+        self.last_id = token
+        self.current_token = self.scanner.next_token()
+        if self.current_token.value != "[" and self.current_token.value != ".":
+            return LeafNode(SyntaxNodeTypes.MUTABLE, token)
+        node = SyntaxNode(SyntaxNodeTypes.MUTABLE)
+        node.id = token
+        node.new_mutable = self.new_mutable()
+        return node
+
+def chain(node_type, first, ops, operands):
+    # Left associative BinaryNodes over first op operand op operand ...
+    node = first
+    for op, operand in zip(ops, operands):
+        node = BinaryNode(node_type, op, node, operand)
+    return node
+
+def compact(node):
+    """The expression under a concrete node as PrecedenceParser builds it.
+
+    Compact nodes are returned as they are; the MUTABLE, CALL and
+    assignment EXPRESSION nodes that compact trees keep are updated in
+    place. Types the semantic pass cached move to the new nodes. Built
+    children first, without recursion, like SemanticAnalyzer.expression.
+    """
+    if node is None or isinstance(node, (BinaryNode, UnaryNode, LeafNode)):
+        return node
+    built = {}
+
+    def get(child):
+        return built.get(id(child), child) if child is not None else None
+
+    for child in reversed(list(walk(node))):
+        if isinstance(child, (BinaryNode, UnaryNode, LeafNode)):
+            continue
+        rule = COMPACT_RULES.get(child.type)
+        if rule is None:
+            continue
+        result = rule(child, get)
+        data_type = getattr(child, "data_type", None)
+        if result is not None and result is not child and data_type is not None:
+            result.data_type = data_type
+        built[id(child)] = result
+    return get(node)
+
+def compact_expression(node, get):
+    target = getattr(node, "mutable", None)
+    if target is None:
+        return get(getattr(node, "simple_expression", None))
+    if getattr(node, "op", None) is not None:
+        node.mutable = get(target)
+        if getattr(node, "expression", None) is not None:
+            node.expression = get(node.expression)
+        return node
+    expression_sum = getattr(node, "expression_sum", None)
+    ops = [op.sumop for op in getattr(expression_sum, "sumop", None) or []]
+    return chain(SyntaxNodeTypes.SUM_EXPRESSION, get(target), ops,
+                 [get(term) for term in getattr(expression_sum, "term", None) or []])
+
+def compact_simple_expression(node, get):
+    tail = node.expression_simple
+    operands = getattr(tail, "expression_simple", None) or []
+    ops = [tail.or_op] * len(operands) if operands else []
+    return chain(SyntaxNodeTypes.SIMPLE_EXPRESSION, get(node.and_expression), ops, [get(item) for item in operands])
+
+def compact_and_expression(node, get):
+    tail = node.expression_and
+    operands = getattr(tail, "expression_and", None) or []
+    ops = [tail.and_op] * len(operands) if operands else []
+    return chain(SyntaxNodeTypes.AND_EXPRESSION, get(node.unary_rel_expression), ops,
+                 [get(item) for item in operands])
+
+def compact_unary_rel_expression(node, get):
+    if getattr(node, "not_op", None) is not None:
+        return UnaryNode(SyntaxNodeTypes.UNARY_REL_EXPRESSION, node.not_op, get(node.unary_rel_expression))
+    return get(getattr(node, "rel_expression", None))
+
+def compact_rel_expression(node, get):
+    relop = getattr(node.expression_rel, "relop", None)
+    if relop is None:
+        return get(node.sum_expression)
+    return BinaryNode(SyntaxNodeTypes.REL_EXPRESSION, relop.relop, get(node.sum_expression),
+                      get(node.expression_rel.sum_expression))
+
+def compact_sum_expression(node, get):
+    tail = node.expression_sum
+    return chain(SyntaxNodeTypes.SUM_EXPRESSION, get(node.term), [op.sumop for op in getattr(tail, "sumop", None) or []],
+                 [get(term) for term in getattr(tail, "term", None) or []])
+
+def compact_term(node, get):
+    tail = node.new_term
+    return chain(SyntaxNodeTypes.TERM, get(node.unary_expression),
+                 [op.mulop for op in getattr(tail, "mulop", None) or []],
+                 [get(item) for item in getattr(tail, "unary_expression", None) or []])
+
+def compact_unary_expression(node, get):
+    operand = get(getattr(node, "factor", None))
+    # The operator nearest to the factor applies first
+    for op in reversed(getattr(node, "unary_op", None) or []):
+        operand = UnaryNode(SyntaxNodeTypes.UNARY_EXPRESSION, op.unary_op, operand)
+    return operand
+
+def compact_factor(node, get):
+    return get(getattr(node, "immutable", None) or getattr(node, "mutable", None))
+
+def compact_immutable(node, get):
+    return get(getattr(node, "expression", None) or getattr(node, "call", None) or getattr(node, "constant", None))
+
+def compact_mutable(node, get):
+    token = getattr(node, "id", None)
+    new_mutable = getattr(node, "new_mutable", None)
+    if token is None:
+        return node
+    expressions = getattr(new_mutable, "expressions", None)
+    if expressions is None and getattr(new_mutable, "ids", None) is None:
+        return LeafNode(SyntaxNodeTypes.MUTABLE, token)
+    if expressions is not None:
+        new_mutable.expressions = [get(expression) for expression in expressions]
+    return node
+
+def compact_call(node, get):
+    arg_list = getattr(getattr(node, "args", None), "arg_list", None)
+    if arg_list is not None:
+        arg_list.expression = get(arg_list.expression)
+        arguments = getattr(arg_list.list_arg, "expression", None)
+        if arguments is not None:
+            arg_list.list_arg.expression = [get(argument) for argument in arguments]
+    return node
+
+def compact_constant(node, get):
+    for name in ("num_const", "char_const", "boolean"):
+        token = getattr(node, name, None)
+        if token is not None:
+            return LeafNode(SyntaxNodeTypes.CONSTANT, token)
+    return None
+
+COMPACT_RULES = {
+    SyntaxNodeTypes.EXPRESSION: compact_expression,
+    SyntaxNodeTypes.SIMPLE_EXPRESSION: compact_simple_expression,
+    SyntaxNodeTypes.AND_EXPRESSION: compact_and_expression,
+    SyntaxNodeTypes.UNARY_REL_EXPRESSION: compact_unary_rel_expression,
+    SyntaxNodeTypes.REL_EXPRESSION: compact_rel_expression,
+    SyntaxNodeTypes.SUM_EXPRESSION: compact_sum_expression,
+    SyntaxNodeTypes.TERM: compact_term,
+    SyntaxNodeTypes.UNARY_EXPRESSION: compact_unary_expression,
+    SyntaxNodeTypes.FACTOR: compact_factor,
+    SyntaxNodeTypes.IMMUTABLE: compact_immutable,
+    SyntaxNodeTypes.MUTABLE: compact_mutable,
+    SyntaxNodeTypes.CALL: compact_call,
+    SyntaxNodeTypes.CONSTANT: compact_constant,
+}
+
+# Statement and declaration fields that hold a whole expression
+EXPRESSION_FIELDS = {
+    SyntaxNodeTypes.EXPRESSION_STATEMENT: "expression",
+    SyntaxNodeTypes.SELECTION_STATEMENT: "simple_expression",
+    SyntaxNodeTypes.ITERATION_STATEMENT: "simple_expression",
+    SyntaxNodeTypes.RETURN_STATEMENT: "expression",
+    SyntaxNodeTypes.INITIALIZE_DECL_VAR: "simple_expression",
+}
+
+def compact_program(tree):
+    """Makes every expression of a tree compact, returns the tree.
+
+    Parser and IterativeParser trees then have the shape of PrecedenceParser
+    ones, so passes after the parse only need to know compact expressions.
+    """
+    for node in walk(tree):
+        name = EXPRESSION_FIELDS.get(node.type)
+        if name is not None:
+            expression = getattr(node, name, None)
+            if isinstance(expression, SyntaxNode):
+                setattr(node, name, compact(expression))
+    return tree
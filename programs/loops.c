@@ -0,0 +1,18 @@
+// Nested counting loops with arithmetic and a branch in the inner one
+int main(){
+    int i = 0;
+    int j;
+    int total = 0;
+    while(i < 300){
+        j = 0;
+        while(j < 1000){
+            total += (i * j + 7) % 13;
+            if(total > 100000){
+                total -= 100000;
+            }
+            j++;
+        }
+        i++;
+    }
+    return total;
+}
@@ -0,0 +1,42 @@
+// Fills and sums a matrix stored row by row in a flat array
+int cells[6000];
+
+int fill(int m[]; int rows, cols, seed){
+    int i = 0;
+    int j;
+    while(i < rows){
+        j = 0;
+        while(j < cols){
+            m[i * cols + j] = (i * 7 + j * seed) % 100;
+            j++;
+        }
+        i++;
+    }
+    return 0;
+}
+
+int diagonals(int m[]; int rows, cols){
+    int i = 0;
+    int j;
+    int total = 0;
+    while(i < rows){
+        j = 0;
+        while(j < cols){
+            total += (i - j) * m[i * cols + j];
+            j++;
+        }
+        i++;
+    }
+    return total;
+}
+
+int main(){
+    int round = 0;
+    int total = 0;
+    while(round < 20){
+        fill(cells, 60, 100, round + 1);
+        total = (total + diagonals(cells, 60, 100)) % 1000000;
+        round++;
+    }
+    return total;
+}
@@ -0,0 +1,11 @@
+// Doubly recursive calls, no loops
+int fib(int n){
+    if(n < 2){
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int main(){
+    return fib(22);
+}
@@ -0,0 +1,32 @@
+// Fills and sums a global array through array parameters
+int data[1000];
+
+int fill(int v[]; int seed){
+    int i = 0;
+    while(i < *v){
+        v[i] = (i * seed + 17) % 1000;
+        i++;
+    }
+    return i;
+}
+
+int sum(int v[]){
+    int i = 0;
+    int total = 0;
+    while(i < *v){
+        total += v[i];
+        i++;
+    }
+    return total;
+}
+
+int main(){
+    int round = 0;
+    int total = 0;
+    while(round < 100){
+        fill(data, round + 3);
+        total = (total + sum(data)) % 100000;
+        round++;
+    }
+    return total;
+}
@@ -161,6 +161,13 @@ class Scanner():
             return self.tokens[next_position]
         return None
 
+    def see_token(self, offset):
+        # offset 0 is the current token, 1 the next one and so on
+        position = self.last_token + offset
+        if 0 <= position < len(self.tokens):
+            return self.tokens[position]
+        return None
+
     def prior_token(self):
         self.last_token -= 1
         last_position = self.last_token
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from bisect import bisect_right
+
+def innermost_intervals(intervals):
+    """Boundaries and values of the innermost interval at every position.
+
+    `intervals` are (start, end, value), ordered by start and properly
+    nested. Returns a sorted array of boundaries and the value holding from
+    each boundary to the next one, None where no interval covers it.
+    """
+    boundaries = array('I')
+    values = []
+
+    def mark(position, value):
+        # Of two events at one position the later one wins
+        if boundaries and boundaries[-1] == position:
+            values[-1] = value
+        else:
+            boundaries.append(position)
+            values.append(value)
+
+    stack = []
+    for start, end, value in intervals:
+        while stack and stack[-1][0] <= start:
+            closed = stack.pop()[0]
+            mark(closed, stack[-1][1] if stack else None)
+        stack.append((end, value))
+        mark(start, value)
+    while stack:
+        closed = stack.pop()[0]
+        mark(closed, stack[-1][1] if stack else None)
+    return boundaries, values
+
+class ScopeRecorder():
+    """Records scopes and declarations while a parse runs.
+
+    It hooks itself into the symbol table until finish(), which turns what
+    was recorded into a ScopeIndex. Positions are token indices read from
+    the scanner cursor.
+    """
+
+    def __init__(self, symbol_table, scanner):
+        self.symbol_table = symbol_table
+        self.scanner = scanner
+        # [start, end, parent] per scope, in the order they were opened
+        self.scopes = []
+        self.open = []
+        # (position, scope, symbol) per declaration, in source order
+        self.declarations = []
+        symbol_table.recorder = self
+
+    def push(self):
+        parent = self.open[-1] if self.open else None
+        self.open.append(len(self.scopes))
+        self.scopes.append([max(self.scanner.last_token, 0), None, parent])
+
+    def pop(self):
+        if self.open:
+            # The token that closes the scope still belongs to it
+            self.scopes[self.open.pop()][1] = self.scanner.last_token + 1
+
+    def declare(self, symbol):
+        if symbol.declared and self.open:
+            self.declarations.append((self.scanner.last_token, self.open[-1], symbol))
+
+    def finish(self):
+        self.symbol_table.recorder = None
+        end = len(self.scanner.tokens)
+        # Scopes a syntax error left open run to the end of the source
+        while self.open:
+            self.scopes[self.open.pop()][1] = end
+        return ScopeIndex(self.scopes, self.declarations, self.symbol_table.names, self.scanner.tokens)
+
+class ScopeIndex():
+    """Which declaration a name means at any token, answered by bisection.
+
+    Scopes nest, so the innermost scope only changes at scope boundaries,
+    and what a name refers to only changes where it is declared or where
+    the scope of one of its declarations ends. Both are kept as sorted
+    boundary arrays: resolve() is one bisection and visible_symbols() one
+    per enclosing scope.
+    """
+
+    def __init__(self, scopes, declarations, names, tokens):
+        self.names = names
+        self.tokens = tokens
+        self.parents = [parent for _, _, parent in scopes]
+        self.boundaries, self.innermost = innermost_intervals(
+            (start, end, scope) for scope, (start, end, _) in enumerate(scopes))
+
+        self.scope_positions = [array('I') for _ in scopes]
+        self.scope_symbols = [[] for _ in scopes]
+        by_name = {}
+        for position, scope, symbol in declarations:
+            self.scope_positions[scope].append(position)
+            self.scope_symbols[scope].append(symbol)
+            # A declaration holds until the end of its scope
+            by_name.setdefault(symbol.symbol_id, []).append((position, scopes[scope][1], symbol))
+        self.symbols = {key: innermost_intervals(found) for key, found in by_name.items()}
+
+    def position(self, line, column):
+        """Index of the first token at line:column or after it."""
+        tokens = self.tokens
+        low, high = 0, len(tokens)
+        while low < high:
+            middle = (low + high) // 2
+            token = tokens[middle]
+            if (token.line, token.column) < (line, column):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def scope_at(self, position):
+        """Innermost scope around token `position`, None outside all of them."""
+        found = bisect_right(self.boundaries, position) - 1
+        return self.innermost[found] if found >= 0 else None
+
+    def resolve(self, name, position):
+        """Symbol `name` (or symbol id) refers to at token `position`, None if undeclared there."""
+        key = name if isinstance(name, int) else self.names.get(name)
+        entry = self.symbols.get(key)
+        if entry is None:
+            return None
+        boundaries, symbols = entry
+        found = bisect_right(boundaries, position) - 1
+        return symbols[found] if found >= 0 else None
+
+    def visible_symbols(self, position):
+        """Every Symbol visible at token `position`, innermost scope first."""
+        visible = []
+        seen = set()
+        scope = self.scope_at(position)
+        while scope is not None:
+            symbols = self.scope_symbols[scope]
+            for index in range(bisect_right(self.scope_positions[scope], position) - 1, -1, -1):
+                symbol = symbols[index]
+                if symbol.symbol_id not in seen:
+                    seen.add(symbol.symbol_id)
+                    visible.append(symbol)
+            scope = self.parents[scope]
+        return visible
@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from language import *
+
+# Measured in-process on benchmarks.py semantics' source, the parent's share
+# (global declarations, merging the errors and types back) is about 0.87 of a
+# serial pass and the workers' about 1.9, so the pool breaks even only from
+# about 15 workers. 500 bodies is about 100 ms of serial checking, ten times
+# the 10 ms it takes to fork 4 workers.
+PARALLEL_THRESHOLD = 500
+
+ARITHMETIC_OPERATORS = {"+", "-", "*", "/", "%"}
+ORDER_OPERATORS = {"<", "<=", ">", ">="}
+LOGICAL_OPERATORS = {"and", "or"}
+CONTRACTED_ASSIGNMENTS = {"+=", "-=", "*=", "/="}
+
+def type_name(type_specifier):
+    # "int", "char", "bool", "void" or a record name, None when missing
+    if type_specifier is None:
+        return None
+    if getattr(type_specifier, "id", None) is not None:
+        return type_specifier.id.value
+    keyword = getattr(type_specifier, "return_type_specifier", None)
+    if keyword is not None:
+        return keyword.return_type_specifier.value
+    return None
+
+def element_type(data_type):
+    # Type of one element of an array type, None when it isn't one
+    if data_type is not None and data_type.endswith("[]"):
+        return data_type[:-2]
+    return None
+
+def constant_type(token):
+    if token.token_class == TokenClass.NUMCONST:
+        return "int"
+    if token.token_class == TokenClass.CHARCONST:
+        return "char"
+    return "bool"
+
+def first_token(node):
+    # Leftmost token under node, for error positions
+    pending = [node]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, Token):
+            return item
+        if type(item) is list:
+            pending.extend(reversed(item))
+        elif isinstance(item, SyntaxNode):
+            pending.extend(reversed([getattr(item, name, None) for name in item.fields]))
+    return None
+
+def items(value):
+    # Optional list fields are missing, a single node or a list
+    if value is None:
+        return []
+    if type(value) is list:
+        return value
+    return [value]
+
+class SemanticAnalyzer():
+    """Checks a finished syntax tree, one rule per node type.
+
+    Works on the concrete trees of Parser and IterativeParser and on the
+    compact expressions of PrecedenceParser. Every expression node gets its
+    type cached in `data_type` ("int", "char", "bool", a record name, or
+    one of those with "[]" for arrays), None where it couldn't be computed.
+    Unlike the checks the parser runs inline, errors are collected in
+    error_list instead of stopping at the first one.
+
+    Function bodies only see the global names declared before them, so once
+    the top level declarations are read the bodies are independent: with
+    workers > 1 and enough of them, they are checked in forked worker
+    processes that inherit the tree, and only errors and type codes travel
+    back.
+    """
+
+    def __init__(self, symbol_table, workers=1, threshold=PARALLEL_THRESHOLD):
+        # Tokens carry symbol ids of the parse, names must come from its table
+        self.names = symbol_table.names
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.error_list = []
+        self.table = None
+        self.records = {}
+        self.parameters = {}
+        self.globals = []
+        self.return_type = None
+        self.loops = 0
+        self.last_type = None
+
+    def new_table(self):
+        table = SymbolTable()
+        table.names = self.names
+        return table
+
+    def error(self, message, token=None):
+        if token is not None:
+            message = "{} ({}:{})".format(message, token.line, token.column)
+        self.error_list.append(message)
+
+    def declare(self, token, data_type, kind, array_size=None):
+        symbol = Symbol(self.table.key_of(token), self.table.current_scope, kind, data_type, token, array_size)
+        try:
+            self.table.store_symbol(symbol)
+        except Exception as raised:
+            self.error_list.append(str(raised))
+            return None
+        return symbol
+
+    def analyze(self, tree):
+        """Checks the whole program, returns error_list."""
+        self.error_list = []
+        self.table = self.new_table()
+        self.table.journal = self.globals = []
+        self.records = {}
+        self.parameters = {}
+        self.table.push_scope()
+        bodies = []
+        declarations = top_level_declarations(tree)
+        functions = sum(1 for declaration in declarations if getattr(declaration, "fun_declaration", None))
+        # Workers must inherit the tree, which needs fork
+        parallel = self.workers > 1 and functions >= self.threshold \
+            and "fork" in multiprocessing.get_all_start_methods()
+        for declaration in declarations:
+            if getattr(declaration, "var_declaration", None) is not None:
+                self.var_declaration(declaration.var_declaration.type_specifier,
+                                     declaration.var_declaration.var_declaration_list)
+            elif getattr(declaration, "rec_declaration", None) is not None:
+                self.rec_declaration(declaration.rec_declaration)
+            elif getattr(declaration, "fun_declaration", None) is not None:
+                node = declaration.fun_declaration
+                symbol = self.fun_signature(node)
+                if parallel:
+                    bodies.append((node, symbol, len(self.globals), len(self.error_list)))
+                else:
+                    self.fun_body(node, symbol)
+        self.table.journal = None
+        self.table.kill_scope()
+        if bodies:
+            self.check_in_pool(bodies)
+        return self.error_list
+
+    # Declarations
+
+    def var_declaration(self, type_specifier, var_decl_list):
+        data_type = type_name(type_specifier) or self.last_type
+        self.last_type = data_type
+        if var_decl_list is None:
+            return
+        declarations = [var_decl_list.var_decl_initialize]
+        declarations += items(getattr(var_decl_list.list_var_decl, "list_var_decl", None))
+        for declaration in declarations:
+            var_decl_id = declaration.var_decl_id
+            token = getattr(var_decl_id, "id", None)
+            if token is None or token.token_class != TokenClass.ID:
+                continue
+            size = getattr(var_decl_id.id_decl_var, "id_decl_var", None)
+            array_size = int(size.value) if size is not None and size.token_class == TokenClass.NUMCONST else None
+            declared_type = data_type + "[]" if array_size is not None and data_type else data_type
+            initializer = getattr(declaration.initialize_decl_var, "simple_expression", None)
+            if initializer is not None:
+                # The name is not in scope yet inside its own initializer
+                value_type = self.expression(initializer)
+                if value_type is not None and value_type != declared_type:
+                    self.error("Invalid type assignment at '{}'".format(token.value), token)
+            self.declare(token, declared_type, SymbolKind.VAR, array_size)
+
+    def scoped_declarations(self, local_declarations):
+        for declaration in items(getattr(local_declarations, "declarations_local", None)):
+            self.var_declaration(declaration.scoped_type_specifier.type_specifier, declaration.var_decl_list)
+
+    def rec_declaration(self, node):
+        token = getattr(node, "id", None)
+        if token is not None:
+            self.declare(token, token.value, SymbolKind.RECORD)
+        fields = {}
+        self.table.push_scope()
+        start = len(self.table.scopes[-1])
+        self.scoped_declarations(getattr(node, "local_declarations", None))
+        for key in self.table.scopes[-1][start:]:
+            symbol = self.table.hashtable[key][-1]
+            fields[symbol.value] = symbol.data_type
+        self.table.kill_scope()
+        if token is not None:
+            self.records[token.value] = fields
+
+    def fun_signature(self, node):
+        return_type = type_name(getattr(node, "type_specifier", None)) or self.last_type
+        self.last_type = return_type
+        token = getattr(node, "id", None)
+        if token is None:
+            return None
+        symbol = self.declare(token, return_type, SymbolKind.FUNC)
+        if symbol is not None:
+            self.parameters[symbol] = [data_type for _, data_type in self.params(node)]
+        return symbol
+
+    def params(self, node):
+        # (token, type) of every parameter, in order
+        found = []
+        param_list = getattr(getattr(node, "params", None), "param_list", None)
+        if param_list is None:
+            return found
+        groups = [param_list.param_type_list] + items(getattr(param_list.list_param, "list_param", None))
+        for group in groups:
+            data_type = type_name(group.type_specifier)
+            param_ids = [group.param_id_list.param_id]
+            param_ids += items(getattr(group.param_id_list.list_id_param, "list_id_param", None))
+            for param_id in param_ids:
+                token = getattr(param_id, "id", None)
+                if token is None or token.token_class != TokenClass.ID:
+                    continue
+                array = getattr(param_id.id_param, "id_param", None) is not None
+                found.append((token, data_type + "[]" if array and data_type else data_type))
+        return found
+
+    def fun_body(self, node, symbol):
+        self.return_type = symbol.data_type if symbol is not None else None
+        self.loops = 0
+        self.table.push_scope()
+        for token, data_type in self.params(node):
+            self.declare(token, data_type, SymbolKind.PARAM, 0 if element_type(data_type) else None)
+        self.statement(getattr(node, "statement", None))
+        self.table.kill_scope()
+
+    # Statements
+
+    def statement(self, node):
+        if node is None:
+            return
+        kind = node.type
+        if kind == SyntaxNodeTypes.STATEMENT:
+            for name in node.fields:
+                child = getattr(node, name, None)
+                if child is not None:
+                    self.statement(child)
+        elif kind == SyntaxNodeTypes.COMPOUND_STATEMENT:
+            self.table.push_scope()
+            self.scoped_declarations(getattr(node, "local_declarations", None))
+            statement_list = getattr(node, "statement_list", None)
+            for statement in items(getattr(getattr(statement_list, "list_statement", None), "statement", None)):
+                self.statement(statement)
+            self.table.kill_scope()
+        elif kind == SyntaxNodeTypes.EXPRESSION_STATEMENT:
+            expression = getattr(node, "expression", None)
+            if isinstance(expression, SyntaxNode):
+                self.expression(expression)
+        elif kind == SyntaxNodeTypes.SELECTION_STATEMENT:
+            self.condition(getattr(node, "simple_expression", None))
+            self.statement(getattr(node, "statement", None))
+            self.statement(getattr(getattr(node, "stmt_selection", None), "statement", None))
+        elif kind == SyntaxNodeTypes.ITERATION_STATEMENT:
+            self.condition(getattr(node, "simple_expression", None))
+            self.loops += 1
+            self.statement(getattr(node, "statement", None))
+            self.loops -= 1
+        elif kind == SyntaxNodeTypes.RETURN_STATEMENT:
+            expression = getattr(node, "expression", None)
+            value_type = self.expression(expression) if expression is not None else "void"
+            if value_type is not None and self.return_type is not None and value_type != self.return_type:
+                self.error("Return type should be '{}'".format(self.return_type),
+                           first_token(expression) if expression is not None else None)
+        elif kind == SyntaxNodeTypes.BREAK_STATEMENT:
+            if self.loops == 0:
+                self.error("Break outside of a loop", getattr(node, "break_statement", None))
+
+    def condition(self, node):
+        if node is None:
+            return
+        data_type = self.expression(node)
+        if data_type is not None and data_type != "bool":
+            self.error("Condition should be 'bool'", first_token(node))
+
+    # Expressions
+
+    def expression(self, node):
+        """Types every expression node under node, children first; returns node's type."""
+        if node is None:
+            return None
+        # Reversed preorder visits every child before its parent, without recursion
+        for child in reversed(list(walk(node))):
+            if isinstance(child, BinaryNode):
+                child.data_type = self.binary(child)
+            elif isinstance(child, UnaryNode):
+                child.data_type = self.unary(child)
+            elif isinstance(child, LeafNode):
+                child.data_type = self.leaf(child)
+            else:
+                rule = self.rules.get(child.type)
+                if rule is not None:
+                    child.data_type = rule(self, child)
+        return getattr(node, "data_type", None)
+
+    def operands(self, op, expected, operands):
+        # Checks operand types, returns False when one is unknown or wrong
+        valid = True
+        for operand in operands:
+            data_type = getattr(operand, "data_type", None)
+            if data_type is None:
+                valid = False
+            elif data_type not in expected:
+                self.error("Operator '{}' expects '{}' operands".format(op.value, "' or '".join(expected)), op)
+                valid = False
+        return valid
+
+    def binary(self, node):
+        op = node.op
+        operator = op.value
+        if operator in ARITHMETIC_OPERATORS:
+            self.operands(op, ("int",), (node.left, node.right))
+            return "int"
+        if operator in LOGICAL_OPERATORS:
+            self.operands(op, ("bool",), (node.left, node.right))
+            return "bool"
+        return self.comparison(op, node.left, node.right)
+
+    def comparison(self, op, left, right):
+        expected = ("int", "char") if op.value in ORDER_OPERATORS else ("int", "char", "bool")
+        if self.operands(op, expected, (left, right)) and left.data_type != right.data_type:
+            self.error("Operator '{}' compares '{}' with '{}'".format(op.value, left.data_type, right.data_type), op)
+        return "bool"
+
+    def unary(self, node):
+        op = node.op
+        operand_type = getattr(node.operand, "data_type", None)
+        if op.value == "not":
+            self.operands(op, ("bool",), (node.operand,))
+            return "bool"
+        if op.value == "*":
+            # Size of an array
+            if operand_type is not None and element_type(operand_type) is None:
+                self.error("Operator '*' expects an array", op)
+            return "int"
+        self.operands(op, ("int",), (node.operand,))
+        return "int"
+
+    def leaf(self, node):
+        if node.type == SyntaxNodeTypes.CONSTANT:
+            return constant_type(node.token)
+        return self.variable(node.token)
+
+    def variable(self, token):
+        symbol = self.table.lookup_token(token)
+        if symbol is None or not symbol.declared:
+            self.error("Variable '{}' wasn't declared".format(token.value), token)
+            return None
+        if symbol.kind == SymbolKind.FUNC or symbol.kind == SymbolKind.RECORD:
+            self.error("'{}' is not a variable".format(token.value), token)
+            return None
+        return symbol.data_type
+
+    def mutable(self, node):
+        token = getattr(node, "id", None)
+        if token is None:
+            return None
+        data_type = self.variable(token)
+        new_mutable = getattr(node, "new_mutable", None)
+        for index in items(getattr(new_mutable, "expressions", None)):
+            index_type = getattr(index, "data_type", None)
+            if index_type is not None and index_type != "int":
+                self.error("Array index should be 'int'", first_token(index))
+            if data_type is not None:
+                element = element_type(data_type)
+                if element is None:
+                    self.error("'{}' is not an array".format(token.value), token)
+                data_type = element
+        for field in items(getattr(new_mutable, "ids", None)):
+            if data_type is None:
+                break
+            fields = self.records.get(data_type)
+            if fields is None or field.value not in fields:
+                self.error("'{}' has no field '{}'".format(data_type, field.value), field)
+                data_type = None
+            else:
+                data_type = fields[field.value]
+        return data_type
+
+    def call(self, node):
+        token = getattr(node, "id", None)
+        if token is None:
+            return None
+        symbol = self.table.lookup_token(token)
+        if symbol is None or not symbol.declared:
+            self.error("Function '{}' wasn't declared".format(token.value), token)
+            return None
+        if symbol.kind != SymbolKind.FUNC:
+            self.error("'{}' is not a function".format(token.value), token)
+            return None
+        arg_list = getattr(getattr(node, "args", None), "arg_list", None)
+        arguments = []
+        if arg_list is not None:
+            arguments = [arg_list.expression] + items(getattr(arg_list.list_arg, "expression", None))
+        expected = self.parameters.get(symbol, [])
+        if len(arguments) != len(expected):
+            self.error("Function '{}' takes {} arguments, {} given".format(token.value, len(expected),
+                                                                         len(arguments)), token)
+        else:
+            for position, (argument, data_type) in enumerate(zip(arguments, expected)):
+                argument_type = getattr(argument, "data_type", None)
+                if argument_type is not None and data_type is not None and argument_type != data_type:
+                    self.error("Argument {} of '{}' should be '{}'".format(position + 1, token.value, data_type),
+                               first_token(argument))
+        return symbol.data_type
+
+    def assignment(self, node):
+        # EXPRESSION node: an assignment, ++/--, or a wrapper of the concrete tree
+        target = getattr(node, "mutable", None)
+        op = getattr(node, "op", None)
+        if target is None:
+            return getattr(getattr(node, "simple_expression", None), "data_type", None)
+        target_type = getattr(target, "data_type", None)
+        if op is None:
+            # Concrete tree, a variable alone or a sum that starts with one
+            sum_ops = items(getattr(getattr(node, "expression_sum", None), "sumop", None))
+            if not sum_ops:
+                return target_type
+            self.operands(sum_ops[0].sumop, ("int",), [target] + items(node.expression_sum.term))
+            return "int"
+        if op.value == "=":
+            value_type = getattr(getattr(node, "expression", None), "data_type", None)
+            if target_type is not None and value_type is not None and target_type != value_type:
+                self.error("Invalid type assignment at '{}'".format(first_token(target).value), first_token(target))
+            return target_type
+        if op.value in CONTRACTED_ASSIGNMENTS:
+            self.operands(op, ("int",), (target, getattr(node, "expression", None)))
+        else:
+            self.operands(op, ("int",), (target,))
+        return target_type
+
+    # Concrete tree levels, an operator level is its operand's type when it has no operator
+
+    def simple_expression(self, node):
+        tail = items(getattr(node.expression_simple, "expression_simple", None))
+        if not tail:
+            return getattr(node.and_expression, "data_type", None)
+        self.operands(node.expression_simple.or_op, ("bool",), [node.and_expression] + tail)
+        return "bool"
+
+    def and_expression(self, node):
+        tail = items(getattr(node.expression_and, "expression_and", None))
+        if not tail:
+            return getattr(node.unary_rel_expression, "data_type", None)
+        self.operands(node.expression_and.and_op, ("bool",), [node.unary_rel_expression] + tail)
+        return "bool"
+
+    def unary_rel_expression(self, node):
+        if getattr(node, "not_op", None) is not None:
+            self.operands(node.not_op, ("bool",), (node.unary_rel_expression,))
+            return "bool"
+        return getattr(getattr(node, "rel_expression", None), "data_type", None)
+
+    def rel_expression(self, node):
+        relop = getattr(node.expression_rel, "relop", None)
+        if relop is None:
+            return getattr(node.sum_expression, "data_type", None)
+        return self.comparison(relop.relop, node.sum_expression, node.expression_rel.sum_expression)
+
+    def sum_expression(self, node):
+        ops = items(getattr(node.expression_sum, "sumop", None))
+        if not ops:
+            return getattr(node.term, "data_type", None)
+        self.operands(ops[0].sumop, ("int",), [node.term] + items(node.expression_sum.term))
+        return "int"
+
+    def term(self, node):
+        ops = items(getattr(node.new_term, "mulop", None))
+        if not ops:
+            return getattr(node.unary_expression, "data_type", None)
+        self.operands(ops[0].mulop, ("int",), [node.unary_expression] + items(node.new_term.unary_expression))
+        return "int"
+
+    def unary_expression(self, node):
+        if getattr(node, "unary_op", None) is not None:
+            return "int"
+        return getattr(getattr(node, "factor", None), "data_type", None)
+
+    def factor(self, node):
+        child = getattr(node, "immutable", None) or getattr(node, "mutable", None)
+        return getattr(child, "data_type", None)
+
+    def immutable(self, node):
+        for name in ("expression", "call", "constant"):
+            child = getattr(node, name, None)
+            if child is not None:
+                return getattr(child, "data_type", None)
+        return None
+
+    def constant(self, node):
+        for name in ("num_const", "char_const", "boolean"):
+            token = getattr(node, name, None)
+            if token is not None:
+                return constant_type(token)
+        return None
+
+    rules = {
+        SyntaxNodeTypes.EXPRESSION: assignment,
+        SyntaxNodeTypes.SIMPLE_EXPRESSION: simple_expression,
+        SyntaxNodeTypes.AND_EXPRESSION: and_expression,
+        SyntaxNodeTypes.UNARY_REL_EXPRESSION: unary_rel_expression,
+        SyntaxNodeTypes.REL_EXPRESSION: rel_expression,
+        SyntaxNodeTypes.SUM_EXPRESSION: sum_expression,
+        SyntaxNodeTypes.TERM: term,
+        SyntaxNodeTypes.UNARY_EXPRESSION: unary_expression,
+        SyntaxNodeTypes.FACTOR: factor,
+        SyntaxNodeTypes.MUTABLE: mutable,
+        SyntaxNodeTypes.IMMUTABLE: immutable,
+        SyntaxNodeTypes.CALL: call,
+        SyntaxNodeTypes.CONSTANT: constant,
+    }
+
+    # Worker pool
+
+    def check_in_pool(self, bodies):
+        global FORKED_ANALYZER
+        chunk_count = self.workers * 4
+        size = max(1, -(-len(bodies) // chunk_count))
+        chunks = [bodies[start:start + size] for start in range(0, len(bodies), size)]
+        # Workers are forked after this, they find the analyzer and the tree here
+        FORKED_ANALYZER = (self, chunks)
+        try:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+                results = list(pool.map(check_chunk, range(len(chunks))))
+        finally:
+            FORKED_ANALYZER = None
+
+        errors = []
+        merged = 0
+        for chunk, (type_names, checked) in zip(chunks, results):
+            for (node, _, _, error_count), (body_errors, codes) in zip(chunk, checked):
+                errors.extend(self.error_list[merged:error_count])
+                errors.extend(body_errors)
+                merged = error_count
+                apply_types(node, type_names, codes)
+        errors.extend(self.error_list[merged:])
+        self.error_list = errors
+
+FORKED_ANALYZER = None
+
+def check_chunk(chunk_index):
+    analyzer, chunks = FORKED_ANALYZER
+    globals_list = analyzer.globals
+    table = analyzer.new_table()
+    table.push_scope()
+    analyzer.table = table
+    declared = 0
+    type_names = [None]
+    type_codes = {None: 0}
+    checked = []
+    for node, symbol, global_count, _ in chunks[chunk_index]:
+        # Global names are added in declaration order, as the serial pass does
+        for key, global_symbol in globals_list[declared:global_count]:
+            # Record fields were journaled too, they are gone again
+            if global_symbol.scope == 1:
+                table.declare(key, global_symbol)
+        declared = max(declared, global_count)
+        analyzer.error_list = []
+        analyzer.fun_body(node, symbol)
+        codes = array('H')
+        for child in walk(node):
+            data_type = getattr(child, "data_type", None)
+            code = type_codes.get(data_type)
+            if code is None:
+                code = type_codes[data_type] = len(type_names)
+                type_names.append(data_type)
+            codes.append(code)
+        checked.append((analyzer.error_list, codes))
+    return type_names, checked
+
+def apply_types(node, type_names, codes):
+    # Same walk as the worker did, so codes line up with nodes
+    for child, code in zip(walk(node), codes):
+        if code:
+            child.data_type = type_names[code]
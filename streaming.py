@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from dfa_scanner import DFAScanner
+
+class StreamingScanner(DFAScanner):
+    """Lexes lazily from any line iterator (e.g. an open file).
+
+    The parser reads tokens through a ring buffer that keeps only `lookbehind`
+    consumed tokens and `lookahead` pending ones, so memory does not grow with
+    the size of the source file.
+    """
+
+    def __init__(self, source_lines, symbol_table, lookbehind=4, lookahead=2):
+        self.code = source_lines
+        self.symbol_table = symbol_table
+        self.error_list = []
+        self.last_token = -1
+        # Scratch list scan_line appends to, drained after every line
+        self.tokens = []
+        self.lookbehind = lookbehind
+        self.lookahead = lookahead
+        self.capacity = lookbehind + lookahead + 1
+        self.buffer = [None] * self.capacity
+        self.read_count = 0
+        self.stream = self.generate_tokens()
+
+    def generate_tokens(self):
+        line_pos = 0
+        for line in self.code:
+            self.scan_line(line, line_pos)
+            if self.tokens:
+                pending = self.tokens
+                self.tokens = []
+                yield from pending
+            line_pos += 1
+
+    def register_id(self, token):
+        # The parser may already be inside a function when this token is lexed
+        self.symbol_table.store_global(token)
+
+    def register_error(self, lexeme, line, col):
+        super().register_error(lexeme, line, col)
+        # Report right away instead of after the whole file was read
+        print(self.error_list[-1])
+
+    def scan(self):
+        raise Exception("StreamingScanner lexes on demand, there is nothing to scan upfront")
+
+    def token_at(self, index):
+        if index < 0:
+            return None
+        if index > self.last_token + self.lookahead:
+            raise Exception("Token {} is beyond the lookahead window".format(index))
+        while self.read_count <= index:
+            token = next(self.stream, None)
+            if token is None:
+                return None
+            self.buffer[self.read_count % self.capacity] = token
+            self.read_count += 1
+        if index < self.read_count - self.capacity:
+            raise Exception("Token {} fell out of the lookbehind window".format(index))
+        return self.buffer[index % self.capacity]
+
+    def next_token(self):
+        token = self.token_at(self.last_token + 1)
+        if token is None:
+            raise Exception("Source code finished!")
+        self.last_token += 1
+        return token
+
+    def see_next_token(self):
+        return self.token_at(self.last_token + 1)
+
+    def see_token(self, offset):
+        return self.token_at(self.last_token + offset)
+
+    def prior_token(self):
+        self.last_token -= 1
+        return self.token_at(self.last_token)
+
+    def see_prior_token(self):
+        return self.token_at(self.last_token - 1)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import sqlite3
+from language import TokenClass, SymbolKind, SymbolTable, COMPILER_VERSION
+from dfa_scanner import DFAScanner
+from parser import Parser
+from scope_index import ScopeRecorder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    hash TEXT NOT NULL,
+    errors INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS declarations (
+    file INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data_type TEXT,
+    array_size INTEGER,
+    scope INTEGER NOT NULL,
+    owner TEXT,
+    line INTEGER NOT NULL,
+    column INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS uses (
+    file INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    scope INTEGER,
+    owner TEXT,
+    line INTEGER NOT NULL,
+    column INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS declarations_name ON declarations (name);
+CREATE INDEX IF NOT EXISTS declarations_type ON declarations (data_type);
+CREATE INDEX IF NOT EXISTS declarations_file ON declarations (file);
+CREATE INDEX IF NOT EXISTS uses_name ON uses (name, kind);
+CREATE INDEX IF NOT EXISTS uses_file ON uses (file);
+"""
+
+def source_hash(source):
+    # Rows depend on the compiler too, a new version reindexes everything
+    digest = hashlib.sha256()
+    digest.update(COMPILER_VERSION.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(source)
+    return digest.hexdigest()
+
+def extract_symbols(code):
+    """Declarations and name uses of one source, as rows without the file id.
+
+    Declaration rows are (name, kind, data_type, array_size, scope, owner,
+    line, column), use rows (name, kind, scope, owner, line, column) where
+    kind is "call" or "use" and scope is the scope of the declaration the
+    name resolves to, None when it is not declared in this file. owner is
+    the function or record the row is inside. Also returns how many lexical
+    and syntax errors the source has; what was parsed before a semantic
+    error is still indexed, what follows it is not.
+    """
+    if not code:
+        return [], [], 0
+    symbol_table = SymbolTable()
+    scanner = DFAScanner(code, symbol_table)
+    scanner.scan()
+    if scanner.error_list:
+        return [], [], len(scanner.error_list)
+
+    recorder = ScopeRecorder(symbol_table, scanner)
+    parser = Parser(symbol_table, scanner)
+    errors = 0
+    parsed = len(scanner.tokens)
+    try:
+        parser.parse()
+    except Exception:
+        # Names after the failing declaration were never resolved
+        errors = 1
+        parsed = scanner.last_token + 1
+    index = recorder.finish()
+    errors += len(parser.error_list)
+
+    declarations = []
+    owners = {}
+    owner = None
+    for position, _, symbol in recorder.declarations:
+        if symbol.scope == 1:
+            if symbol.kind in (SymbolKind.FUNC, SymbolKind.RECORD):
+                owner = symbol.value
+            elif symbol.kind == SymbolKind.VAR:
+                # A global variable ends the function or record before it
+                owner = None
+        owners[position] = owner
+        token = symbol.token
+        declarations.append((symbol.value, symbol.kind.name, symbol.data_type, symbol.array_size, symbol.scope,
+                             None if symbol.scope == 1 else owner,
+                             token.line, token.column))
+
+    uses = []
+    tokens = scanner.tokens
+    # Declarations in source order give the owner of the names between them
+    declared = sorted(owners)
+    following = 0
+    owner = None
+    for position in range(parsed):
+        token = tokens[position]
+        while following < len(declared) and declared[following] <= position:
+            owner = owners[declared[following]]
+            following += 1
+        if token.token_class != TokenClass.ID or position in owners:
+            continue
+        symbol = index.resolve(symbol_table.key_of(token), position)
+        call = position + 1 < len(tokens) and tokens[position + 1].value == "("
+        uses.append((token.value, "call" if call else "use", symbol and symbol.scope, owner,
+                     token.line, token.column))
+    return declarations, uses, errors
+
+class SymbolIndex():
+    """Global declarations and name uses of many files in one SQLite database.
+
+    update() indexes files whose content changed since they were last
+    indexed, each in a single transaction that replaces all of its rows, so
+    the database is always consistent file by file. The query methods read
+    through indices on names and types, and do not parse anything.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, paths):
+        """Indexes the files in `paths` whose content changed, returns their paths."""
+        indexed = []
+        for path in paths:
+            with open(path, "rb") as source:
+                data = source.read()
+            if self.index_source(path, data):
+                indexed.append(path)
+        return indexed
+
+    def index_source(self, path, data):
+        digest = source_hash(data)
+        row = self.connection.execute("SELECT id, hash FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[1] == digest:
+            return False
+
+        declarations, uses, errors = extract_symbols(data.decode("utf-8").splitlines(keepends=True))
+        with self.connection:
+            if row is None:
+                file_id = self.connection.execute("INSERT INTO files (path, hash, errors) VALUES (?, ?, ?)",
+                                                  (path, digest, errors)).lastrowid
+            else:
+                file_id = row[0]
+                self.connection.execute("UPDATE files SET hash = ?, errors = ? WHERE id = ?",
+                                        (digest, errors, file_id))
+                self.connection.execute("DELETE FROM declarations WHERE file = ?", (file_id,))
+                self.connection.execute("DELETE FROM uses WHERE file = ?", (file_id,))
+            self.connection.executemany("INSERT INTO declarations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [(file_id,) + fields for fields in declarations])
+            self.connection.executemany("INSERT INTO uses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        [(file_id,) + fields for fields in uses])
+        return True
+
+    def remove(self, path):
+        with self.connection:
+            row = self.connection.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return
+            self.connection.execute("DELETE FROM declarations WHERE file = ?", row)
+            self.connection.execute("DELETE FROM uses WHERE file = ?", row)
+            self.connection.execute("DELETE FROM files WHERE id = ?", row)
+
+    def files(self):
+        return [path for path, in self.connection.execute("SELECT path FROM files ORDER BY path")]
+
+    def definitions(self, name):
+        """(path, kind, data_type, line, column) of every global declaration of `name`."""
+        return self.connection.execute(
+            "SELECT path, kind, data_type, line, column FROM declarations JOIN files ON files.id = file "
+            "WHERE name = ? AND scope = 1 ORDER BY path, line, column", (name,)).fetchall()
+
+    def signature(self, name):
+        """(path, return type, [(param, type, array_size)]) of every function `name`."""
+        found = []
+        for file_id, path, data_type in self.connection.execute(
+                "SELECT file, path, data_type FROM declarations JOIN files ON files.id = file "
+                "WHERE name = ? AND kind = 'FUNC' ORDER BY path", (name,)).fetchall():
+            params = self.connection.execute(
+                "SELECT name, data_type, array_size FROM declarations "
+                "WHERE file = ? AND owner = ? AND kind = 'PARAM' ORDER BY line, column", (file_id, name)).fetchall()
+            found.append((path, data_type, params))
+        return found
+
+    def callers(self, name):
+        """(path, function) of every function calling `name`, None for calls outside functions."""
+        # A call that resolves to a local name does not call the global function
+        return self.connection.execute(
+            "SELECT DISTINCT path, owner FROM uses JOIN files ON files.id = file "
+            "WHERE name = ? AND kind = 'call' AND (scope IS NULL OR scope = 1) ORDER BY path, owner",
+            (name,)).fetchall()
+
+    def references(self, name):
+        """(path, kind, owner, line, column) of every use of `name`."""
+        return self.connection.execute(
+            "SELECT path, kind, owner, line, column FROM uses JOIN files ON files.id = file "
+            "WHERE name = ? ORDER BY path, line, column", (name,)).fetchall()
+
+    def declarations_of_type(self, data_type):
+        """(path, name, kind, owner, line, column) of every name declared with type `data_type`.
+
+        For a record this is every variable and parameter of that record
+        type; the record declaration itself is left out.
+        """
+        return self.connection.execute(
+            "SELECT path, name, kind, owner, line, column FROM declarations JOIN files ON files.id = file "
+            "WHERE data_type = ? AND kind != 'RECORD' ORDER BY path, line, column", (data_type,)).fetchall()
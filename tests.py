@@ -1,9 +1,38 @@
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import tempfile
 import unittest
-from language import TokenClass, SymbolTable, SyntaxNodeTypes
+from array import array
+from language import Token, TokenClass, SymbolTable, SymbolKind, SyntaxNode, SyntaxNodeTypes, InternTable, BinaryNode, \
+    UnaryNode, LeafNode, NodeVisitor, SyntaxOnlyHelpers, walk, top_level_declarations
 from scanner import Scanner
+from dfa_scanner import DFAScanner
+from streaming import StreamingScanner
+from tokenbuffer import CompactScanner, TokenBuffer
+from mapped_source import MappedSource, MappedScanner
+import parallel_scanner
+from parallel_scanner import ParallelScanner
+from token_cache import TokenCache, encode_scan, decode_scan
+from incremental_scanner import IncrementalScanner, TokenList, chunk_tokens
+from grammar import Grammar, C_MINUS, read_grammar
 from parser import Parser
+from iterative_parser import IterativeParser
+from precedence_parser import PrecedenceParser, compact_program
+from tree_file import encode_program, ProgramFile
+from incremental_parser import IncrementalParser
+from parallel_parser import ParallelParser
+from scope_index import ScopeRecorder, innermost_intervals
+from symbol_index import SymbolIndex, extract_symbols
+from semantic import SemanticAnalyzer
+from folding import ConstantFolder
+from interpreter import Interpreter
+from bytecode import compile_program, VirtualMachine, disassemble, instructions, OPCODE_NAMES
+from ir import build_program, to_ssa, format_program, IRInterpreter
+from optimizer import optimize_program, propagate_constants, propagate_copies, eliminate_common_subexpressions, \
+    eliminate_dead_code
+from loops import LoopOptimizer, loop_passes, find_loops
 
 class TestScanner(unittest.TestCase):
 
@@ -258,9 +287,1235 @@ class TestScanner(unittest.TestCase):
         scanner = self.get_scanner(mock_code)
         scanner.scan()
 
-        self.assertEqual(scanner.symbol_table.lookup("identifier").token_class, TokenClass.ID)
+        self.assertEqual(scanner.symbol_table.lookup("identifier").token.token_class, TokenClass.ID)
         self.assertEqual(len(scanner.symbol_table.hashtable), 1)
 
+class TestInterning(unittest.TestCase):
+
+    def test_intern_table_round_trip(self):
+        names = InternTable()
+        self.assertEqual(names.intern("a"), 0)
+        self.assertEqual(names.intern("b"), 1)
+        self.assertEqual(names.intern("a"), 0)
+        self.assertEqual(names[1], "b")
+        self.assertIsNone(names.get("c"))
+
+    def test_scanner_gives_each_name_one_symbol_id(self):
+        symbol_table = SymbolTable()
+        scanner = Scanner(["count x count"], symbol_table)
+        scanner.scan()
+        first, other, second = scanner.tokens
+
+        self.assertEqual(first.symbol_id, second.symbol_id)
+        self.assertNotEqual(first.symbol_id, other.symbol_id)
+        self.assertEqual(symbol_table.names[first.symbol_id], "count")
+        self.assertEqual(sorted(symbol_table.hashtable), [0, 1])
+
+    def test_lookup_by_name_or_symbol_id(self):
+        symbol_table = SymbolTable()
+        scanner = Scanner(["total"], symbol_table)
+        scanner.scan()
+        symbol_id = scanner.tokens[0].symbol_id
+
+        self.assertIs(symbol_table.lookup("total"), symbol_table.lookup(symbol_id))
+
+    def test_compact_tokens_share_symbol_ids(self):
+        symbol_table = SymbolTable()
+        scanner = CompactScanner(["int total; total = 1;"], symbol_table)
+        scanner.scan()
+        self.assertEqual(scanner.tokens[1].symbol_id, scanner.tokens[3].symbol_id)
+        self.assertIs(symbol_table.lookup(scanner.tokens[3].symbol_id).token.token_class, TokenClass.ID)
+
+class TestSymbolTable(unittest.TestCase):
+
+    def token(self, name):
+        return Token(TokenClass.ID, name, 0, 0)
+
+    def test_scopes_shadow_and_restore(self):
+        symbol_table = SymbolTable()
+        symbol_table.store_global(self.token("x"))
+        symbol_table.push_scope()
+        symbol_table.set_type(self.token("x"), "int")
+        symbol_table.push_scope()
+        symbol_table.set_type(self.token("x"), "char")
+        symbol_table.set_type(self.token("y"), "bool")
+        self.assertEqual(symbol_table.lookup("x").data_type, "char")
+
+        symbol_table.kill_scope()
+        self.assertEqual(symbol_table.lookup("x").data_type, "int")
+        self.assertIsNone(symbol_table.lookup("y"))
+        symbol_table.kill_scope()
+        self.assertEqual(symbol_table.lookup("x").scope, 0)
+
+    def test_kill_scope_only_touches_its_names(self):
+        symbol_table = SymbolTable()
+        for index in range(100):
+            symbol_table.store_global(self.token("global{}".format(index)))
+        symbol_table.push_scope()
+        symbol_table.set_type(self.token("local"), "int")
+        self.assertEqual(symbol_table.scopes[-1], [symbol_table.names.get("local")])
+        symbol_table.kill_scope()
+        self.assertEqual(symbol_table.scopes, [[]])
+
+    def test_same_scope_redeclaration_fails(self):
+        symbol_table = SymbolTable()
+        symbol_table.push_scope()
+        symbol_table.set_type(self.token("x"), "int")
+        with self.assertRaises(Exception):
+            symbol_table.set_type(self.token("x"), "int")
+
+    def test_declarations_become_symbol_records(self):
+        symbol_table = SymbolTable()
+        scanner = Scanner(["int v[10];", "int f(int a; bool b[]){", "return a;", "}", "int end;"], symbol_table)
+        scanner.scan()
+        symbol_table.journal = []
+        Parser(symbol_table, scanner).parse()
+
+        self.assertEqual([(s.value, s.kind, s.data_type, s.array_size) for _, s in symbol_table.journal[:4]],
+                         [("v", SymbolKind.VAR, "int", 10), ("f", SymbolKind.FUNC, "int", None),
+                          ("a", SymbolKind.PARAM, "int", None), ("b", SymbolKind.PARAM, "bool", 0)])
+        self.assertIs(symbol_table.journal[0][1].token, scanner.tokens[1])
+        self.assertFalse(hasattr(scanner.tokens[1], "data_type"))
+
+    def test_unknown_names_are_not_found(self):
+        symbol_table = SymbolTable()
+        self.assertIsNone(symbol_table.lookup("missing"))
+        self.assertIsNone(symbol_table.lookup(42))
+        self.assertIsNone(symbol_table.lookup_token(self.token("missing")))
+
+class TestScopeIndex(unittest.TestCase):
+
+    SOURCE = ["int x;", "int f(int a){", "int y;", "y = a;", "while (y < a) {", "int x;", "x = y;", "}",
+              "return y;", "}", "int end;"]
+
+    def get_index(self, mock_code):
+        symbol_table = SymbolTable()
+        scanner = Scanner(mock_code, symbol_table)
+        scanner.scan()
+        recorder = ScopeRecorder(symbol_table, scanner)
+        Parser(symbol_table, scanner).parse()
+        return recorder.finish()
+
+    def test_resolves_shadowed_names(self):
+        index = self.get_index(self.SOURCE)
+        inner = index.resolve("x", index.position(7, 1))
+        self.assertEqual((inner.token.line, inner.scope), (6, 4))
+        self.assertEqual(index.resolve("x", index.position(9, 1)).token.line, 1)
+        self.assertIsNone(index.resolve("y", index.position(1, 1)))
+        self.assertIsNone(index.resolve("missing", 0))
+
+    def test_names_are_visible_after_their_declaration(self):
+        index = self.get_index(self.SOURCE)
+        self.assertIsNone(index.resolve("end", index.position(11, 1)))
+        self.assertEqual(index.resolve("end", index.position(11, 5)).kind, SymbolKind.VAR)
+
+    def test_visible_symbols_innermost_first(self):
+        index = self.get_index(self.SOURCE)
+        visible = index.visible_symbols(index.position(7, 1))
+        self.assertEqual([(symbol.value, symbol.scope) for symbol in visible],
+                         [("x", 4), ("y", 3), ("a", 2), ("f", 1)])
+
+    def test_scope_boundaries(self):
+        self.assertEqual(innermost_intervals([(0, 10, "a"), (2, 5, "b"), (5, 7, "c")]),
+                         (array('I', [0, 2, 5, 7, 10]), ["a", "b", "c", "a", None]))
+
+class TestDFAScanner(unittest.TestCase):
+
+    def scan(self, scanner_class, mock_code):
+        symbol_table = SymbolTable()
+        scanner = scanner_class(mock_code, symbol_table)
+        scanner.scan()
+        tokens = [(t.token_class, t.value, t.line, t.column) for t in scanner.tokens]
+        return tokens, scanner.error_list, sorted(symbol_table.names[key] for key in symbol_table.hashtable)
+
+    def assert_same_as_classic(self, mock_code):
+        self.assertEqual(self.scan(DFAScanner, mock_code), self.scan(Scanner, mock_code))
+
+    def test_same_tokens_as_classic_scanner(self):
+        self.assert_same_as_classic(["int main(){ // comment", "  x += 12; c = 'a'; e = '';", "}"])
+
+    def test_same_operators_as_classic_scanner(self):
+        self.assert_same_as_classic(["a<=b>=c==d!e++f--g*=h/=i-=j/k%l?m"])
+
+    def test_same_errors_as_classic_scanner(self):
+        self.assert_same_as_classic(["if(true && false){", "int 123erro = $$;", "'a"])
+
+    def test_keyword_prefix_is_split_like_classic_scanner(self):
+        tokens, errors, ids = self.scan(DFAScanner, ["if2 notx3 int"])
+        self.assertEqual([t[1] for t in tokens], ["if", "2", "notx3", "int"])
+        self.assertEqual(tokens[0][0], TokenClass.KEYWORD)
+        self.assertEqual(ids, ["notx3"])
+
+    def test_same_tokens_for_test_files(self):
+        for name in ["charconst.c", "comments.c", "errors.c", "ids.c", "keywords.c", "numconst.c",
+                     "operators.c", "semanticErrors.c", "syntaxErrors.c", "valid_program.c"]:
+            with open("testfiles/" + name) as source:
+                self.assert_same_as_classic(source.readlines())
+
+class TestStreamingScanner(unittest.TestCase):
+
+    def test_streams_same_tokens_as_scanner(self):
+        mock_code = ["int main(){ // comment", "  x += 12; c = 'a';", "}"]
+        scanner = Scanner(mock_code, SymbolTable())
+        scanner.scan()
+        streaming = StreamingScanner(iter(mock_code), SymbolTable())
+        streamed = []
+        while streaming.see_next_token() is not None:
+            streamed.append(streaming.next_token())
+
+        self.assertEqual([(t.value, t.line, t.column) for t in streamed],
+                         [(t.value, t.line, t.column) for t in scanner.tokens])
+
+    def test_can_move_back_inside_window(self):
+        scanner = StreamingScanner(iter(["a b c d"]), SymbolTable())
+        scanner.next_token()
+        scanner.next_token()
+        self.assertEqual(scanner.next_token().value, "c")
+        self.assertEqual(scanner.see_prior_token().value, "b")
+        self.assertEqual(scanner.prior_token().value, "b")
+        self.assertEqual(scanner.next_token().value, "c")
+
+    def test_cant_move_back_outside_window(self):
+        scanner = StreamingScanner(iter(["a b c d e f"]), SymbolTable(), lookbehind=1)
+        for _ in range(6):
+            scanner.next_token()
+        with self.assertRaises(Exception):
+            scanner.token_at(0)
+
+    def test_cant_read_past_end_of_stream(self):
+        scanner = StreamingScanner(iter(["a"]), SymbolTable())
+        scanner.next_token()
+        self.assertIsNone(scanner.see_next_token())
+        with self.assertRaises(Exception):
+            scanner.next_token()
+
+    def test_parser_reports_same_errors_when_streaming(self):
+        symbol_table = SymbolTable()
+        parser = Parser(symbol_table, StreamingScanner(iter(["int; x"]), symbol_table))
+        parser.parse()
+        self.assertEqual(len(parser.error_list), 1)
+
+    def test_ids_read_inside_a_function_are_global(self):
+        # The parser is inside f when "x" is first lexed, the name outlives f's scope
+        symbol_table = SymbolTable()
+        Parser(symbol_table, StreamingScanner(iter(["int f(){", "int x;", "x = 1;", "}"]), symbol_table)).parse()
+        self.assertEqual(symbol_table.lookup("x").scope, 0)
+
+class TestTokenBuffer(unittest.TestCase):
+
+    def test_views_match_tokens(self):
+        mock_code = ["int x = 'a'; // comment", "x += 12;"]
+        scanner = Scanner(mock_code, SymbolTable())
+        scanner.scan()
+        compact = CompactScanner(mock_code, SymbolTable())
+        compact.scan()
+
+        self.assertEqual(len(compact.tokens), len(scanner.tokens))
+        for token, view in zip(scanner.tokens, compact.tokens):
+            self.assertEqual((token.token_class, token.value, token.line, token.column),
+                             (view.token_class, view.value, view.line, view.column))
+
+    def test_lexemes_are_interned(self):
+        scanner = CompactScanner(["a a a b a"], SymbolTable())
+        scanner.scan()
+        self.assertEqual(len(scanner.tokens), 5)
+        self.assertEqual(scanner.tokens.strings, ["a", "b"])
+
+    def test_views_have_no_dict(self):
+        buffer = TokenBuffer()
+        buffer.add(TokenClass.ID, "x", 1, 1)
+        with self.assertRaises(AttributeError):
+            buffer[0].unknown_attribute = 1
+        self.assertFalse(hasattr(buffer[0], "data_type"))
+
+    def test_parser_works_on_token_buffer(self):
+        symbol_table = SymbolTable()
+        scanner = CompactScanner(["int; x"], symbol_table)
+        scanner.scan()
+        parser = Parser(symbol_table, scanner)
+        parser.parse()
+        self.assertEqual(len(parser.error_list), 1)
+
+class TestMappedScanner(unittest.TestCase):
+
+    def map_source(self, content):
+        handle, path = tempfile.mkstemp(suffix=".c")
+        with os.fdopen(handle, "wb") as source:
+            source.write(content)
+        self.addCleanup(os.remove, path)
+        source = MappedSource(path)
+        self.addCleanup(source.close)
+        return source
+
+    def test_indexes_line_starts(self):
+        source = self.map_source(b"int x;\n\nx = 1;")
+        self.assertEqual(list(source.line_starts), [0, 7, 8])
+        self.assertEqual(source.line_of(9), 2)
+
+    def test_same_tokens_as_scanner(self):
+        content = b"int main(){ // comment\r\n  x += 12; c = 'a'; e = '';\n  1x $\n}"
+        mapped = MappedScanner(self.map_source(content), SymbolTable())
+        mapped.scan()
+        scanner = Scanner(content.decode().replace("\r\n", "\n").splitlines(True), SymbolTable())
+        scanner.scan()
+
+        self.assertEqual([(t.token_class, t.value, t.line, t.column) for t in mapped.tokens],
+                         [(t.token_class, t.value, t.line, t.column) for t in scanner.tokens])
+        self.assertEqual(mapped.error_list, scanner.error_list)
+
+    def test_literals_cut_by_the_end_of_the_file_are_lexical_errors(self):
+        for content, error in [(b"x = 1a", "Could not understand 'a' near 0:5"),
+                               (b"c = '", "Could not understand ''' near 0:4")]:
+            scanner = MappedScanner(self.map_source(content), SymbolTable())
+            scanner.scan()
+            self.assertEqual(scanner.error_list, [error])
+        with self.assertRaisesRegex(IndexError, "No token 2, 2 tokens were scanned"):
+            scanner.tokens[2]
+
+    def test_values_are_decoded_lazily(self):
+        scanner = MappedScanner(self.map_source(b"abc 12"), SymbolTable())
+        scanner.scan()
+        number = scanner.tokens[1]
+        self.assertIsNone(number.cached_value)
+        self.assertEqual(number.value, "12")
+        self.assertEqual((number.start, number.end), (4, 6))
+
+    def test_cant_map_empty_file(self):
+        with self.assertRaises(Exception):
+            self.map_source(b"")
+
+class TestParallelScanner(unittest.TestCase):
+
+    def scan(self, scanner):
+        scanner.scan()
+        tokens = [(t.token_class, t.value, t.line, t.column) for t in scanner.tokens]
+        return tokens, scanner.error_list, list(scanner.symbol_table.hashtable)
+
+    def test_same_result_as_serial_scan(self):
+        mock_code = ["int main(){ // comment", "  x += 12; c = 'a';", "  int 1x = $;", "}"] * 20
+        serial = self.scan(DFAScanner(mock_code, SymbolTable()))
+        parallel = self.scan(ParallelScanner(mock_code, SymbolTable(), workers=2, threshold=0))
+        self.assertEqual(parallel, serial)
+
+    def test_splits_at_line_boundaries_in_order(self):
+        scanner = ParallelScanner(["a", "b", "c", "d", "e"], SymbolTable(), workers=1)
+        chunks = scanner.split()
+        self.assertEqual([start for _, start in chunks], [0, 2, 4])
+        self.assertEqual(sum((lines for lines, _ in chunks), []), ["a", "b", "c", "d", "e"])
+
+    def test_small_input_is_scanned_serially(self):
+        def no_pool(*args, **kwargs):
+            raise AssertionError("a process pool was started")
+        self.addCleanup(setattr, parallel_scanner, "ProcessPoolExecutor", parallel_scanner.ProcessPoolExecutor)
+        parallel_scanner.ProcessPoolExecutor = no_pool
+        scanner = ParallelScanner(["abc 12"], SymbolTable(), workers=4)
+        scanner.scan()
+        self.assertEqual(len(scanner.tokens), 2)
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def scan_with(self, cache, mock_code):
+        symbol_table = SymbolTable()
+        scanner = Scanner(mock_code, symbol_table)
+        hit = cache.scan(scanner)
+        tokens = [(t.token_class, t.value, t.line, t.column) for t in scanner.tokens]
+        names = [symbol_table.names[key] for key in symbol_table.hashtable]
+        return hit, tokens, scanner.error_list, names
+
+    def test_round_trip_encoding(self):
+        scanner = Scanner(["int x = 'a'; $", "x += 300;"], SymbolTable())
+        scanner.scan()
+        tokens, errors, registrations = decode_scan(encode_scan(scanner.tokens, scanner.error_list))
+
+        self.assertEqual([(t.token_class, t.value, t.line, t.column) for t in tokens],
+                         [(t.token_class, t.value, t.line, t.column) for t in scanner.tokens])
+        self.assertEqual(errors, scanner.error_list)
+        self.assertEqual(registrations, [1, 5])
+
+    def test_second_scan_is_a_hit_with_same_result(self):
+        cache = TokenCache(self.directory)
+        mock_code = ["int main(){", "  x = 1; $", "}"]
+        first = self.scan_with(cache, mock_code)
+        second = self.scan_with(cache, mock_code)
+
+        self.assertFalse(first[0])
+        self.assertTrue(second[0])
+        self.assertEqual(first[1:], second[1:])
+
+    def test_changed_source_is_a_miss(self):
+        cache = TokenCache(self.directory)
+        self.scan_with(cache, ["int x;"])
+        self.assertFalse(self.scan_with(cache, ["int y;"])[0])
+
+    def test_corrupted_entry_is_a_miss(self):
+        cache = TokenCache(self.directory)
+        self.scan_with(cache, ["int x;"])
+        with open(cache.path(cache.key(b"int x;")), "wb") as entry:
+            entry.write(b"garbage")
+        self.assertFalse(self.scan_with(cache, ["int x;"])[0])
+
+    def test_evicts_least_recently_used_entries(self):
+        cache = TokenCache(self.directory)
+        for index, name in enumerate(["a", "b", "c"]):
+            self.scan_with(cache, [name])
+            os.utime(cache.path(cache.key(name.encode())), (index, index))
+        # Reading "a" makes "b" the least recently used entry
+        self.assertTrue(self.scan_with(cache, ["a"])[0])
+        size = os.path.getsize(cache.path(cache.key(b"a")))
+        cache.max_bytes = 2 * size
+        cache.evict()
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(cache.key(name.encode()) + ".tok" for name in ["a", "c"]))
+
+class TestIncrementalScanner(unittest.TestCase):
+
+    def token_values(self, tokens):
+        return [(t.value, t.line, t.column) for t in tokens]
+
+    def full_scan(self, mock_code):
+        scanner = DFAScanner(mock_code, SymbolTable())
+        scanner.scan()
+        return self.token_values(scanner.tokens), scanner.error_list
+
+    def get_scanner(self, mock_code):
+        scanner = IncrementalScanner(mock_code, SymbolTable())
+        scanner.scan()
+        return scanner
+
+    def test_replaces_single_line(self):
+        scanner = self.get_scanner(["int x;", "x = 1;", "x = 2;"])
+        tokens, diff = scanner.relex(scanner.tokens, 1, 2, ["x = 10 + y;"])
+
+        self.assertEqual((diff.start, len(diff.removed), len(diff.inserted), diff.line_delta), (3, 4, 6, 0))
+        self.assertEqual((self.token_values(tokens), scanner.error_list),
+                         self.full_scan(["int x;", "x = 10 + y;", "x = 2;"]))
+
+    def test_shifts_lines_after_inserted_lines(self):
+        scanner = self.get_scanner(["int x;", "x = 1;"])
+        tokens, diff = scanner.relex(scanner.tokens, 1, 1, ["int y;", "int z;"])
+
+        self.assertEqual(diff.line_delta, 2)
+        self.assertEqual(tokens[-1].line, 4)
+        self.assertEqual(self.token_values(tokens), self.full_scan(["int x;", "int y;", "int z;", "x = 1;"])[0])
+
+    def test_keeps_errors_in_sync(self):
+        scanner = self.get_scanner(["$", "x;", "&"])
+        scanner.relex(scanner.tokens, 0, 1, ["", "y;"])
+        self.assertEqual(scanner.error_list, self.full_scan(["", "y;", "x;", "&"])[1])
+        scanner.relex(scanner.tokens, 3, 4, ["z;"])
+        self.assertEqual(scanner.error_list, [])
+
+    def test_edits_across_line_spans(self):
+        code = ["x{} = {};".format(line, line) for line in range(600)]
+        scanner = self.get_scanner(list(code))
+        moved = scanner.tokens[-1]
+        for start_line, end_line, new_lines in [(250, 260, ["int y;"]), (0, 0, ["a;", "b;"]),
+                                                (10, 300, []), (300, 300, ["c;"] * 300)]:
+            tokens = scanner.relex(scanner.tokens, start_line, end_line, new_lines)[0]
+            code[start_line:end_line] = new_lines
+            self.assertEqual(self.token_values(tokens), self.full_scan(code)[0])
+        # Still the token scanned first, on its new line
+        self.assertIs(tokens[-1], moved)
+        self.assertEqual(moved.line, len(code))
+
+    def test_leaves_previous_tokens_as_they_were(self):
+        scanner = self.get_scanner(["int x;", "x = 1;", "x = 2;"])
+        previous = scanner.tokens
+        before = list(previous)
+        fields = [(t.token_class, t.value, t.line, t.column) for t in before]
+        tokens, diff = scanner.relex(previous, 1, 2, ["int y;", "y = 3;"])
+
+        self.assertIsNot(tokens, previous)
+        self.assertEqual(list(previous), before)
+        self.assertEqual(diff.removed, before[3:7])
+        self.assertEqual(len(tokens), len(before) + 3)
+        # Tokens before the edit are where they were, the ones after it moved one line down
+        after = [(t.token_class, t.value, t.line, t.column) for t in before]
+        self.assertEqual(after[:7], fields[:7])
+        self.assertEqual(after[7:], [(token_class, value, line + 1, column)
+                                     for token_class, value, line, column in fields[7:]])
+        self.assertEqual(after[7:], [(t.token_class, t.value, t.line, t.column) for t in tokens[10:]])
+
+    def test_cant_relex_tokens_from_before_an_edit(self):
+        scanner = self.get_scanner(["int x;", "x = 1;"])
+        previous = scanner.tokens
+        scanner.relex(previous, 0, 0, ["int y;", "y = 3;"])
+        with self.assertRaises(Exception):
+            scanner.relex(previous, 0, 0, ["int z;"])
+
+    def test_token_list_replace_shares_untouched_chunks(self):
+        tokens = TokenList(chunk_tokens(list(range(2000))))
+        edited = tokens.replace(600, 610, ["a", "b"])
+
+        self.assertEqual(list(tokens), list(range(2000)))
+        self.assertEqual(list(edited), list(range(600)) + ["a", "b"] + list(range(610, 2000)))
+        self.assertEqual((len(edited), edited[-1], edited[601]), (1992, 1999, "b"))
+        self.assertEqual(edited[598:603], [598, 599, "a", "b", 610])
+        self.assertIs(edited.chunks[0], tokens.chunks[0])
+        self.assertIs(edited.chunks[-1], tokens.chunks[-1])
+        with self.assertRaises(IndexError):
+            edited[1992]
+
+    def test_registers_new_ids(self):
+        scanner = self.get_scanner(["int x;"])
+        scanner.relex(scanner.tokens, 0, 1, ["int newname;"])
+        self.assertIsNotNone(scanner.symbol_table.lookup("newname"))
+
+    def test_cant_edit_outside_source(self):
+        scanner = self.get_scanner(["int x;"])
+        with self.assertRaises(Exception):
+            scanner.relex(scanner.tokens, 0, 5, [])
+
+class TestGrammar(unittest.TestCase):
+
+    def test_first_and_follow_sets(self):
+        grammar = Grammar(read_grammar("s -> a t\nt -> b | EPSILON"), "s", k=1)
+        self.assertEqual(grammar.first["s"], {("a",)})
+        self.assertEqual(grammar.first["t"], {("b",), ()})
+        self.assertEqual(grammar.follow["t"], {("$",)})
+
+    def test_looks_further_only_where_needed(self):
+        grammar = Grammar(read_grammar("s -> a b | a c | d"), "s", k=2)
+        self.assertEqual(grammar.table["s"], {"a": {"b": ("a", "b"), "c": ("a", "c")}, "d": ("d",)})
+        self.assertEqual(grammar.conflicts, [])
+
+    def test_first_production_wins_conflicts(self):
+        grammar = Grammar(read_grammar("s -> a b | a b c"), "s", k=2)
+        self.assertEqual(grammar.table["s"], {"a": {"b": ("a", "b")}})
+        self.assertEqual(grammar.conflicts, [("s", ("a", "b"), [0, 1])])
+
+    def test_declarations_need_three_tokens(self):
+        row = C_MINUS.table["declaration"]
+        self.assertEqual(row["record"], ("recDeclaration",))
+        self.assertEqual(row["int"]["ID"]["("], ("funDeclaration",))
+        self.assertEqual(row["int"]["ID"][";"], ("varDeclaration",))
+        self.assertEqual(C_MINUS.depth(row), 3)
+
+    def test_parser_follows_predictions(self):
+        parser, tree, failure = parse_source(["int x, y;", "char c = 'a';"])
+
+        self.assertEqual((parser.error_list, failure), ([], None))
+        declarations = [tree.declaration_list.declaration] + tree.declaration_list.list_declaration.list_declaration
+        self.assertTrue(all(hasattr(node, "var_declaration") for node in declarations))
+
+def parse_source(code, parser_class=Parser, scanner_class=Scanner, syntax_only=False, **options):
+    """Scans and parses code, returns (parser, tree, failure).
+
+    failure is the message of the exception parse raised, tree is then None.
+    syntax_only leaves the semantic checks to a SemanticAnalyzer.
+    """
+    symbol_table = SymbolTable()
+    scanner = scanner_class(code, symbol_table)
+    scanner.scan()
+    parser = parser_class(symbol_table, scanner, **options)
+    if syntax_only:
+        parser.semantic_helpers = SyntaxOnlyHelpers(symbol_table)
+    try:
+        return parser, parser.parse(), None
+    except Exception as raised:
+        return parser, None, str(raised)
+
+def tree_shape(node):
+    # Nested (type, attributes) tuples, tokens compared by position
+    if isinstance(node, list):
+        return [tree_shape(child) for child in node]
+    if hasattr(node, "token_class"):
+        return (node.value, node.line, node.column)
+    if not isinstance(node, SyntaxNode):
+        return node
+    return (node.type, [(name, tree_shape(getattr(node, name))) for name in node.fields if hasattr(node, name)])
+
+def nested_program(depth):
+    return ["int main(){", "int x = 0;", "x = " + "(" * depth + "1" + ")" * depth + ";"] + \
+           ["while(x < 1)"] * depth + ["x = 1;", "return 0;", "}", "int end;"]
+
+class TestIterativeParser(unittest.TestCase):
+
+    def parse(self, parser_class, mock_code):
+        parser, tree, failure = parse_source(mock_code, parser_class)
+        return tree, parser.error_list, failure
+
+    def parse_shape(self, parser_class, mock_code):
+        tree, errors, exception = self.parse(parser_class, mock_code)
+        return tree_shape(tree), errors, exception
+
+    def assert_same_as_recursive(self, mock_code):
+        self.assertEqual(self.parse_shape(IterativeParser, mock_code), self.parse_shape(Parser, mock_code))
+
+    def test_same_tree_as_recursive_parser(self):
+        self.assert_same_as_recursive(nested_program(8))
+
+    def test_same_errors_as_recursive_parser(self):
+        self.assert_same_as_recursive(["int; x", "record r { int a; }", "int f(int a; char b){ a = b; }"])
+
+    def test_same_result_for_test_files(self):
+        for name in ["charconst.c", "ids.c", "keywords.c", "semanticErrors.c", "syntaxErrors.c",
+                     "valid_program.c"]:
+            with open("testfiles/" + name) as source:
+                self.assert_same_as_recursive(source.readlines())
+
+    def test_nesting_is_not_bound_by_recursion_limit(self):
+        tree, errors, exception = self.parse(IterativeParser, nested_program(5000))
+        self.assertEqual((errors, exception), ([], None))
+
+    def test_same_result_for_programs(self):
+        # The rules are written twice, this keeps the two sets in sync
+        for name in sorted(os.listdir("programs")):
+            with open(os.path.join("programs", name)) as source:
+                self.assert_same_as_recursive(source.readlines())
+
+class TestPrecedenceParser(unittest.TestCase):
+
+    def parse(self, mock_code, concrete=False):
+        parser, tree, failure = parse_source(["int main(){", "int a = 1;", "int b = 2;", "bool c = true;"] + mock_code +
+                                             ["return 0;", "}", "int end;"], PrecedenceParser, concrete=concrete)
+        self.assertEqual((parser.error_list, failure), ([], None))
+        body = tree.declaration_list.declaration.fun_declaration.statement.compound_stmt
+        return body.statement_list.list_statement.statement[0]
+
+    def condition(self, expression):
+        return self.render(self.parse(["while(" + expression + ") a = 1;"]).iteration_stmt.simple_expression)
+
+    def render(self, node):
+        if isinstance(node, BinaryNode):
+            return "({} {} {})".format(self.render(node.left), node.op.value, self.render(node.right))
+        if isinstance(node, UnaryNode):
+            return "({} {})".format(node.op.value, self.render(node.operand))
+        return node.token.value
+
+    def test_binds_by_precedence(self):
+        self.assertEqual(self.condition("a + b * 2 < 10 or not c and a == b"),
+                         "(((a + (b * 2)) < 10) or ((not c) and (a == b)))")
+
+    def test_same_level_operators_are_left_associative(self):
+        self.assertEqual(self.condition("a - b - (a - 1) / 2 % b"), "((a - b) - (((a - 1) / 2) % b))")
+
+    def test_relational_operators_dont_chain(self):
+        parser = parse_source(["int main(){", "int a = 1;", "while(a < a < a) a = 1;", "}", "int end;"],
+                              PrecedenceParser)[0]
+        self.assertEqual(parser.error_list[0], "Syntax Error in 3:14 expected:')' found:'<'")
+
+    def test_literal_is_a_single_leaf(self):
+        node = self.parse(["a = 5;"]).expression_stmt.expression
+        self.assertEqual(node.type, SyntaxNodeTypes.EXPRESSION)
+        self.assertIsInstance(node.mutable, LeafNode)
+        self.assertIsInstance(node.expression, LeafNode)
+        self.assertEqual(node.expression.type, SyntaxNodeTypes.CONSTANT)
+
+    def test_concrete_option_builds_recursive_tree(self):
+        node = self.parse(["a = 5;"], concrete=True).expression_stmt.expression
+        self.assertEqual(node.expression.simple_expression.type, SyntaxNodeTypes.SIMPLE_EXPRESSION)
+
+    def test_concrete_option_matches_recursive_parser(self):
+        trees = []
+        for parser_class, options in [(Parser, {}), (PrecedenceParser, {"concrete": True})]:
+            parser, tree, failure = parse_source(nested_program(8), parser_class, **options)
+            trees.append((tree_shape(tree), parser.error_list, failure))
+        self.assertEqual(trees[0], trees[1])
+
+    def test_compacted_concrete_tree_matches_precedence_parser(self):
+        statements = ["while(a + b * 2 < 10 or not c and a == -b) a = 1;", "a += (b - 1) / 2;"]
+        rendered = []
+        for concrete in [True, False]:
+            body = compact_program(self.parse(statements, concrete).iteration_stmt)
+            assignment = body.statement.expression_stmt.expression
+            rendered.append((self.render(body.simple_expression), self.render(assignment.expression)))
+        self.assertEqual(rendered[0], rendered[1])
+        self.assertEqual(rendered[0], ("(((a + (b * 2)) < 10) or ((not c) and (a == (- b))))", "1"))
+
+class TestSyntaxTree(unittest.TestCase):
+
+    def parse(self, mock_code):
+        return parse_source(mock_code)[1]
+
+    def test_each_type_has_its_own_slots_class(self):
+        node = SyntaxNode(SyntaxNodeTypes.MUTABLE)
+        self.assertIsInstance(node, SyntaxNode)
+        self.assertEqual(type(node).__name__, "MutableNode")
+        self.assertEqual(node.type, SyntaxNodeTypes.MUTABLE)
+        self.assertFalse(hasattr(node, "id"))
+        self.assertFalse(hasattr(node, "__dict__"))
+        with self.assertRaises(AttributeError):
+            node.unknown_attribute = 1
+
+    def test_cant_build_unknown_type(self):
+        with self.assertRaises(Exception):
+            SyntaxNode("not a node type")
+
+    def test_var_declaration_is_a_tree_node(self):
+        tree = self.parse(["int x;", "int y;"])
+        declaration = tree.declaration_list.declaration.var_declaration
+        self.assertIsInstance(declaration, SyntaxNode)
+        self.assertEqual(declaration.var_declaration_list.var_decl_initialize.var_decl_id.id.value, "x")
+
+    def test_walk_visits_parents_first_in_source_order(self):
+        tree = self.parse(["int x;", "char y;"])
+        ids = [node.id.value for node in walk(tree) if node.type == SyntaxNodeTypes.VAR_DEC_ID]
+        self.assertEqual(ids, ["x", "y"])
+        self.assertIs(next(walk(tree)), tree)
+
+    def test_walk_is_not_bound_by_recursion_limit(self):
+        tree = parse_source(nested_program(1000), IterativeParser)[1]
+        loops = [node for node in walk(tree) if node.type == SyntaxNodeTypes.ITERATION_STATEMENT]
+        self.assertEqual(len(loops), 1000)
+
+    def test_visitor_dispatches_by_node_type(self):
+        class Collector(NodeVisitor):
+            def __init__(self):
+                self.names = []
+
+            def visit_var_dec_id(self, node):
+                self.names.append(node.id.value)
+
+        collector = Collector()
+        collector.visit(self.parse(["int x, y;", "bool z;"]))
+        self.assertEqual(collector.names, ["x", "y", "z"])
+
+class TestTreeFile(unittest.TestCase):
+
+    def parse(self, parser_class, mock_code):
+        parser, tree, failure = parse_source(mock_code, parser_class)
+        return tree, parser.symbol_table, parser.error_list
+
+    def symbols(self, symbol_table):
+        return [(symbol_table.names[key], [(s.value, s.token.line, s.token.column, s.scope, s.kind, s.data_type,
+                                            s.array_size) for s in tk_list])
+                for key, tk_list in symbol_table.hashtable.items()]
+
+    def assert_round_trip(self, parser_class, mock_code):
+        tree, symbol_table, error_list = self.parse(parser_class, mock_code)
+        program = ProgramFile(encode_program(tree, symbol_table, error_list))
+        self.assertEqual(tree_shape(program.tree()), tree_shape(tree))
+        self.assertEqual(self.symbols(program.symbol_table), self.symbols(symbol_table))
+        self.assertEqual(program.error_list, error_list)
+
+    def test_round_trip_test_files(self):
+        for name in sorted(os.listdir("testfiles")):
+            with open(os.path.join("testfiles", name)) as source:
+                code = source.readlines()
+            for parser_class in [Parser, PrecedenceParser]:
+                self.assert_round_trip(parser_class, code)
+
+    def test_round_trip_compact_expressions(self):
+        self.assert_round_trip(PrecedenceParser, ["int f(){", "int a = 1;", "a = -a * (a + 2) - 3;",
+                                                   "while(not a < 2 or a == 1) a += 1;", "}", "int g;"])
+
+    def test_round_trip_deep_nesting(self):
+        tree, symbol_table, error_list = self.parse(IterativeParser, nested_program(2000))
+        program = ProgramFile(encode_program(tree, symbol_table, []))
+        self.assertEqual(sum(1 for _ in walk(program.tree())), sum(1 for _ in walk(tree)))
+
+    def test_declarations_are_decoded_on_demand(self):
+        tree, symbol_table, error_list = self.parse(Parser, ["int f(){ return 1; }", "int g(){ return 2; }",
+                                                             "int x;"])
+        program = ProgramFile(encode_program(tree, symbol_table, error_list))
+
+        self.assertEqual(len(program), 3)
+        self.assertEqual(program.names, ["f", "g", None])
+        function = program.find("g")
+        self.assertEqual(function.fun_declaration.id.value, "g")
+        self.assertEqual([declaration is not None for declaration in program.declarations],
+                         [False, True, False])
+        self.assertIsNone(program.find("missing"))
+
+    def test_cant_read_other_files(self):
+        with self.assertRaises(Exception):
+            ProgramFile(b"CMTK\x02")
+
+class TestIncrementalParser(unittest.TestCase):
+
+    SOURCE = ["int g;", "int f(int a){", "int b;", "b = a + g;", "return b;", "}",
+              "int h(){", "return 1;", "}", "int end;"]
+
+    def get_parser(self, mock_code):
+        parser, tree, failure = parse_source(mock_code, IncrementalParser, IncrementalScanner)
+        self.assertIsNone(failure)
+        return parser, tree
+
+    def full_parse(self, mock_code):
+        parser, tree, failure = parse_source(mock_code)
+        return tree_shape(tree), parser.error_list, failure
+
+    def edit(self, parser, tree, start_line, end_line, new_lines):
+        tokens, diff = parser.scanner.relex(parser.scanner.tokens, start_line, end_line, new_lines)
+        reparsed = parser.reparse(tree, diff)
+        self.assertEqual((tree_shape(tree), parser.error_list, None), self.full_parse(parser.scanner.code))
+        return reparsed
+
+    def test_reparses_only_the_edited_function(self):
+        parser, tree = self.get_parser(self.SOURCE)
+        before = top_level_declarations(tree)
+        reparsed = self.edit(parser, tree, 3, 4, ["b = a * g + 2;"])
+
+        self.assertEqual(list(reparsed), [1])
+        after = top_level_declarations(tree)
+        self.assertEqual([old is new for old, new in zip(before, after)], [True, False, True, True])
+
+    def test_inserts_and_removes_declarations(self):
+        parser, tree = self.get_parser(self.SOURCE)
+        self.edit(parser, tree, 6, 6, ["int k;"])
+        self.assertEqual(len(top_level_declarations(tree)), 5)
+        self.edit(parser, tree, 6, 10, [])
+        self.assertEqual(len(top_level_declarations(tree)), 3)
+
+    def test_errors_follow_the_edits(self):
+        parser, tree = self.get_parser(self.SOURCE)
+        self.edit(parser, tree, 3, 4, ["b = ;"])
+        self.assertEqual(len(parser.error_list), 1)
+        self.edit(parser, tree, 0, 0, ["", ""])
+        self.assertTrue(parser.error_list[0].startswith("Syntax Error in 6:"))
+        self.edit(parser, tree, 5, 6, ["b = 1;"])
+        self.assertEqual(parser.error_list, [])
+
+    def test_sees_globals_declared_before(self):
+        parser, tree = self.get_parser(self.SOURCE)
+        with self.assertRaises(Exception):
+            parser.reparse(tree, parser.scanner.relex(parser.scanner.tokens, 7, 8, ["return end;"])[1])
+        parser, tree = self.get_parser(self.SOURCE)
+        self.edit(parser, tree, 7, 8, ["return g;"])
+
+    def test_globals_added_before_kept_declarations_clash_with_them(self):
+        for start_line, end_line, new_lines in [(6, 6, ["int h(){ return 2; }"]), (0, 0, ["int end;"]),
+                                                (6, 6, ["int end;"])]:
+            parser, tree = self.get_parser(self.SOURCE)
+            failure = self.full_parse(self.SOURCE[:start_line] + new_lines + self.SOURCE[end_line:])[2]
+            self.assertTrue(failure.startswith("Name already exists in scope!"))
+            diff = parser.scanner.relex(parser.scanner.tokens, start_line, end_line, new_lines)[1]
+            with self.assertRaises(Exception) as incremental:
+                parser.reparse(tree, diff)
+            self.assertEqual(str(incremental.exception), failure)
+
+class TestParallelParser(unittest.TestCase):
+
+    def parse(self, parser_class, mock_code, **options):
+        parser, tree, failure = parse_source(mock_code, parser_class, DFAScanner, **options)
+        return tree_shape(tree), parser.error_list, failure
+
+    def assert_same_as_serial(self, mock_code):
+        self.assertEqual(self.parse(ParallelParser, mock_code, workers=2, threshold=0),
+                         self.parse(Parser, mock_code))
+
+    def test_same_result_as_serial_parse(self):
+        self.assert_same_as_serial(["int g;", "int f(int a){", "int b;", "b = a + g;", "return b;", "}",
+                                    "record point { int x; }", "int h(){", "while(g < 1) g += 1;", "return 1;", "}",
+                                    "bool end;"] * 3)
+
+    def test_errors_stay_in_source_order(self):
+        self.assert_same_as_serial(["int f(int a; ){", "a = 1 +;", "}", "int g(){", "return 1", "}", "int end;"])
+
+    def test_first_semantic_error_wins(self):
+        mock_code = ["int f(){", "return 1;", "}", "int g(){", "x = 1;", "}", "int h(){", "y = 1;", "}", "int end;"]
+        self.assertEqual(self.parse(ParallelParser, mock_code, workers=2, threshold=0)[2],
+                         "Variable 'x' wasn't declared (5:2)")
+        self.assert_same_as_serial(mock_code)
+
+    def test_syntax_errors_before_an_exception_in_a_body_are_kept(self):
+        mock_code = ["int main(){", " b{ol b2 = 1 <= 3;", " b2 = 5;", " return 0;", "}", "int f(){", "return 1", "}"]
+        shape, errors, failure = self.parse(ParallelParser, mock_code, workers=2, threshold=0)
+        self.assertTrue(failure.startswith("Invalid type assignment at 'b2'"))
+        self.assertEqual(len(errors), 2)
+        self.assert_same_as_serial(mock_code)
+
+    def test_bodies_braces_dont_delimit_fall_back_to_serial(self):
+        self.assert_same_as_serial(["int f(int a){", "if (a) {", "return 1;", "} else return 2;", "}", "int end;"])
+        self.assert_same_as_serial(["int f(int a){", "int b;", "}", "g(int z){ return 1; }", "int end;"])
+
+class TestSymbolIndex(unittest.TestCase):
+
+    LIBRARY = "int total;\nrecord point { int x; }\n"
+    MAIN = "int f(int a){\nreturn a;\n}\nint g(int b){\nint c;\nc = f(b);\nreturn c;\n}\nint h(){\nreturn total;\n}\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.index = SymbolIndex(os.path.join(self.directory, "index.db"))
+        self.addCleanup(self.index.close)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as source:
+            source.write(text)
+        return path
+
+    def test_extracts_declarations_and_uses(self):
+        declarations, uses, _ = extract_symbols(["int f(int a){", "int b;", "b = f(a);", "}"])
+        self.assertEqual(declarations, [("f", "FUNC", "int", None, 1, None, 1, 6),
+                                        ("a", "PARAM", "int", None, 2, "f", 1, 12),
+                                        ("b", "VAR", "int", None, 3, "f", 2, 6)])
+        self.assertEqual(uses, [("b", "use", 3, "f", 3, 2), ("f", "call", 1, "f", 3, 6),
+                                ("a", "use", 2, "f", 3, 8)])
+
+    def test_queries_across_files(self):
+        library = self.write("library.c", self.LIBRARY)
+        main = self.write("main.c", self.MAIN)
+        self.index.update([library, main])
+
+        self.assertEqual(self.index.callers("f"), [(main, "g")])
+        self.assertEqual(self.index.definitions("point"), [(library, "RECORD", "point", 2, 13)])
+        self.assertEqual(self.index.signature("g"), [(main, "int", [("b", "int", None)])])
+        # total is declared in another file, the use stays unresolved
+        self.assertEqual(self.index.references("total"), [(main, "use", "h", 10, 13)])
+        self.assertEqual([row[:2] for row in self.index.declarations_of_type("int")],
+                         [(library, "total"), (library, "x"), (main, "f"), (main, "a"), (main, "g"), (main, "b"),
+                          (main, "c"), (main, "h")])
+
+    def test_update_only_reindexes_changed_files(self):
+        library = self.write("library.c", self.LIBRARY)
+        main = self.write("main.c", self.MAIN)
+        self.assertEqual(self.index.update([library, main]), [library, main])
+        self.assertEqual(self.index.update([library, main]), [])
+
+        self.write("main.c", self.MAIN.replace("c = f(b);", "c = b;"))
+        self.assertEqual(self.index.update([library, main]), [main])
+        self.assertEqual(self.index.callers("f"), [])
+        self.assertEqual(len(self.index.definitions("total")), 1)
+
+        self.index.remove(library)
+        self.assertEqual(self.index.files(), [main])
+        self.assertEqual(self.index.definitions("total"), [])
+
+class TestConstantFolder(unittest.TestCase):
+
+    def fold(self, parser_class, mock_code):
+        parser, tree, failure = parse_source(["int g = 2 * 3 + 1;", "int main(){"] + mock_code + ["}"], parser_class,
+                                             DFAScanner, syntax_only=True)
+        self.assertEqual((parser.error_list, failure), ([], None))
+        symbol_table = parser.symbol_table
+        self.assertEqual(SemanticAnalyzer(symbol_table).analyze(tree), [])
+        folder = ConstantFolder()
+        folder.fold(tree)
+        # The folded tree is still a valid program
+        self.assertEqual(SemanticAnalyzer(symbol_table).analyze(tree), [])
+        return tree, folder
+
+    def render(self, node):
+        if isinstance(node, BinaryNode):
+            return "({} {} {})".format(self.render(node.left), node.op.value, self.render(node.right))
+        if isinstance(node, UnaryNode):
+            return "({} {})".format(node.op.value, self.render(node.operand))
+        if isinstance(node, LeafNode):
+            return node.token.value
+        if getattr(node, "expression", None) is None:
+            return "{} {}".format(self.render(node.mutable), node.op.value)
+        return "{} {} {}".format(self.render(node.mutable), node.op.value, self.render(node.expression))
+
+    def statements(self, tree):
+        rendered = []
+        for node in walk(tree.declaration_list.list_declaration.list_declaration[0]):
+            if node.type in (SyntaxNodeTypes.EXPRESSION_STATEMENT, SyntaxNodeTypes.RETURN_STATEMENT):
+                expression = getattr(node, "expression", None)
+                rendered.append(self.render(expression) if isinstance(expression, SyntaxNode) else ";")
+                if node.type == SyntaxNodeTypes.RETURN_STATEMENT:
+                    rendered[-1] = "return " + rendered[-1]
+            elif node.type == SyntaxNodeTypes.SELECTION_STATEMENT:
+                rendered.append("if " + self.render(node.simple_expression))
+            elif node.type == SyntaxNodeTypes.ITERATION_STATEMENT:
+                rendered.append("while " + self.render(node.simple_expression))
+        return rendered
+
+    def test_folds_and_propagates_constants(self):
+        for parser_class in [Parser, PrecedenceParser]:
+            tree, folder = self.fold(parser_class, [
+                "int n = 4 * 2;", "int i;", "char c = 'a';", "bool b = n > 5 and c == 'a';", "i = n / 3 - -7 % 3;",
+                "n = i + g;", "n += 1;", "return (n + 1) * g;"])
+            self.assertEqual(tree.declaration_list.declaration.var_declaration.var_declaration_list
+                             .var_decl_initialize.initialize_decl_var.simple_expression.token.value, "7")
+            self.assertEqual(self.statements(tree), ["i = 3", "n = (3 + g)", "n += 1", "return ((n + 1) * g)"])
+            self.assertEqual((folder.folded, folder.pruned), (10, 0))
+
+    def test_prunes_constant_branches_and_loops(self):
+        tree, folder = self.fold(PrecedenceParser, [
+            "int i = 0;", "int n = 8;", "bool b = true;", "while (n < 0) n++;", "if (not b) i = 1; else i = 2;",
+            "while (i < n) { i++; if (i == 9 and b) break; }", "if (false) n = 0;", "return i;"])
+        self.assertEqual(self.statements(tree), ["i = 2", "while (i < 8)", "i ++", "if (i == 9)",
+                                                 "return i"])
+        self.assertEqual(folder.pruned, 3)
+        self.assertEqual(folder.removed, 34)
+
+    def test_keeps_values_paths_disagree_on(self):
+        tree, _ = self.fold(PrecedenceParser, [
+            "int i = 1;", "int k = 1;", "bool b = g > 3;", "if (b) { i = 2; k = 5; } else k = 5;",
+            "while (b) { b = false; }", "return i + k;"])
+        self.assertEqual(self.statements(tree), ["if b", "i = 2", "k = 5", "k = 5", "while b", "b = false",
+                                                 "return (i + 5)"])
+
+class TestInterpreter(unittest.TestCase):
+
+    def checked_tree(self, mock_code, parser_class=PrecedenceParser):
+        parser, tree, failure = parse_source(mock_code, parser_class, DFAScanner, syntax_only=True)
+        self.assertEqual((parser.error_list, failure), ([], None))
+        self.assertEqual(SemanticAnalyzer(parser.symbol_table).analyze(tree), [])
+        return tree
+
+    def run_program(self, mock_code, parser_class=PrecedenceParser):
+        return Interpreter(self.checked_tree(mock_code, parser_class)).run()
+
+    def test_loops_branches_and_assignment_operators(self):
+        mock_code = ["int main(){", "int i = 0;", "int total = 0;", "while(true){", "i++;",
+                     "if(i % 2 == 0) total += i;", "else total -= 1;", "if(i >= 10) break;", "}", "total *= 3;",
+                     "total /= 4;", "i--;", "return total * 100 + i;", "}"]
+        for parser_class in [Parser, IterativeParser, PrecedenceParser]:
+            self.assertEqual(self.run_program(mock_code, parser_class), 1809)
+
+    def test_recursion_and_parameters(self):
+        self.assertEqual(self.run_program(["int fib(int n){", "if(n < 2) return n;",
+                                           "return fib(n - 1) + fib(n - 2);", "}",
+                                           "int pick(int a, b; bool first){", "if(first) return a;", "return b;",
+                                           "}", "int main(){", "return fib(15) + pick(1, 2, false);", "}"]), 612)
+
+    def test_arrays_by_reference_records_by_value(self):
+        self.assertEqual(self.run_program([
+            "record point { int x; int y; }", "int data[4];", "int fill(int v[]; int n){", "int i = 0;",
+            "while(i < *v){ v[i] = n * i; i++; }", "return 0;", "}", "int move(point p){", "p.x = 100;",
+            "return p.x;", "}", "int main(){", "point p;", "int i = 0;", "int total = 0;", "p.x = 3;",
+            "fill(data, 5);", "while(i < 4){ total += data[i]; i++; }", "return total + move(p) + p.x;", "}"]), 133)
+
+    def test_c_division_and_characters(self):
+        self.assertEqual(self.run_program(["bool main(){", "char c = 'b';", "int a = -7;",
+                                           "return a / 2 == -3 and a % 2 == -1 and c > 'a' and not (c == 'a');",
+                                           "}"]), True)
+
+    def test_run_time_errors_name_their_position(self):
+        with self.assertRaisesRegex(Exception, r"Division by zero \(3:11\)"):
+            self.run_program(["int main(){", "int a = 0;", "return 1 / a;", "}"])
+        with self.assertRaisesRegex(Exception, "Index 3 out of bounds of 'v'"):
+            self.run_program(["int main(){", "int v[3];", "return v[3];", "}"])
+
+    def test_assignments_as_values_and_nested_records(self):
+        self.assertEqual(self.run_program([
+            "record point { int x; int y; }", "record box { point p; int n; }", "int main(){", "box b;", "box c;",
+            "point ps[3];", "int v[3];", "int a;", "int w;", "a = v[1] = 7;", "w = ps[2].x = a + 1;",
+            "ps[2].x += v[1];", "b.p.y = 4;", "c = b;", "b.p.y--;", "c.n = 2;",
+            "return a * 1000 + w * 100 + ps[2].x * 10 + b.p.y + c.p.y + c.n + b.n;", "}"]), 7959)
+
+    def test_short_circuit_and_globals(self):
+        self.assertEqual(self.run_program([
+            "int calls;", "bool touch(bool b){", "calls++;", "return b;", "}", "int main(){", "int i = 0;",
+            "if(touch(false) and touch(true)) i = 100;", "if(touch(true) or touch(true)) i += 10;",
+            "while(i < 20 and touch(true)) i++;", "return i * 100 + calls;", "}"]), 2012)
+
+    def test_division_assignment_and_call_stack_errors(self):
+        with self.assertRaisesRegex(Exception, r"Division by zero \(3:5\)"):
+            self.run_program(["int main(){", "int a = 0;", "a /= a;", "return a;", "}"])
+        with self.assertRaisesRegex(Exception, "Call stack overflow running 'main'"):
+            self.run_program(["int f(int n){", "return f(n + 1);", "}", "int main(){", "return f(0);", "}"])
+
+class TestVirtualMachine(TestInterpreter):
+    # Every interpreter test runs on the bytecode too
+
+    def compile(self, mock_code, parser_class=PrecedenceParser):
+        return compile_program(self.checked_tree(mock_code, parser_class))
+
+    def run_program(self, mock_code, parser_class=PrecedenceParser):
+        return VirtualMachine(self.compile(mock_code, parser_class)).run()
+
+    def test_bytecode_is_compact_and_disassembles(self):
+        program = self.compile(["int main(){", "int i = 0;", "int total = 0;", "while(i < 10){",
+                                "total += i * 2;", "i++;", "}", "return total;", "}"])
+        main = program.function("main")
+        self.assertIsInstance(main.code, array)
+        self.assertEqual(main.code.typecode, 'i')
+        self.assertEqual([OPCODE_NAMES[opcode] for _, opcode, _ in instructions(main.code)],
+                         ["LOAD_CONST", "STORE_LOCAL", "LOAD_CONST", "STORE_LOCAL", "JUMP", "BINARY_OPERANDS",
+                          "INPLACE", "INPLACE_OPERAND", "COMPARE_JUMP", "LOAD_LOCAL", "RETURN", "LOAD_CONST",
+                          "RETURN"])
+        listing = disassemble(program)
+        self.assertIn("BINARY_OPERANDS       * i 2", listing)
+        self.assertIn("COMPARE_JUMP          >= i 10 -> ", listing)
+        self.assertEqual(VirtualMachine(program).run(), 90)
+
+class TestIRInterpreter(TestInterpreter):
+    # Every interpreter test runs on the optimized IR too
+
+    def build(self, mock_code, parser_class=PrecedenceParser):
+        return build_program(self.checked_tree(mock_code, parser_class))
+
+    def run_program(self, mock_code, parser_class=PrecedenceParser):
+        program = self.build(mock_code, parser_class)
+        optimize_program(program)
+        return IRInterpreter(program).run()
+
+    def ops(self, function):
+        return [instruction.op for block in function.blocks for instruction in block.instructions]
+
+    def test_loop_variables_meet_in_header_phis(self):
+        program = self.build(["int main(){", "int i = 0;", "int total = 0;", "while(i < 10){",
+                              "total += i * 2;", "i++;", "}", "return total;", "}"])
+        main = program.functions["main"]
+        to_ssa(main)
+        header = main.blocks[1]
+        self.assertEqual(sorted(phi.dest for phi in header.phis()), ["i.2", "total.2"])
+        self.assertEqual(header.phis()[0].extra, [0, 2])
+        self.assertIn("i.2 = phi [i, B0], [i.3, B2]", format_program(program))
+        self.assertEqual(IRInterpreter(program).run(), 90)
+
+    def test_constants_propagate_through_branches(self):
+        program = self.build(["int main(){", "int x = 4;", "int y;", "if(x * 2 > 5) y = x + 1;", "else y = 0;",
+                              "while(y > 100) y--;", "return y * 10;", "}"])
+        main = program.functions["main"]
+        to_ssa(main)
+        propagate_constants(main)
+        self.assertEqual(len(main.blocks), 1)
+        self.assertEqual(self.ops(main), ["return"])
+        self.assertEqual(main.blocks[0].instructions[0].args[0].value, 50)
+
+    def test_division_by_constant_zero_is_kept(self):
+        program = self.build(["int main(){", "int a = 0;", "int b = 7 / a;", "return 1;", "}"])
+        optimize_program(program)
+        self.assertIn("binary", self.ops(program.functions["main"]))
+        with self.assertRaisesRegex(Exception, r"Division by zero \(3:12\)"):
+            IRInterpreter(program).run()
+
+    def test_copies_and_common_subexpressions(self):
+        program = self.build(["int f(int a; int b){", "int c = a;", "int d = c * b + 1;", "int e = b * a + 1;",
+                              "return d + e;", "}", "int main(){", "return f(3, 4);", "}"])
+        f = program.functions["f"]
+        to_ssa(f)
+        propagate_copies(f)
+        self.assertNotIn("copy", self.ops(f))
+        eliminate_common_subexpressions(f)
+        self.assertEqual(self.ops(f), ["binary", "binary", "binary", "return"])
+        self.assertEqual(IRInterpreter(program).run(), 26)
+
+    def test_dead_code_keeps_effects(self):
+        program = self.build(["int g;", "int f(int v[]){", "int unused = v[0] * 5;", "int i = *v + 1;",
+                              "int n = ?3;", "g = 2;", "return 1;", "}", "int main(){", "int v[2];",
+                              "return f(v) + g;", "}"])
+        f = program.functions["f"]
+        to_ssa(f)
+        propagate_copies(f)
+        eliminate_dead_code(f)
+        # The index may trap and ? draws a number, the size and the products are dropped
+        self.assertEqual(self.ops(f), ["index", "unary", "store_global", "return"])
+        self.assertEqual(IRInterpreter(program).run(), 3)
+
+    def test_pass_manager_reports_every_pass(self):
+        program = self.build(["int main(){", "int i = 0;", "int k = 3;", "int total = 0;", "while(i < 10){",
+                              "total += k * i;", "i++;", "}", "return total;", "}"])
+        before = program.instruction_count()
+        manager = optimize_program(program)
+        self.assertEqual([row[0] for row in manager.report], ["ssa", "sccp", "copy-propagation", "cse", "dce"])
+        self.assertEqual(manager.report[0][2], before)
+        for previous, row in zip(manager.report, manager.report[1:]):
+            self.assertEqual(row[2], previous[3])
+        self.assertLess(manager.report[-1][3], before)
+        self.assertIn("copy-propagation", manager.format_report())
+        self.assertEqual(IRInterpreter(program).run(), 135)
+
+class TestLoopOptimizer(TestIRInterpreter):
+    # The IR tests run again with the loop passes
+
+    def run_program(self, mock_code, parser_class=PrecedenceParser):
+        program = self.build(mock_code, parser_class)
+        optimize_program(program, loop_passes(LoopOptimizer()))
+        return IRInterpreter(program).run()
+
+    def optimize(self, mock_code):
+        program = self.build(mock_code)
+        loops = LoopOptimizer()
+        optimize_program(program, loop_passes(loops))
+        return program, loops
+
+    MATRIX = ["int sum(int m[]; int rows, cols){", "int i = 0;", "int j;", "int total = 0;", "while(i < rows){",
+              "j = 0;", "while(j < cols){", "total += m[i * cols + j] + *m;", "j++;", "}", "i++;", "}",
+              "return total;", "}", "int main(){", "int m[6];", "int i = 0;", "while(i < 6){", "m[i] = i;",
+              "i++;", "}", "return sum(m, 2, 3);", "}"]
+
+    def test_finds_nested_natural_loops(self):
+        program = self.build(self.MATRIX)
+        function = program.functions["sum"]
+        to_ssa(function)
+        loops = find_loops(function)
+        self.assertEqual([loop.depth for loop in loops], [2, 1])
+        inner, outer = loops
+        self.assertLess(inner.blocks, outer.blocks)
+        self.assertEqual(len(inner.latches), 1)
+        self.assertIn(inner.preheader, outer.blocks)
+        self.assertNotIn(outer.preheader, outer.blocks)
+
+    def test_invariants_leave_every_loop_they_dont_change_in(self):
+        program, loops = self.optimize(self.MATRIX)
+        function = program.functions["sum"]
+        entry = [str(instruction) for instruction in function.blocks[0].instructions]
+        # *m is invariant in both loops, i * cols only in the inner one
+        self.assertIn("%6 = size m", entry)
+        self.assertIn("sum: hoisted %6 = size m out of the loop at B1", loops.applied)
+        self.assertTrue(any(line.startswith("sum: hoisted %3 = i.2 * cols") for line in loops.applied))
+        self.assertEqual(IRInterpreter(program).run(), 51)
+
+    def test_products_of_induction_variables_become_sums(self):
+        program, loops = self.optimize(self.MATRIX)
+        self.assertIn("sum: reduced %3 = i.2 * cols to %3.iv += cols", loops.applied)
+        report = loops.format_report()
+        self.assertIn("sum: loop at B4, depth 2", report)
+        self.assertIn("induction variable j.4 from 0 step 1", report)
+        ops = [(instruction.op, instruction.extra) for block in program.functions["sum"].blocks
+               for instruction in block.instructions]
+        self.assertNotIn(("binary", "*"), ops)
+        self.assertEqual(IRInterpreter(program).run(), 51)
+
+    def test_bounds_checks_only_go_when_the_loop_condition_proves_them(self):
+        program, loops = self.optimize(["int main(){", "int v[4];", "int i = 0;", "while(i < *v){",
+                                        "v[i] = i * 2;", "i++;", "}", "return v[3];", "}"])
+        self.assertEqual(sum(1 for line in loops.applied if "dropped the bounds check" in line), 1)
+        self.assertEqual(IRInterpreter(program).run(), 6)
+        program, loops = self.optimize(["int main(){", "int v[4];", "int i = 0;", "while(i <= *v){",
+                                        "v[i] = i;", "i++;", "}", "return 0;", "}"])
+        self.assertFalse(any("dropped" in line for line in loops.applied))
+        with self.assertRaisesRegex(Exception, r"Index 4 out of bounds of 'v' \(5:2\)"):
+            IRInterpreter(program).run()
+
+class TestSemanticAnalyzer(unittest.TestCase):
+
+    SOURCE = ["record point { int x; }", "int f(int a; char c){", "return a + 1;", "}", "bool main(){", "int x;",
+              "int v[10];", "bool ok;", "x = f(x, 'a');", "x = f(x);", "v[ok] = x * 2;", "ok = x < 'c';",
+              "if (x) x = 1;", "while (x < 10) { x++; break; }", "break;", "y = 3;", "return x;", "}"]
+
+    ERRORS = ["Function 'f' takes 2 arguments, 1 given (10:6)", "Array index should be 'int' (11:5)",
+              "Operator '<' compares 'int' with 'char' (12:9)", "Condition should be 'bool' (13:6)",
+              "Break outside of a loop (15:6)", "Variable 'y' wasn't declared (16:2)",
+              "Return type should be 'bool' (17:9)"]
+
+    def parse(self, parser_class, mock_code):
+        parser, tree, failure = parse_source(mock_code, parser_class, DFAScanner, syntax_only=True)
+        self.assertEqual((parser.error_list, failure), ([], None))
+        return tree, parser.symbol_table
+
+    def test_collects_errors_of_every_tree_shape(self):
+        for parser_class in [Parser, IterativeParser, PrecedenceParser]:
+            tree, symbol_table = self.parse(parser_class, self.SOURCE)
+            self.assertEqual(SemanticAnalyzer(symbol_table).analyze(tree), self.ERRORS)
+
+    def test_caches_expression_types(self):
+        tree, symbol_table = self.parse(PrecedenceParser, ["int main(){", "int v[3];", "bool b;",
+                                                           "b = v[1] + 2 > *v;", "return 0;", "}"])
+        SemanticAnalyzer(symbol_table).analyze(tree)
+        typed = [(str(node), node.data_type) for node in walk(tree) if getattr(node, "data_type", None)]
+        self.assertEqual(typed, [("SyntaxNodeTypes.EXPRESSION", "bool"), ("SyntaxNodeTypes.MUTABLE 'b'", "bool"),
+                                 ("SyntaxNodeTypes.REL_EXPRESSION '>'", "bool"),
+                                 ("SyntaxNodeTypes.SUM_EXPRESSION '+'", "int"),
+                                 ("SyntaxNodeTypes.MUTABLE", "int"), ("SyntaxNodeTypes.CONSTANT '1'", "int"),
+                                 ("SyntaxNodeTypes.CONSTANT '2'", "int"),
+                                 ("SyntaxNodeTypes.UNARY_EXPRESSION '*'", "int"),
+                                 ("SyntaxNodeTypes.MUTABLE 'v'", "int[]"), ("SyntaxNodeTypes.CONSTANT '0'", "int")])
+
+    def test_worker_pool_gives_serial_result(self):
+        mock_code = self.SOURCE[:4] + [line.replace("main", "main{}".format(copy)) for copy in range(3)
+                                       for line in self.SOURCE[4:]]
+        tree, symbol_table = self.parse(PrecedenceParser, mock_code)
+        serial = SemanticAnalyzer(symbol_table).analyze(tree)
+        types = [getattr(node, "data_type", None) for node in walk(tree)]
+        for node in walk(tree):
+            if getattr(node, "data_type", None) is not None:
+                del node.data_type
+        self.assertEqual(SemanticAnalyzer(symbol_table, workers=2, threshold=0).analyze(tree), serial)
+        self.assertEqual([getattr(node, "data_type", None) for node in walk(tree)], types)
+
 class TestParser(unittest.TestCase):
 
     def get_parser(self, mock_code):
@@ -281,6 +1536,36 @@ class TestParser(unittest.TestCase):
 
         self.assertEqual(parser.error_list, [])
     
+    def test_source_can_end_with_a_function(self):
+        parser = self.get_parser(["int f(){", "return 1;", "}"])
+        parser.parse()
+
+        self.assertEqual(parser.error_list, [])
+
+    def test_can_parse_calls_records_and_logical_operators(self):
+        parser = self.get_parser(["record point { int x; }", "int f(int a; bool b){", "return a;", "}",
+                                  "int main(){", "bool b;", "b = b and not b or -f(1, b) < 2;", "return f(2, b);", "}"])
+        # The inline checks only see the last constant, 2, assigned to b
+        parser.semantic_helpers = SyntaxOnlyHelpers(parser.symbol_table)
+        tree = parser.parse()
+
+        self.assertEqual(parser.error_list, [])
+        calls = [node for node in walk(tree) if node.type == SyntaxNodeTypes.CALL]
+        self.assertEqual([len(node.args.arg_list.list_arg.expression) for node in calls], [1, 1])
+
+    def test_can_parse_parameter_lists(self):
+        parser = self.get_parser(["int f(int a, b; char c; int v[], w[]){", "return a;", "}",
+                                  "int g(int a; bool v[]){", "return a;", "}", "int end;"])
+        tree = parser.parse()
+
+        self.assertEqual(parser.error_list, [])
+        self.assertEqual(len(top_level_declarations(tree)), 3)
+        # Parameters are local to their function, so f and g can both have an a
+        params = [(node.id.value, hasattr(node.id_param, "id_param")) for node in walk(tree)
+                  if node.type == SyntaxNodeTypes.PARAM_ID]
+        self.assertEqual(params, [("a", False), ("b", False), ("c", False), ("v", True), ("w", True), ("a", False),
+                                  ("v", True)])
+
     def test_can_not_parse_invalid_var_declaration(self):
         parser = self.get_parser(["int; x"])
         tree = parser.parse()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sys
+import tempfile
+import zlib
+from array import array
+from language import Token, TokenClass, COMPILER_VERSION
+from tokenbuffer import TOKEN_CLASSES
+
+MAGIC = b"CMTK"
+FORMAT_VERSION = 2
+SUFFIX = ".tok"
+DEFAULT_CACHE_DIR = ".cminus_cache"
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+def write_string(out, text):
+    encoded = text.encode("utf-8")
+    write_varint(out, len(encoded))
+    out += encoded
+
+def read_string(data, position):
+    length, position = read_varint(data, position)
+    end = position + length
+    return data[position:end].decode("utf-8"), end
+
+def pack_array(out, values):
+    # Arrays are stored little endian whatever the machine is
+    if sys.byteorder == "big":
+        values.byteswap()
+    encoded = values.tobytes()
+    write_varint(out, len(encoded))
+    out += encoded
+
+def unpack_array(data, position, typecode):
+    length, position = read_varint(data, position)
+    values = array(typecode)
+    values.frombytes(data[position:position + length])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, position + length
+
+def encode_scan(tokens, error_list):
+    """Serializes a scanner's output.
+
+    Layout: magic, format version (varint) and a zlib stream holding the
+    string table, one array per token field (kind, line, column, string id),
+    the error messages and the indices of the tokens that were registered in
+    the symbol table, in order.
+    """
+    string_ids = {}
+    strings = []
+    kinds = array('B')
+    lines = array('I')
+    columns = array('I')
+    lexemes = array('I')
+    registrations = array('I')
+    id_class = TokenClass.ID
+    for token in tokens:
+        string_id = string_ids.get(token.value)
+        if string_id is None:
+            string_id = string_ids[token.value] = len(strings)
+            strings.append(token.value)
+        # Every scanner registers each id token, in source order
+        if token.token_class == id_class:
+            registrations.append(len(kinds))
+        kinds.append(token.token_class.value)
+        lines.append(token.line)
+        columns.append(token.column)
+        lexemes.append(string_id)
+
+    payload = bytearray()
+    write_varint(payload, len(strings))
+    for text in strings:
+        write_string(payload, text)
+    for values in (kinds, lines, columns, lexemes, registrations):
+        pack_array(payload, values)
+    write_varint(payload, len(error_list))
+    for error in error_list:
+        write_string(payload, error)
+
+    out = bytearray(MAGIC)
+    write_varint(out, FORMAT_VERSION)
+    out += zlib.compress(bytes(payload), 6)
+    return bytes(out)
+
+def decode_scan(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise Exception("Not a token cache file")
+    version, position = read_varint(data, len(MAGIC))
+    if version != FORMAT_VERSION:
+        raise Exception("Unsupported token cache format {}".format(version))
+    data = zlib.decompress(data[position:])
+
+    count, position = read_varint(data, 0)
+    strings = []
+    for _ in range(count):
+        text, position = read_string(data, position)
+        strings.append(text)
+    kinds, position = unpack_array(data, position, 'B')
+    lines, position = unpack_array(data, position, 'I')
+    columns, position = unpack_array(data, position, 'I')
+    lexemes, position = unpack_array(data, position, 'I')
+    registrations, position = unpack_array(data, position, 'I')
+
+    count, position = read_varint(data, position)
+    error_list = []
+    for _ in range(count):
+        error, position = read_string(data, position)
+        error_list.append(error)
+
+    # Token adds one to line and column
+    tokens = [Token(TOKEN_CLASSES[kind], strings[lexeme], line - 1, column - 1)
+              for kind, line, column, lexeme in zip(kinds, lines, columns, lexemes)]
+    return tokens, error_list, list(registrations)
+
+class TokenCache():
+    """On disk cache of scanner output keyed by source content and compiler version.
+
+    Entries are evicted least recently used first once the directory grows
+    past max_bytes; a hit refreshes the entry's modification time.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, source):
+        digest = hashlib.sha256()
+        digest.update(COMPILER_VERSION.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, source, symbol_table):
+        path = self.path(self.key(source))
+        try:
+            with open(path, "rb") as entry:
+                tokens, error_list, registrations = decode_scan(entry.read())
+        except Exception:
+            # Missing, unreadable or corrupted entries are plain misses
+            return None
+        for index in registrations:
+            symbol_table.store(tokens[index])
+        os.utime(path)
+        return tokens, error_list
+
+    def save(self, source, tokens, error_list):
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as entry:
+            entry.write(encode_scan(tokens, error_list))
+        os.replace(temp_path, self.path(self.key(source)))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def scan(self, scanner):
+        """Fills scanner.tokens and error_list from the cache, scanning on a miss.
+
+        Returns True on a cache hit.
+        """
+        source = "".join(scanner.code).encode("utf-8")
+        cached = self.load(source, scanner.symbol_table)
+        if cached is None:
+            scanner.scan()
+            self.save(source, scanner.tokens, scanner.error_list)
+            return False
+
+        scanner.tokens, scanner.error_list = cached
+        for err in scanner.error_list:
+            print(err)
+        return True
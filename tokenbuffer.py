@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from language import TokenClass, InternTable
+from dfa_scanner import DFAScanner
+
+# array code -> TokenClass, codes are the enum values (1-6)
+TOKEN_CLASSES = (None,) + tuple(sorted(TokenClass, key=lambda token_class: token_class.value))
+
+class TokenView():
+    """Lightweight Token look-alike reading its fields from a TokenBuffer."""
+    __slots__ = ("buffer", "index")
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def token_class(self):
+        return TOKEN_CLASSES[self.buffer.kinds[self.index]]
+
+    @property
+    def value(self):
+        return self.buffer.strings[self.buffer.lexemes[self.index]]
+
+    @property
+    def symbol_id(self):
+        return self.buffer.lexemes[self.index]
+
+    @property
+    def line(self):
+        return self.buffer.lines[self.index]
+
+    @property
+    def column(self):
+        return self.buffer.columns[self.index]
+
+    def __str__(self):
+        return "Token '{}' with value '{}' in line: {}, col: {}".format(self.token_class,
+            self.value, self.line, self.column)
+
+    def __repr__(self):
+        return "Token class: {}, Value: {}".format(self.token_class, self.value)
+
+class TokenBuffer():
+    """Struct of arrays token storage.
+
+    Every token costs one entry in each of the four arrays; lexemes are
+    interned, so repeated names and literals are stored only once. When the
+    symbol table's InternTable is passed in, lexeme ids are symbol ids.
+    """
+
+    def __init__(self, names=None):
+        self.kinds = array('B')
+        self.lines = array('I')
+        self.columns = array('I')
+        self.lexemes = array('I')
+        self.names = names if names is not None else InternTable()
+
+    @property
+    def strings(self):
+        return self.names.strings
+
+    def intern(self, value):
+        return self.names.intern(value)
+
+    def add(self, token_class, value, line, column):
+        # line and column are 1 based, as in Token
+        self.kinds.append(token_class.value)
+        self.lines.append(line)
+        self.columns.append(column)
+        self.lexemes.append(self.intern(value))
+        return len(self.kinds) - 1
+
+    def append(self, token):
+        return self.add(token.token_class, token.value, token.line, token.column)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.kinds)
+        if index < 0 or index >= len(self.kinds):
+            raise IndexError("token index out of range")
+        return TokenView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield TokenView(self, index)
+
+    def nbytes(self):
+        # Memory held by the arrays themselves, the string table is not included
+        return sum(buf.itemsize * len(buf) for buf in (self.kinds, self.lines, self.columns, self.lexemes))
+
+class CompactScanner(DFAScanner):
+    """DFAScanner writing straight into a TokenBuffer, no Token objects are kept."""
+
+    def __init__(self, source_code, symbol_table):
+        super().__init__(source_code, symbol_table)
+        self.tokens = TokenBuffer(symbol_table.names)
+
+    def emit(self, token_class, value, line_pos, col):
+        self.tokens.add(token_class, value, line_pos + 1, col + 1)
+
+    def emit_id(self, value, line_pos, col):
+        index = self.tokens.add(TokenClass.ID, value, line_pos + 1, col + 1)
+        self.register_id(TokenView(self.tokens, index))
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+from array import array
+from language import Token, Symbol, SymbolKind, SymbolTable, SyntaxNode, SyntaxNodeTypes, BinaryNode, UnaryNode, LeafNode, \
+    top_level_declarations
+from token_cache import write_varint, read_varint, write_string, read_string, pack_array, unpack_array
+from tokenbuffer import TOKEN_CLASSES
+
+MAGIC = b"CMAS"
+FORMAT_VERSION = 2
+
+# Value tags. A node is TAG_NODE plus its class code (one byte), a bit mask
+# of the fields that are set and then the value of each of those fields.
+TAG_NONE = 0
+TAG_TOKEN = 1
+TAG_LIST = 2
+TAG_DECLARATION = 3
+TAG_NODE = 4
+
+# Node class codes: SyntaxNodeTypes in order, then the compact expression
+# nodes, which are followed by the code of their own type
+NODE_TYPES = list(SyntaxNodeTypes)
+NODE_CLASSES = [SyntaxNode.classes[node_type] for node_type in NODE_TYPES] + [BinaryNode, UnaryNode, LeafNode]
+NODE_CODES = {node_class: code for code, node_class in enumerate(NODE_CLASSES)}
+TYPE_CODES = {node_type: code for code, node_type in enumerate(NODE_TYPES)}
+COMPACT_NODES = (BinaryNode, UnaryNode, LeafNode)
+
+# Node class -> field mask -> names of the fields set in that mask
+FIELD_MASKS = {}
+for node_class in NODE_CLASSES:
+    FIELD_MASKS[node_class] = [tuple(name for bit, name in enumerate(node_class.fields) if mask & (1 << bit))
+                               for mask in range(1 << len(node_class.fields))]
+
+# variable_value holds a token or, after an id to id assignment, a name
+VALUE_NONE = 0
+VALUE_TOKEN = 1
+VALUE_STRING = 2
+
+def read_symbol(data, position):
+    # (scope, kind, data type, array size, token, value kind, value), all but
+    # scope and token stored plus one with zero meaning unset
+    fields = []
+    for _ in range(5):
+        field, position = read_varint(data, position)
+        fields.append(field)
+    value_kind = data[position]
+    position += 1
+    value = None
+    if value_kind != VALUE_NONE:
+        value, position = read_varint(data, position)
+    fields += [value_kind, value]
+    return fields, position
+
+def declaration_name(declaration):
+    for field in ("fun_declaration", "rec_declaration"):
+        node = getattr(declaration, field, None)
+        if node is not None and hasattr(node, "id"):
+            return node.id.value
+    return None
+
+class TreeWriter():
+    """Collects the string and token tables while nodes are written."""
+
+    def __init__(self):
+        self.string_ids = {}
+        self.strings = []
+        self.token_ids = {}
+        self.tokens = []
+
+    def string(self, text):
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def token(self, token):
+        # Keyed by identity, a token shared by the tree and the symbol table stays shared
+        token_id = self.token_ids.get(id(token))
+        if token_id is None:
+            token_id = self.token_ids[id(token)] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def write(self, out, value, references=None):
+        # Pre-order with an explicit stack, trees can be deeper than the recursion limit.
+        # Nodes in `references` (id -> declaration index) are written as that index.
+        references = references or {}
+        pending = [value]
+        while pending:
+            value = pending.pop()
+            if value is None:
+                out.append(TAG_NONE)
+            elif id(value) in references:
+                out.append(TAG_DECLARATION)
+                write_varint(out, references[id(value)])
+            elif isinstance(value, SyntaxNode):
+                node_class = type(value)
+                out.append(TAG_NODE + NODE_CODES[node_class])
+                if node_class in COMPACT_NODES:
+                    # The type isn't implied by the class
+                    out.append(TYPE_CODES[value.type])
+                mask = 0
+                children = []
+                for bit, name in enumerate(node_class.fields):
+                    if hasattr(value, name):
+                        mask |= 1 << bit
+                        children.append(getattr(value, name))
+                out.append(mask)
+                children.reverse()
+                pending.extend(children)
+            elif type(value) is list:
+                out.append(TAG_LIST)
+                write_varint(out, len(value))
+                pending.extend(reversed(value))
+            elif hasattr(value, "token_class"):
+                out.append(TAG_TOKEN)
+                write_varint(out, self.token(value))
+            else:
+                raise Exception("Can't serialize tree value '{}'".format(value))
+
+    def write_symbol_table(self, out, symbol_table):
+        names = symbol_table.names
+        write_varint(out, len(names))
+        for symbol_id in range(len(names)):
+            write_varint(out, self.string(names[symbol_id]))
+        write_varint(out, symbol_table.current_scope)
+        write_varint(out, len(symbol_table.hashtable))
+        for key, tk_list in symbol_table.hashtable.items():
+            write_varint(out, key)
+            write_varint(out, len(tk_list))
+            for symbol in tk_list:
+                self.write_symbol(out, symbol)
+
+    def write_symbol(self, out, symbol):
+        write_varint(out, symbol.scope)
+        write_varint(out, 0 if symbol.kind is None else symbol.kind.value)
+        write_varint(out, 0 if symbol.data_type is None else self.string(symbol.data_type) + 1)
+        write_varint(out, 0 if symbol.array_size is None else symbol.array_size + 1)
+        write_varint(out, self.token(symbol.token))
+        value = symbol.variable_value
+        if value is None:
+            out.append(VALUE_NONE)
+        elif hasattr(value, "token_class"):
+            out.append(VALUE_TOKEN)
+            write_varint(out, self.token(value))
+        else:
+            out.append(VALUE_STRING)
+            write_varint(out, self.string(value))
+
+    def write_tokens(self, out):
+        # Strings grow while tokens are written, so the string table goes after
+        kinds = array('B')
+        lines = array('I')
+        columns = array('I')
+        lexemes = array('I')
+        for token in self.tokens:
+            kinds.append(token.token_class.value)
+            lines.append(token.line)
+            columns.append(token.column)
+            lexemes.append(self.string(token.value))
+        for column in (kinds, lines, columns, lexemes):
+            pack_array(out, column)
+
+def encode_program(tree, symbol_table, error_list):
+    """Serializes a parse: syntax tree, symbol table and syntax errors.
+
+    Layout: magic, format version (varint), header length (varint), zlib
+    compressed header, then one block per top level declaration, left
+    uncompressed so any one of them can be read on its own. The header holds the error
+    messages, the program skeleton (the tree with every top level
+    declaration replaced by its index), each declaration's name and block
+    offset, the symbol table, the token table (one array per field) and
+    last the string table every token and name refers to.
+    """
+    writer = TreeWriter()
+    declarations = top_level_declarations(tree)
+    blocks = bytearray()
+    offsets = []
+    for declaration in declarations:
+        offsets.append(len(blocks))
+        writer.write(blocks, declaration)
+
+    header = bytearray()
+    write_varint(header, len(error_list))
+    for error in error_list:
+        write_string(header, error)
+    writer.write(header, tree, {id(declaration): index for index, declaration in enumerate(declarations)})
+    write_varint(header, len(declarations))
+    for declaration, offset in zip(declarations, offsets):
+        name = declaration_name(declaration)
+        write_varint(header, 0 if name is None else writer.string(name) + 1)
+        write_varint(header, offset)
+    writer.write_symbol_table(header, symbol_table)
+    writer.write_tokens(header)
+    write_varint(header, len(writer.strings))
+    for text in writer.strings:
+        write_string(header, text)
+
+    header = zlib.compress(bytes(header), 6)
+    out = bytearray(MAGIC)
+    write_varint(out, FORMAT_VERSION)
+    write_varint(out, len(header))
+    out += header
+    out += blocks
+    return bytes(out)
+
+class ProgramFile():
+    """Reads what encode_program wrote.
+
+    Only the header is decoded up front; top level declarations are decoded
+    the first time they are asked for, and tokens the first time a decoded
+    node or the symbol table refers to them.
+    """
+
+    def __init__(self, data):
+        if data[:len(MAGIC)] != MAGIC:
+            raise Exception("Not a syntax tree file")
+        version, position = read_varint(data, len(MAGIC))
+        if version != FORMAT_VERSION:
+            raise Exception("Unsupported syntax tree format {}".format(version))
+        header_length, position = read_varint(data, position)
+        self.data = data
+        self.blocks = position + header_length
+        self.header = data = zlib.decompress(data[position:self.blocks])
+
+        count, position = read_varint(data, 0)
+        self.error_list = []
+        for _ in range(count):
+            error, position = read_string(data, position)
+            self.error_list.append(error)
+        # The skeleton refers to tokens and strings, it is decoded on demand too
+        self.skeleton = position
+        position = self.skip(data, position)
+
+        count, position = read_varint(data, position)
+        names = []
+        self.offsets = []
+        for _ in range(count):
+            name, position = read_varint(data, position)
+            names.append(name)
+            offset, position = read_varint(data, position)
+            self.offsets.append(offset)
+        self.declarations = [None] * count
+
+        self.symbol_table_position = position
+        position = self.skip_symbol_table(position)
+        self.kinds, position = unpack_array(data, position, 'B')
+        self.lines, position = unpack_array(data, position, 'I')
+        self.columns, position = unpack_array(data, position, 'I')
+        self.lexemes, position = unpack_array(data, position, 'I')
+        self.tokens = [None] * len(self.kinds)
+
+        count, position = read_varint(data, position)
+        self.strings = []
+        for _ in range(count):
+            text, position = read_string(data, position)
+            self.strings.append(text)
+        self.names = [None if name == 0 else self.strings[name - 1] for name in names]
+        self.symbol_table_cache = None
+
+    def __len__(self):
+        return len(self.declarations)
+
+    def token(self, index):
+        token = self.tokens[index]
+        if token is None:
+            # Token adds one to line and column
+            token = Token(TOKEN_CLASSES[self.kinds[index]], self.strings[self.lexemes[index]],
+                          self.lines[index] - 1, self.columns[index] - 1)
+            self.tokens[index] = token
+        return token
+
+    def declaration(self, index):
+        """Top level declaration `index`, in source order."""
+        declaration = self.declarations[index]
+        if declaration is None:
+            declaration, _ = self.read(self.data, self.blocks + self.offsets[index])
+            self.declarations[index] = declaration
+        return declaration
+
+    def find(self, name):
+        """Top level function or record declaration called `name`, None if there is none."""
+        for index, declaration_name in enumerate(self.names):
+            if declaration_name == name:
+                return self.declaration(index)
+        return None
+
+    def tree(self):
+        """The whole program, every declaration decoded."""
+        tree, _ = self.read(self.header, self.skeleton)
+        return tree
+
+    @property
+    def symbol_table(self):
+        if self.symbol_table_cache is None:
+            self.symbol_table_cache = self.read_symbol_table()
+        return self.symbol_table_cache
+
+    def read_symbol_table(self):
+        data = self.header
+        symbol_table = SymbolTable()
+        count, position = read_varint(data, self.symbol_table_position)
+        for _ in range(count):
+            string_id, position = read_varint(data, position)
+            symbol_table.names.intern(self.strings[string_id])
+        symbol_table.current_scope, position = read_varint(data, position)
+        count, position = read_varint(data, position)
+        for _ in range(count):
+            key, position = read_varint(data, position)
+            length, position = read_varint(data, position)
+            tk_list = []
+            for _ in range(length):
+                fields, position = read_symbol(data, position)
+                scope, kind, data_type, array_size, index, value_kind, value = fields
+                symbol = Symbol(key, scope, SymbolKind(kind) if kind else None,
+                                self.strings[data_type - 1] if data_type else None, self.token(index),
+                                array_size - 1 if array_size else None)
+                if value_kind == VALUE_TOKEN:
+                    symbol.variable_value = self.token(value)
+                elif value_kind == VALUE_STRING:
+                    symbol.variable_value = self.strings[value]
+                tk_list.append(symbol)
+            symbol_table.hashtable[key] = tk_list
+        # Rebuild the undo logs of the scopes that were still open
+        symbol_table.scopes = [[] for _ in range(symbol_table.current_scope + 1)]
+        for key, tk_list in symbol_table.hashtable.items():
+            for symbol in tk_list:
+                if 0 < symbol.scope <= symbol_table.current_scope:
+                    symbol_table.scopes[symbol.scope].append(key)
+        return symbol_table
+
+    def skip_symbol_table(self, position):
+        data = self.header
+        count, position = read_varint(data, position)
+        for _ in range(count):
+            _, position = read_varint(data, position)
+        _, position = read_varint(data, position)
+        count, position = read_varint(data, position)
+        for _ in range(count):
+            _, position = read_varint(data, position)
+            length, position = read_varint(data, position)
+            for _ in range(length):
+                _, position = read_symbol(data, position)
+        return position
+
+    def skip(self, data, position):
+        # Steps over one value without building it
+        remaining = 1
+        while remaining:
+            remaining -= 1
+            tag = data[position]
+            position += 1
+            if tag >= TAG_NODE:
+                if NODE_CLASSES[tag - TAG_NODE] in COMPACT_NODES:
+                    position += 1
+                remaining += bin(data[position]).count("1")
+                position += 1
+            elif tag == TAG_LIST:
+                count, position = read_varint(data, position)
+                remaining += count
+            elif tag != TAG_NONE:
+                _, position = read_varint(data, position)
+        return position
+
+    def read(self, data, position):
+        # Frames are [node, names of its set fields, next field] or [list, None, length]
+        frames = []
+        while True:
+            tag = data[position]
+            position += 1
+            if tag >= TAG_NODE:
+                node_class = NODE_CLASSES[tag - TAG_NODE]
+                node = object.__new__(node_class)
+                if node_class in COMPACT_NODES:
+                    node.type = NODE_TYPES[data[position]]
+                    position += 1
+                mask = data[position]
+                position += 1
+                if mask:
+                    frames.append([node, FIELD_MASKS[node_class][mask], 0])
+                    continue
+                value = node
+            elif tag == TAG_TOKEN:
+                index, position = read_varint(data, position)
+                value = self.tokens[index] or self.token(index)
+            elif tag == TAG_NONE:
+                value = None
+            elif tag == TAG_LIST:
+                count, position = read_varint(data, position)
+                if count:
+                    frames.append([[], None, count])
+                    continue
+                value = []
+            elif tag == TAG_DECLARATION:
+                index, position = read_varint(data, position)
+                value = self.declaration(index)
+            else:
+                raise Exception("Corrupted syntax tree file, unknown tag {}".format(tag))
+
+            # Hand the value to its parent, finishing every frame that is now full
+            while frames:
+                frame = frames[-1]
+                target, names, index = frame
+                if names is None:
+                    target.append(value)
+                    if len(target) < index:
+                        break
+                else:
+                    setattr(target, names[index], value)
+                    index += 1
+                    if index < len(names):
+                        frame[2] = index
+                        break
+                frames.pop()
+                value = target
+            else:
+                return value, position
+
+def save_program(path, tree, symbol_table, error_list):
+    with open(path, "wb") as output:
+        output.write(encode_program(tree, symbol_table, error_list))
+
+def load_program(path):
+    with open(path, "rb") as source:
+        return ProgramFile(source.read())